@@ -0,0 +1,128 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+# Weight of the latest call in the moving average of the time a slot is held
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """A request shed before calling an LLM backend, with the seconds after which a retry may succeed"""
+
+    def __init__(self, backend: str, reason: str, retry_after: float):
+        super().__init__(f"{backend} backend is overloaded: {reason.replace('_', ' ')}")
+        self.backend = backend
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency limit of one LLM backend, with a bounded wait queue and per-request deadlines.
+
+    At most `max_concurrency` requests hold a slot at once; the next `max_queue` wait for one
+    in arrival order, and a freed slot is handed straight to the oldest waiter. A request is
+    rejected without waiting when the queue is full, or when its wait, estimated from its
+    place in the queue and the average time a slot is held, plus one average call would end
+    past its deadline. A request still waiting once its answer could no longer be in time
+    gives up its place, and no request waits longer than `max_wait` seconds for a slot.
+    """
+
+    def __init__(self, backend: str, max_concurrency: int, max_queue: int, max_wait: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.backend = backend
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.clock = clock
+        self.service_time: Optional[float] = None
+        self._active = 0
+        self._waiters = deque()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def estimated_wait(self, position: int) -> float:
+        """Seconds until the request at `position` in the queue (1 is next) gets a slot"""
+        if position <= 0 or self.service_time is None:
+            return 0.0
+        return math.ceil(position / self.max_concurrency) * self.service_time
+
+    def retry_after(self) -> int:
+        """Whole seconds until a newly queued request would get a slot, at least 1"""
+        return max(1, math.ceil(self.estimated_wait(len(self._waiters) + 1)))
+
+    def _has_free_slot(self) -> bool:
+        return self._active < self.max_concurrency and not self._waiters
+
+    def check(self, deadline: Optional[float] = None) -> float:
+        """Raise AdmissionRejected if a request arriving now would be shed, else return when its wait must end.
+
+        `deadline` is the time of the clock by which the caller needs the backend's answer.
+        """
+        now = self.clock()
+        wait_until = now + self.max_wait
+        if deadline is not None:
+            wait_until = min(wait_until, deadline - (self.service_time or 0.0))
+        if self._has_free_slot():
+            wait = 0.0
+        elif len(self._waiters) >= self.max_queue:
+            raise AdmissionRejected(self.backend, "queue_full", self.retry_after())
+        else:
+            wait = self.estimated_wait(len(self._waiters) + 1)
+        if now + wait > wait_until:
+            raise AdmissionRejected(self.backend, "deadline", self.retry_after())
+        return wait_until
+
+    async def acquire(self, deadline: Optional[float] = None) -> None:
+        """Take a slot, waiting in the queue for as long as the answer can still be in time for `deadline`"""
+        wait_until = self.check(deadline)
+        if self._has_free_slot():
+            self._active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, wait_until - self.clock())
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the wait ended
+                if isinstance(e, asyncio.TimeoutError):
+                    return
+                self.release()
+                raise
+            if future in self._waiters:
+                self._waiters.remove(future)
+            if isinstance(e, asyncio.TimeoutError):
+                raise AdmissionRejected(self.backend, "deadline", self.retry_after()) from None
+            raise
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        """Free a slot, handing it to the oldest waiter, and record how long it was held"""
+        if service_time is not None:
+            self.service_time = service_time if self.service_time is None else (
+                SERVICE_TIME_SMOOTHING * service_time + (1 - SERVICE_TIME_SMOOTHING) * self.service_time
+            )
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, deadline: Optional[float] = None):
+        """Hold a slot for the duration of the block"""
+        await self.acquire(deadline)
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.release(self.clock() - start)
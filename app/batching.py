@@ -0,0 +1,86 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, NamedTuple
+
+
+class _Request(NamedTuple):
+    prompt: str
+    key: tuple
+    kwargs: dict
+    future: Future
+
+
+class MicroBatcher:
+    """Collects concurrent generation requests and runs them through the pipeline in batches.
+
+    A worker thread waits for the first queued prompt, then keeps collecting until the batch
+    holds `max_batch_size` prompts or `max_wait` seconds have passed, and runs each group of
+    prompts with identical generation parameters as one padded pipeline call. Every caller
+    blocks on its own future and receives the output for its prompt only. With
+    `max_batch_size` of 1 prompts are generated directly in the calling thread.
+    """
+
+    def __init__(self, generate: Callable, max_batch_size: int = 8, max_wait: float = 0.01):
+        self.generate = generate
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, prompt: str, **kwargs):
+        """Generate for one prompt, batched with concurrent callers. Blocks until the output is ready."""
+        if self.max_batch_size <= 1:
+            return self.generate(prompt, **kwargs)
+
+        self._ensure_worker()
+        future = Future()
+        self._queue.put(_Request(prompt, tuple(sorted(kwargs.items())), kwargs, future))
+        return future.result()
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name="local-llm-batcher", daemon=True)
+                    self._worker.start()
+
+    def _collect(self) -> List[_Request]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            groups = {}
+            for request in self._collect():
+                groups.setdefault(request.key, []).append(request)
+            for requests in groups.values():
+                self._flush(requests)
+
+    def _flush(self, requests: List[_Request]):
+        kwargs = requests[0].kwargs
+        try:
+            if len(requests) == 1:
+                outputs = [self.generate(requests[0].prompt, **kwargs)]
+            else:
+                outputs = self.generate([r.prompt for r in requests], batch_size=len(requests), **kwargs)
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        for request, output in zip(requests, outputs):
+            request.future.set_result(output)
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, NamedTuple, Optional
+
+import numpy as np
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Whitespace-insensitive form of a prompt used in cache keys.
+
+    Case is kept: the LLM sees the prompt as written, and its answer may differ by case.
+    """
+    return " ".join(prompt.split())
+
+
+class _Entry(NamedTuple):
+    value: Any
+    expires: float
+    namespace: Hashable
+    embedding: Optional[np.ndarray]
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with a time-to-live for sanitized LLM responses.
+
+    Entries are keyed by a namespace (model, generation parameters and policy) and the normalized
+    prompt. With `embed` and `semantic_threshold` set, a lookup that misses on the exact key
+    falls back to the cached prompt of the same namespace whose embedding has the highest
+    cosine similarity, if it reaches the threshold. `embed` must return L2-normalized vectors.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0,
+                 embed: Callable[[str], np.ndarray] = None, semantic_threshold: float = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.embed = embed
+        self.semantic_threshold = semantic_threshold
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def semantic(self) -> bool:
+        return self.embed is not None and bool(self.semantic_threshold)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict_expired(self, now: float) -> None:
+        for key in [key for key, entry in self._entries.items() if entry.expires <= now]:
+            del self._entries[key]
+
+    def get(self, namespace: Hashable, prompt: str) -> Optional[Any]:
+        """Return the cached value for a prompt, or None"""
+        if self.maxsize <= 0:
+            return None
+        key = (namespace, normalize_prompt(prompt))
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.value
+            if entry is not None:
+                del self._entries[key]
+
+        if self.semantic:
+            value = self._get_semantic(namespace, key[1], now)
+            if value is not None:
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _get_semantic(self, namespace: Hashable, prompt: str, now: float) -> Optional[Any]:
+        with self._lock:
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry.namespace == namespace and entry.embedding is not None and entry.expires > now
+            ]
+        if not candidates:
+            return None
+
+        scores = np.stack([entry.embedding for _, entry in candidates]) @ self.embed(prompt)
+        best = int(np.argmax(scores))
+        if scores[best] < self.semantic_threshold:
+            return None
+
+        key, entry = candidates[best]
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.semantic_hits += 1
+        return entry.value
+
+    def put(self, namespace: Hashable, prompt: str, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        normalized = normalize_prompt(prompt)
+        embedding = self.embed(normalized) if self.semantic else None
+        now = self.clock()
+        with self._lock:
+            key = (namespace, normalized)
+            self._entries[key] = _Entry(value, now + self.ttl, namespace, embedding)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._evict_expired(now)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.semantic_hits = self.misses = 0
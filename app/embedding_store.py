@@ -0,0 +1,166 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Rows appended since the last full index rebuild are looked up in a dict until they exceed this
+# many (or an eighth of the indexed rows), then the sorted index is rebuilt
+RECENT_ROWS_LIMIT = 4096
+
+
+class EmbeddingStoreMismatch(Exception):
+    """The embedding store was written by another model or with another embedding width"""
+
+
+def prompt_key(prompt: str) -> int:
+    """64-bit BLAKE2 hash of a prompt, the key of its row"""
+    return int.from_bytes(hashlib.blake2b(prompt.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little")
+
+
+class EmbeddingStore:
+    """Append-only on-disk store of prompt embeddings, shared by every worker on a host.
+
+    Embeddings are fixed-width float32 rows in vectors.f32, read through a read-only
+    numpy.memmap, so all workers share one copy in the page cache and the store is warm after
+    a restart. keys.u64 holds the 64-bit prompt hash of each row at the same position; a
+    sorted copy of it, searched with np.searchsorted, is the in-memory hash-to-row index.
+
+    Appends take an exclusive lock on keys.u64 and write the vectors before their keys, so a
+    row becomes visible only once it is complete and a partial write left by a crashed writer
+    is overwritten by the next append. Rows appended by other processes are picked up when a
+    lookup misses. meta.json records the model and embedding width the store was written with.
+    """
+
+    def __init__(self, path: str, model: str = ""):
+        self.path = path
+        self.model = model
+        os.makedirs(path, exist_ok=True)
+        self._meta_path = os.path.join(path, "meta.json")
+        self.dim = self._read_meta()
+        self._keys_file = self._open(os.path.join(path, "keys.u64"))
+        self._vectors_file = self._open(os.path.join(path, "vectors.f32"))
+        self._vectors = None
+        self._rows = 0
+        self._sorted_keys = np.empty(0, dtype=np.uint64)
+        self._sorted_rows = np.empty(0, dtype=np.int64)
+        self._recent: Dict[int, int] = {}
+        self._indexed = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self._refresh()
+
+    def __len__(self):
+        return self._indexed
+
+    @staticmethod
+    def _open(path: str):
+        return os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+
+    def _read_meta(self) -> Optional[int]:
+        if not os.path.exists(self._meta_path):
+            return None
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+        if meta["model"] != self.model:
+            raise EmbeddingStoreMismatch(f"Embedding store {self.path} was written by model {meta['model']!r}, not {self.model!r}")
+        return meta["dim"]
+
+    def _write_meta(self, dim: int) -> None:
+        # Called with the file lock held; another process may have written it first
+        existing = self._read_meta()
+        if existing is None:
+            temporary = self._meta_path + f".{os.getpid()}"
+            with open(temporary, "w") as f:
+                json.dump({"model": self.model, "dim": dim}, f)
+            os.replace(temporary, self._meta_path)
+            existing = dim
+        self.dim = existing
+
+    def _file_rows(self) -> int:
+        if self.dim is None:
+            return 0
+        keys = os.fstat(self._keys_file.fileno()).st_size // 8
+        vectors = os.fstat(self._vectors_file.fileno()).st_size // (4 * self.dim)
+        return min(keys, vectors)
+
+    def _refresh(self) -> None:
+        """Map rows appended since the last refresh and add them to the index"""
+        if self.dim is None:
+            self.dim = self._read_meta()
+        rows = self._file_rows()
+        if rows <= self._indexed:
+            return
+        keys = np.memmap(self._keys_file, dtype=np.uint64, mode="r", shape=(rows,))
+        self._vectors = np.memmap(self._vectors_file, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        self._rows = rows
+        if rows - self._indexed + len(self._recent) > max(RECENT_ROWS_LIMIT, len(self._sorted_keys) // 8):
+            self._sorted_rows = np.argsort(keys, kind="stable")
+            self._sorted_keys = np.asarray(keys[self._sorted_rows])
+            self._recent.clear()
+        else:
+            for row, key in enumerate(keys[self._indexed:rows].tolist(), self._indexed):
+                self._recent.setdefault(key, row)
+        self._indexed = rows
+
+    def _find(self, key: int) -> Optional[int]:
+        row = self._recent.get(key)
+        if row is not None:
+            return row
+        i = int(np.searchsorted(self._sorted_keys, np.uint64(key)))
+        if i < len(self._sorted_keys) and self._sorted_keys[i] == key:
+            return int(self._sorted_rows[i])
+        return None
+
+    def get(self, prompt: str) -> Optional[np.ndarray]:
+        """Return the stored embedding of a prompt as a read-only view of the file, or None"""
+        key = prompt_key(prompt)
+        with self._lock:
+            row = self._find(key)
+            if row is None:
+                self._refresh()
+                row = self._find(key)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._vectors[row]
+
+    def put_many(self, prompts: List[str], embeddings) -> int:
+        """Append the embeddings of prompts not stored yet and return how many were written"""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if not len(prompts):
+            return 0
+        with self._lock:
+            fcntl.flock(self._keys_file, fcntl.LOCK_EX)
+            try:
+                if self.dim is None:
+                    self._write_meta(embeddings.shape[1])
+                if embeddings.shape[1] != self.dim:
+                    raise EmbeddingStoreMismatch(f"Embedding width {embeddings.shape[1]} does not match the store width {self.dim}")
+                self._refresh()
+                new, keys = [], {}
+                for i, prompt in enumerate(prompts):
+                    key = prompt_key(prompt)
+                    if self._find(key) is None and key not in keys:
+                        new.append(i)
+                        keys[key] = i
+                if not new:
+                    return 0
+                row = os.fstat(self._keys_file.fileno()).st_size // 8
+                os.pwrite(self._vectors_file.fileno(), embeddings[new].tobytes(), row * 4 * self.dim)
+                os.pwrite(self._keys_file.fileno(), np.fromiter(keys, dtype=np.uint64, count=len(keys)).tobytes(), row * 8)
+                self._refresh()
+                return len(new)
+            finally:
+                fcntl.flock(self._keys_file, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        with self._lock:
+            self._vectors = None
+            self._keys_file.close()
+            self._vectors_file.close()
@@ -1,34 +1,378 @@
+import httpx
 import openai
 import os
+import threading
+from typing import AsyncIterator, Iterator, NamedTuple
 from dotenv import load_dotenv
+from app.batching import MicroBatcher
+from app.sanitize import StreamSanitizer
 
 load_dotenv()
 
-from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
+MODEL_NAME = "tiiuae/falcon-rw-1b"
 
-MODEL_NAME = "tiiuae/falcon-rw-1b"  
+# Start loading the local model in the background when the service starts
+LOCAL_MODEL_PRELOAD = os.getenv("LOCAL_MODEL_PRELOAD", "true").lower() == "true"
+# Prompt for one short generation that primes the model after loading (empty to disable)
+LOCAL_MODEL_WARMUP_PROMPT = os.getenv("LOCAL_MODEL_WARMUP_PROMPT", "Hello")
+LOCAL_MODEL_WARMUP_TOKENS = int(os.getenv("LOCAL_MODEL_WARMUP_TOKENS", "8"))
 
-# Load model and tokenizer
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForCausalLM.from_pretrained(MODEL_NAME)
+# Generation parameters of the local model; a temperature of 0 decodes greedily
+LOCAL_MAX_NEW_TOKENS = int(os.getenv("LOCAL_MAX_NEW_TOKENS", "100"))
+LOCAL_TEMPERATURE = float(os.getenv("LOCAL_TEMPERATURE", "0.7"))
+LOCAL_GENERATION_KWARGS = (
+    {"max_new_tokens": LOCAL_MAX_NEW_TOKENS, "do_sample": True, "temperature": LOCAL_TEMPERATURE}
+    if LOCAL_TEMPERATURE > 0
+    else {"max_new_tokens": LOCAL_MAX_NEW_TOKENS, "do_sample": False}
+)
 
-# Load text generation pipeline
-generator = pipeline("text-generation", model=model, tokenizer=tokenizer)
+
+class InferenceProfile(NamedTuple):
+    """CPU inference settings of the local model"""
+    # Dynamic int8 quantization of the linear layers
+    quantize: bool = False
+    # Run generation under torch.inference_mode instead of torch.no_grad
+    inference_mode: bool = True
+    # torch intra-op and inter-op thread counts; 0 keeps the torch default
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+
+
+LOCAL_INFERENCE_PROFILE = InferenceProfile(
+    quantize=os.getenv("LOCAL_QUANTIZE", "false").lower() == "true",
+    inference_mode=os.getenv("LOCAL_INFERENCE_MODE", "true").lower() == "true",
+    intra_op_threads=int(os.getenv("LOCAL_INTRA_OP_THREADS", "0")),
+    inter_op_threads=int(os.getenv("LOCAL_INTER_OP_THREADS", "0"))
+)
+
+# Stop local generations early once output moderation is certain to reject them
+LOCAL_MODERATION_STOPPING = os.getenv("LOCAL_MODERATION_STOPPING", "true").lower() == "true"
+
+# Micro-batching of concurrent local generations (a batch size of 1 disables batching)
+LOCAL_LLM_MAX_BATCH_SIZE = int(os.getenv("LOCAL_LLM_MAX_BATCH_SIZE", "8"))
+LOCAL_LLM_MAX_WAIT_MS = float(os.getenv("LOCAL_LLM_MAX_WAIT_MS", "10"))
+
+# Connection pool and timeouts of the shared async OpenAI client
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "100"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+
+def quantize_linear_layers(model):
+    """Dynamic int8 quantization of every linear layer of a model.
+
+    quantize_dynamic only swaps modules whose type is exactly nn.Linear, so subclasses with
+    the same computation (such as FalconLinear) are first replaced by plain nn.Linear
+    modules sharing their weights.
+    """
+    import torch
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+                linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None, device="meta")
+                linear.weight, linear.bias = child.weight, child.bias
+                setattr(parent, name, linear)
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+# Whether the inference profile's torch thread counts were applied. They are process-wide, and
+# torch refuses to set inter-op threads a second time, so a retried load must not set them again
+_torch_threads_set = False
+
+
+class LocalModelManager:
+    """Loads the local text generation pipeline once, on first use or in a background thread.
+
+    Calling the manager generates text like the transformers pipeline, loading the model
+    first if needed. `state` is one of "not_loaded", "loading", "ready" or "failed". The
+    inference profile is applied when the model is loaded.
+    """
+
+    def __init__(self, model_name: str, warmup_prompt: str = "", warmup_tokens: int = 8,
+                 profile: InferenceProfile = InferenceProfile()):
+        self.model_name = model_name
+        self.warmup_prompt = warmup_prompt
+        self.warmup_tokens = warmup_tokens
+        self.profile = profile
+        self.state = "not_loaded"
+        self.error = None
+        self._pipeline = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def _load_pipeline(self):
+        import torch
+        from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
+
+        # Thread counts are process-wide; inter-op threads must be set before any parallel work
+        global _torch_threads_set
+        if not _torch_threads_set:
+            if self.profile.intra_op_threads:
+                torch.set_num_threads(self.profile.intra_op_threads)
+            if self.profile.inter_op_threads:
+                torch.set_num_interop_threads(self.profile.inter_op_threads)
+            _torch_threads_set = True
+
+        # Load model and tokenizer, padding on the left so batched prompts can be generated together
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = "left"
+        model = AutoModelForCausalLM.from_pretrained(self.model_name)
+        if self.profile.quantize:
+            model = quantize_linear_layers(model)
+
+        # Load text generation pipeline
+        generator = pipeline("text-generation", model=model, tokenizer=tokenizer)
+        if self.profile.inference_mode:
+            # The pipeline runs the model under the context it returns (torch.no_grad by default)
+            generator.get_inference_context = lambda: torch.inference_mode
+        return generator
+
+    def load(self):
+        """Load and warm up the pipeline if it is not loaded yet, and return it"""
+        with self._lock:
+            if self._pipeline is not None:
+                return self._pipeline
+            self.state = "loading"
+            try:
+                generator = self._load_pipeline()
+                if self.warmup_prompt:
+                    generator(self.warmup_prompt, max_new_tokens=self.warmup_tokens, do_sample=False)
+            except Exception as e:
+                self.state, self.error = "failed", str(e)
+                raise
+            self._pipeline = generator
+            self.state, self.error = "ready", None
+            return generator
+
+    def start_background_load(self) -> threading.Thread:
+        """Load the pipeline in a daemon thread so startup is not blocked"""
+        def run():
+            try:
+                self.load()
+            except Exception:
+                pass  # Reported through state and error
+
+        thread = threading.Thread(target=run, name="local-model-loader", daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def tokenizer(self):
+        """Tokenizer of the pipeline, loading the model first if needed"""
+        return (self._pipeline or self.load()).tokenizer
+
+    def status(self) -> dict:
+        status = {"model": self.model_name, "state": self.state}
+        if self.error:
+            status["error"] = self.error
+        return status
+
+    def __call__(self, *args, **kwargs):
+        generator = self._pipeline or self.load()
+        return generator(*args, **kwargs)
+
+
+class ModerationStoppingCriteria:
+    """Generation stopping criterion that moderates every sequence while it is decoded.
+
+    Each step decodes the new text of every row and feeds it to a StreamSanitizer, which
+    updates the output risk incrementally. A row is stopped as soon as its output would be
+    rejected by output moderation however the remaining tokens turn out, assuming each
+    generated token starts at most one new word. The decoded text includes the prompt, like
+    the pipeline output. Use a new instance for every generate call.
+    """
+
+    def __init__(self, tokenizer, max_new_tokens: int):
+        self.tokenizer = tokenizer
+        self.max_new_tokens = max_new_tokens
+        self.prompt_length = None
+        self.stopped = set()
+        self._sanitizers = {}
+        self._decoded = {}
+
+    def _should_stop(self, row: int, ids, remaining: int) -> bool:
+        text = self.tokenizer.decode(ids, skip_special_tokens=True)
+        previous = self._decoded.get(row, "")
+        sanitizer = self._sanitizers.setdefault(row, StreamSanitizer())
+        # Decoding can revise the last characters (e.g. partial UTF-8); wait until it settles
+        if text.startswith(previous):
+            sanitizer.feed(text[len(previous):])
+            self._decoded[row] = text
+        return sanitizer.certain_rejection(remaining)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        # Called after every generated token, so the first call sees one new token
+        if self.prompt_length is None:
+            self.prompt_length = input_ids.shape[1] - 1
+        remaining = max(self.max_new_tokens - (input_ids.shape[1] - self.prompt_length), 0)
+        for row, ids in enumerate(input_ids):
+            if row not in self.stopped and self._should_stop(row, ids, remaining):
+                self.stopped.add(row)
+        done = [row in self.stopped for row in range(input_ids.shape[0])]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class EventStoppingCriteria:
+    """Generation stopping criterion that stops every sequence once `event` is set.
+
+    Lets another thread end a generation at the next token, e.g. when the client of a
+    streamed response has gone away.
+    """
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+def moderated_generate(prompts, **kwargs):
+    """Generate with the local model, stopping sequences that output moderation will reject"""
+    if LOCAL_MODERATION_STOPPING and "max_new_tokens" in kwargs:
+        # generate() merges a plain list of criteria into its StoppingCriteriaList
+        kwargs["stopping_criteria"] = list(kwargs.get("stopping_criteria", [])) + [
+            ModerationStoppingCriteria(generator.tokenizer, kwargs["max_new_tokens"])
+        ]
+    return generator(prompts, **kwargs)
+
+
+local_model = LocalModelManager(MODEL_NAME, LOCAL_MODEL_WARMUP_PROMPT, LOCAL_MODEL_WARMUP_TOKENS, LOCAL_INFERENCE_PROFILE)
+
+# Text generation callable, loads the local model on first use
+generator = local_model
+
+# Batches concurrent local generations; looks up generator at call time
+local_batcher = MicroBatcher(
+    lambda prompts, **kwargs: moderated_generate(prompts, **kwargs),
+    max_batch_size=LOCAL_LLM_MAX_BATCH_SIZE,
+    max_wait=LOCAL_LLM_MAX_WAIT_MS / 1000
+)
 
 def get_llm_response(prompt: str) -> str:
-    client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))  
-    
+    client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+
     try:
         response = client.chat.completions.create(
             model=os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'),
             messages=[{"role": "user", "content": prompt}]
         )
         return response.choices[0].message.content
-        
-    except Exception as e: 
+
+    except Exception as e:
         raise RuntimeError(f"LLM request failed: {str(e)}")
 
+_async_client = None
+
+def get_async_openai_client() -> openai.AsyncOpenAI:
+    """Return the long-lived async OpenAI client, creating it on first use"""
+    global _async_client
+    if _async_client is None:
+        timeout = httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+        _async_client = openai.AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            timeout=timeout,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=httpx.AsyncClient(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=OPENAI_POOL_SIZE, max_keepalive_connections=OPENAI_POOL_SIZE)
+            )
+        )
+    return _async_client
+
+async def close_async_openai_client():
+    """Close the shared async OpenAI client and its connection pool"""
+    global _async_client
+    if _async_client is not None:
+        client, _async_client = _async_client, None
+        await client.close()
+
+async def get_llm_response_async(prompt: str) -> str:
+    try:
+        client = get_async_openai_client()
+        response = await client.chat.completions.create(
+            model=os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'),
+            messages=[{"role": "user", "content": prompt}]
+        )
+        return response.choices[0].message.content
+
+    except Exception as e:
+        raise RuntimeError(f"LLM request failed: {str(e)}")
+
+async def stream_llm_response_async(prompt: str) -> AsyncIterator[str]:
+    """Yield the OpenAI response to a prompt in chunks as they are generated"""
+    try:
+        client = get_async_openai_client()
+        stream = await client.chat.completions.create(
+            model=os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'),
+            messages=[{"role": "user", "content": prompt}],
+            stream=True
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Closed early, e.g. output rejected or client gone: end the HTTP stream
+            await stream.close()
+
+    except Exception as e:
+        raise RuntimeError(f"LLM request failed: {str(e)}")
+
+def stream_local_llm_response(prompt: str) -> Iterator[str]:
+    """Yield the local model output in chunks as tokens are decoded.
+
+    Generation runs in its own thread outside the micro-batcher; like get_local_llm_response
+    the output starts with the prompt. Closing the iterator early stops the generation at
+    the next token.
+    """
+    from transformers import TextIteratorStreamer
+
+    try:
+        # Loading and warming up the model on first use can fail like generation does
+        tokenizer = local_model.load().tokenizer
+    except Exception as e:
+        raise RuntimeError(f"LLM request failed: {str(e)}")
+    streamer = TextIteratorStreamer(tokenizer, skip_special_tokens=True)
+    stop = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            moderated_generate(
+                prompt, streamer=streamer, stopping_criteria=[EventStoppingCriteria(stop)], **LOCAL_GENERATION_KWARGS
+            )
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    thread = threading.Thread(target=run, name="local-llm-stream", daemon=True)
+    thread.start()
+    try:
+        yield from streamer
+    finally:
+        stop.set()
+    thread.join()
+    if errors:
+        raise RuntimeError(f"LLM request failed: {str(errors[0])}")
+
 def get_local_llm_response(prompt: str) -> str:
     # Get local llm model response
-    response = generator(prompt, max_new_tokens=100, do_sample=True, temperature=0.7)
-    return response[0]['generated_text']
\ No newline at end of file
+    response = local_batcher.submit(prompt, **LOCAL_GENERATION_KWARGS)
+    return response[0]['generated_text']
+
+def generation_params(llm_model: str) -> tuple:
+    """Model and generation parameters that determine a response, used in response cache keys"""
+    if llm_model == 'openai':
+        return ('openai', os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo'))
+    return ('local_llm', MODEL_NAME) + tuple(sorted(LOCAL_GENERATION_KWARGS.items()))
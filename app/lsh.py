@@ -0,0 +1,133 @@
+import json
+import threading
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.similarity import jaccard_tokens
+
+# Mersenne prime and hash range used by the MinHash permutations
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def lsh_params(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """Pick (bands, rows) with bands * rows == num_perm whose S-curve midpoint is closest to the threshold"""
+    candidates = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(candidates, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - threshold))
+
+
+class MinHash:
+    """MinHash signatures over the Jaccard token sets of prompts"""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        self.num_perm = num_perm
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Return the uint32 signature of a text, or None if it has no tokens"""
+        tokens = set(jaccard_tokens(text))
+        if not tokens:
+            return None
+        hashes = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in tokens), dtype=np.uint64, count=len(tokens))
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class LSHIndex:
+    """Near-duplicate prompt index: MinHash signatures bucketed by LSH bands.
+
+    Signatures are kept in one growable uint32 array. A query only compares the prompts that
+    share at least one band bucket with it, so lookups stay sub-linear in the index size, and
+    returns their estimated Jaccard similarity (the fraction of equal signature positions).
+    """
+
+    def __init__(self, threshold: float = 0.5, num_perm: int = 128, seed: int = 1):
+        self.threshold = threshold
+        self.minhash = MinHash(num_perm, seed)
+        self.bands, self.rows = lsh_params(num_perm, threshold)
+        self.keys: List[str] = []
+        self._key_ids = {}
+        self._signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._buckets = [dict() for _ in range(self.bands)]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._key_ids
+
+    def _band_keys(self, signature: np.ndarray) -> Iterable[bytes]:
+        for band in range(self.bands):
+            yield signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _insert(self, key: str, signature: np.ndarray) -> None:
+        row = len(self.keys)
+        if row == len(self._signatures):
+            grown = np.empty((max(16, 2 * row), self.minhash.num_perm), dtype=np.uint32)
+            grown[:row] = self._signatures[:row]
+            self._signatures = grown
+        self._signatures[row] = signature
+        self.keys.append(key)
+        self._key_ids[key] = row
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(band_key, []).append(row)
+
+    def add(self, key: str, text: str) -> bool:
+        """Add a prompt under a unique key. Returns False if the text has no tokens."""
+        signature = self.minhash.signature(text)
+        if signature is None:
+            return False
+        with self._lock:
+            if key in self._key_ids:
+                raise ValueError(f"Key already indexed: {key}")
+            self._insert(key, signature)
+        return True
+
+    def query(self, text: str, threshold: float = None, limit: int = 10) -> List[Tuple[str, float]]:
+        """Return up to `limit` (key, estimated Jaccard) pairs at or above the threshold, best first"""
+        threshold = self.threshold if threshold is None else threshold
+        signature = self.minhash.signature(text)
+        if signature is None:
+            return []
+
+        candidates = set()
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band_key, ()))
+        if not candidates:
+            return []
+
+        rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        scores = (self._signatures[rows] == signature).mean(axis=1)
+        keep = scores >= threshold
+        rows, scores = rows[keep], scores[keep]
+        order = np.argsort(-scores, kind="stable")[:limit]
+        return [(self.keys[rows[i]], float(scores[i])) for i in order]
+
+    def save(self, path: str) -> None:
+        """Write the index to a .npz file"""
+        with self._lock:
+            params = {"threshold": self.threshold, "num_perm": self.minhash.num_perm, "seed": self.minhash.seed}
+            np.savez(
+                path,
+                signatures=self._signatures[:len(self.keys)],
+                keys=np.array(json.dumps(self.keys)),
+                params=np.array(json.dumps(params)),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "LSHIndex":
+        """Load an index written by save(); band buckets are rebuilt from the signatures"""
+        with np.load(path) as data:
+            params = json.loads(str(data["params"]))
+            index = cls(**params)
+            signatures = data["signatures"]
+            index._signatures = np.empty_like(signatures)
+            for key, signature in zip(json.loads(str(data["keys"])), signatures):
+                index._insert(key, signature)
+        return index
@@ -1,21 +1,125 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
-from app.similarity import cosine_similarity_tfidf, jaccard_similarity
-from app.sanitize import sanitize_input_prompt, sanitize_output_response
-from app.llm import get_llm_response, get_local_llm_response
-from fastapi.responses import JSONResponse
-from typing import Literal
+from app.similarity import (
+    cosine_similarity_score, jaccard_similarity,
+    cosine_similarity_score_batch, jaccard_similarity_batch,
+    semantic_similarity, semantic_similarity_batch, embed_prompts, similarity_precheck, similarity_error, get_embedding_store
+)
+from app.sanitize import (
+    sanitize_input_prompt, sanitize_input_prompts, sanitize_output_response, StreamSanitizer, policy_version,
+    index_text
+)
+from app.llm import (
+    get_llm_response_async, get_local_llm_response, close_async_openai_client,
+    stream_llm_response_async, stream_local_llm_response, generation_params, local_model, local_batcher,
+    LOCAL_MODEL_PRELOAD, LOCAL_LLM_MAX_BATCH_SIZE, OPENAI_POOL_SIZE
+)
+from app.admission import AdmissionController, AdmissionRejected
+from app.embedding_store import EmbeddingStoreMismatch
+from app.cache import ResponseCache
+from app.lsh import LSHIndex
+from app.reference import ReferenceIndex
+from app.shared_index import SharedIndex
+from app.workers import run_cpu, start_process_pool, shutdown_process_pool
+from app.timing import StageTimer
+from app.profiling import profiling, profile_call, profiling_requested, PROFILE_ID_HEADER
+from app.metrics import registry, observe_stage, count_rejection, count_shed, queued_requests, InFlightMiddleware, CONTENT_TYPE
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from contextlib import aclosing, asynccontextmanager
+import asyncio
+import json
+import math
+import time
+from typing import AsyncIterator, List, Literal, Optional
+import os
 
-app = FastAPI(title="PromptGuard", version="1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the local model in the background so liveness is reported immediately
+    if LOCAL_MODEL_PRELOAD:
+        local_model.start_background_load()
+    # Open the embedding store before serving, so a store written by another model fails startup
+    await run_in_threadpool(get_embedding_store)
+    # In process mode, start the moderation and similarity workers before serving
+    await run_in_threadpool(start_process_pool)
+    yield
+    await close_async_openai_client()
+    await run_in_threadpool(shutdown_process_pool)
+
+
+app = FastAPI(title="PromptGuard", version="1.0", lifespan=lifespan)
+app.add_middleware(InFlightMiddleware)
+
+# Local generations waiting for the micro-batcher, read when /metrics is scraped
+queued_requests.set_function(local_batcher.qsize, queue="local_llm")
 
 SIMILARITY_THRESHOLD = 0.4
 
+# Maximum number of prompt pairs accepted by the batch endpoint
+MAX_BATCH_SIZE = 64
+
+NOT_SIMILAR_MESSAGE = "The prompts are not similar enough to generate a meaningful response."
+
+# Similarity functions for each similarity method
+SIMILARITY = {
+    "cosine": cosine_similarity_score,
+    "jaccard": jaccard_similarity,
+    "semantic": semantic_similarity,
+}
+
+# Batch similarity functions for each similarity method
+BATCH_SIMILARITY = {
+    "cosine": cosine_similarity_score_batch,
+    "jaccard": jaccard_similarity_batch,
+    "semantic": semantic_similarity_batch,
+}
+
+# Cache of sanitized LLM responses (RESPONSE_CACHE_SIZE=0 disables it). With
+# RESPONSE_CACHE_SEMANTIC_THRESHOLD set, near-identical prompts are also served from the cache.
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("RESPONSE_CACHE_SEMANTIC_THRESHOLD", "0") or 0)
+response_cache = ResponseCache(
+    maxsize=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    embed=lambda prompt: embed_prompts([prompt])[0],
+    semantic_threshold=RESPONSE_CACHE_SEMANTIC_THRESHOLD
+)
+
+# Admission control per LLM backend: calls in flight, requests allowed to wait for a call and
+# the longest wait in seconds. Requests beyond these limits are shed with 503 and Retry-After.
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", str(OPENAI_POOL_SIZE)))
+OPENAI_MAX_QUEUE = int(os.getenv("OPENAI_MAX_QUEUE", "200"))
+OPENAI_MAX_QUEUE_WAIT = float(os.getenv("OPENAI_MAX_QUEUE_WAIT", "10"))
+LOCAL_LLM_MAX_CONCURRENCY = int(os.getenv("LOCAL_LLM_MAX_CONCURRENCY", str(LOCAL_LLM_MAX_BATCH_SIZE)))
+LOCAL_LLM_MAX_QUEUE = int(os.getenv("LOCAL_LLM_MAX_QUEUE", "32"))
+LOCAL_LLM_MAX_QUEUE_WAIT = float(os.getenv("LOCAL_LLM_MAX_QUEUE_WAIT", "30"))
+admission = {
+    "openai": AdmissionController("openai", OPENAI_MAX_CONCURRENCY, OPENAI_MAX_QUEUE, OPENAI_MAX_QUEUE_WAIT),
+    "local_llm": AdmissionController("local_llm", LOCAL_LLM_MAX_CONCURRENCY, LOCAL_LLM_MAX_QUEUE, LOCAL_LLM_MAX_QUEUE_WAIT),
+}
+for backend, controller in admission.items():
+    queued_requests.set_function(controller.queued, queue=f"{backend}_admission")
+
+# Header with the client's time budget for a request in seconds, turned into its admission deadline
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout"
+
+# Near-duplicate index of previously seen or blocked prompts, kept in NEAR_DUPLICATE_INDEX_PATH if set
+NEAR_DUPLICATE_INDEX_PATH = os.getenv("NEAR_DUPLICATE_INDEX_PATH")
+near_duplicates = SharedIndex(NEAR_DUPLICATE_INDEX_PATH, LSHIndex.load, LSHIndex)
+
+# Reference prompts searched by TF-IDF cosine similarity, kept in REFERENCE_INDEX_PATH if set
+REFERENCE_INDEX_PATH = os.getenv("REFERENCE_INDEX_PATH")
+reference_prompts = SharedIndex(REFERENCE_INDEX_PATH, ReferenceIndex.load, ReferenceIndex)
+
 # Request body
 class PromptRequest(BaseModel):
     prompt1: str
     prompt2: str
     # Restrict llm_model and similarity method to specific options. Default set to "cosine"
-    similarity_method: Literal["cosine", "jaccard"] = "cosine"
+    similarity_method: Literal["cosine", "jaccard", "semantic"] = "cosine"
     llm_model: Literal["openai", "local_llm"] = "local_llm"
 
 # Response body
@@ -27,63 +131,450 @@ class PromptResponse(BaseModel):
     sanitized_prompt1: str = None
     sanitized_prompt2: str = None
 
+# Near-duplicate request and response bodies
+class NearDuplicateAddRequest(BaseModel):
+    key: str
+    prompt: str
+
+class NearDuplicateQueryRequest(BaseModel):
+    prompt: str
+    threshold: Optional[float] = None
+    limit: int = 10
+
+class NearDuplicateMatch(BaseModel):
+    key: str
+    score: float
+
+class NearDuplicateResponse(BaseModel):
+    matches: List[NearDuplicateMatch] = []
+
+# Reference prompt request and response bodies
+class ReferenceAddRequest(BaseModel):
+    key: str
+    prompt: str
+
+class ReferenceRemoveRequest(BaseModel):
+    key: str
+
+class ReferenceSearchRequest(BaseModel):
+    prompt: str
+    k: int = 10
+    min_score: float = 0.0
+
+class ReferenceMatch(BaseModel):
+    key: str
+    score: float
+
+class ReferenceSearchResponse(BaseModel):
+    matches: List[ReferenceMatch] = []
+
+
+@app.exception_handler(EmbeddingStoreMismatch)
+async def embedding_store_error(request: Request, exc: EmbeddingStoreMismatch) -> JSONResponse:
+    # A misconfigured server, not a bad request
+    return JSONResponse(status_code=500, content={"status": "error", "message": str(exc)})
+
+@app.exception_handler(AdmissionRejected)
+async def shed_response(request: Request, exc: AdmissionRejected) -> JSONResponse:
+    count_shed(exc)
+    return JSONResponse(
+        status_code=503,
+        content={"status": "overloaded", "message": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+def request_deadline(headers) -> Optional[float]:
+    """Time on the admission clock by which the client needs the response, if it sent a budget"""
+    try:
+        timeout = float(headers.get(REQUEST_TIMEOUT_HEADER, ""))
+    except ValueError:
+        return None
+    return time.monotonic() + timeout if math.isfinite(timeout) else None
 
 @app.get("/")
 def root():
     return {"status": "ok"}
 
-@app.post("/check_prompt_similarity", response_model=PromptResponse)
-def check_prompt_similarity(payload: PromptRequest):
+@app.get("/ready")
+def ready():
+    # The local model only gates readiness when it is preloaded; otherwise it loads on first use
+    local_llm = local_model.status()
+    if LOCAL_MODEL_PRELOAD and not local_model.ready:
+        return JSONResponse(status_code=503, content={"status": "not_ready", "local_llm": local_llm})
+    return {"status": "ready", "local_llm": local_llm}
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(registry.exposition(), media_type=CONTENT_TYPE)
+
+async def get_model_response(llm_model: str, prompt: str) -> str:
+    """Get the LLM response for a sanitized prompt without blocking the event loop"""
+    if llm_model == 'openai':
+        return await get_llm_response_async(prompt)
+    elif llm_model == 'local_llm':
+        return await run_in_threadpool(get_local_llm_response, prompt)
+
+def response_cache_namespace(llm_model: str) -> tuple:
+    # Cached outputs were moderated under the policy of the time, so a policy change must miss
+    return generation_params(llm_model) + (policy_version(),)
+
+async def get_cached_response(namespace: tuple, prompt: str) -> Optional[dict]:
+    # Semantic lookups embed the prompt, so they run in the threadpool
+    if response_cache.semantic:
+        return await run_in_threadpool(response_cache.get, namespace, prompt)
+    return response_cache.get(namespace, prompt)
+
+async def cache_response(namespace: tuple, prompt: str, response: dict) -> None:
+    # Only accepted outputs are cached, so a rejected sample can be regenerated
+    if response.get('action') != "accept":
+        return
+    if response_cache.semantic:
+        await run_in_threadpool(response_cache.put, namespace, prompt, response)
+    else:
+        response_cache.put(namespace, prompt, response)
+
+async def get_sanitized_response(llm_model: str, prompt: str, timer: StageTimer = None,
+                                 deadline: Optional[float] = None) -> dict:
+    """Get the sanitized LLM response for a prompt, served from the response cache when possible.
+
+    Only the LLM call itself goes through the backend's admission control, which raises
+    AdmissionRejected instead of waiting past the deadline.
+    """
+    timer = timer or StageTimer(observe=observe_stage)
+    namespace = response_cache_namespace(llm_model)
+    with timer.stage("cache"):
+        cached = await get_cached_response(namespace, prompt)
+    if cached is not None:
+        return cached
+
+    controller = admission[llm_model]
+    with timer.stage("queue", llm_model):
+        await controller.acquire(deadline)
+    start = controller.clock()
+    try:
+        with timer.stage("llm", llm_model):
+            llm_response = await get_model_response(llm_model, prompt)
+    finally:
+        controller.release(controller.clock() - start)
+    with timer.stage("output_sanitize"):
+        response = await run_cpu(sanitize_output_response, llm_response)
+    if response.get('action') == "reject":
+        count_rejection("output", response)
+    await cache_response(namespace, prompt, response)
+    return response
+
+async def run_similarity(similarity_method: str, func, *args):
+    """Run a similarity function off the event loop.
+
+    Lexical methods go through run_cpu (the process pool in process mode); the semantic
+    model is loaded once in the server process, so semantic similarity stays in the threadpool.
+    """
+    if similarity_method == "semantic":
+        return await run_in_threadpool(profile_call, func, *args)
+    return await run_cpu(func, *args)
+
+async def sanitize_prompts(prompts: List[str]) -> Optional[List[str]]:
+    """Sanitize prompts concurrently, each distinct prompt once; None at the first rejection.
+
+    Sanitization still running when a prompt is rejected is cancelled or its result dropped.
+    """
+    tasks = {prompt: asyncio.ensure_future(run_cpu(sanitize_input_prompt, prompt)) for prompt in dict.fromkeys(prompts)}
     try:
-        sanitized_prompt1 = sanitize_input_prompt(payload.prompt1)
-        sanitized_prompt2 = sanitize_input_prompt(payload.prompt2)
-
-        # Rejecting prompts if the prompts cannot be sanitized further
-        if sanitized_prompt1.get('action') == "reject" or sanitized_prompt2.get('action') == "reject":
-            return JSONResponse(
-                status_code=400, 
-                content={"status": "rejected", "message": "Content violates safety policies."}
+        for task in asyncio.as_completed(list(tasks.values())):
+            result = await task
+            if result.get('action') == "reject":
+                count_rejection("input", result)
+                return None
+    finally:
+        for task in tasks.values():
+            task.cancel()
+    return [tasks[prompt].result().get("sanitized_prompt") for prompt in prompts]
+
+async def score_prompts(payload: PromptRequest, timer: StageTimer) -> Optional[PromptResponse]:
+    """Sanitize and score a prompt pair without calling the LLM; None if a prompt is rejected.
+
+    Stages run cheapest first and stop as early as possible: sanitization (which rejects
+    before rewriting a prompt), then a precheck that settles the score without the
+    similarity method when it can, then the similarity method itself.
+    """
+    if payload.similarity_method not in SIMILARITY:
+        raise HTTPException(status_code=422, detail="Invalid similarity method")
+
+    # CPU-bound sanitization and similarity run off the event loop, in the process pool in process mode
+    with timer.stage("sanitize"):
+        sanitized = await sanitize_prompts([payload.prompt1, payload.prompt2])
+    # Rejecting prompts if the prompts cannot be sanitized further
+    if sanitized is None:
+        return None
+    sanitized_prompt1, sanitized_prompt2 = sanitized
+
+    # Calculate similarity based on the similarity_method in payload
+    with timer.stage("precheck"):
+        similarity_score = profile_call(similarity_precheck, payload.similarity_method, sanitized_prompt1, sanitized_prompt2)
+    if similarity_score is None:
+        with timer.stage("similarity", payload.similarity_method):
+            similarity_score = await run_similarity(
+                payload.similarity_method, SIMILARITY[payload.similarity_method], sanitized_prompt1, sanitized_prompt2
             )
 
-        # Accepted prompts after sanitization
-        sanitized_prompt1 = sanitized_prompt1.get("sanitized_prompt")
-        sanitized_prompt2 = sanitized_prompt2.get("sanitized_prompt")
+    # Compare similarity score and threshold defined
+    return PromptResponse(
+        status_code=200,
+        similarity_score=similarity_score,
+        is_similar=similarity_score >= SIMILARITY_THRESHOLD,
+        sanitized_prompt1=sanitized_prompt1,
+        sanitized_prompt2=sanitized_prompt2
+    )
 
-        similarity_method = payload.similarity_method  
+def rejected_response(timer: StageTimer) -> JSONResponse:
+    return JSONResponse(
+        status_code=400, 
+        content={"status": "rejected", "message": "Content violates safety policies."},
+        headers={"Server-Timing": timer.server_timing()}
+    )
 
-        # Calculate similarity based on the similarity_method in payload
-        if similarity_method == "cosine":
-            similarity_score = cosine_similarity_tfidf(sanitized_prompt1, sanitized_prompt2)
-        elif similarity_method == "jaccard":
-            similarity_score = jaccard_similarity(sanitized_prompt1, sanitized_prompt2)
-        else:
-            raise HTTPException(status_code=422, detail="Invalid similarity method")
-
-        # Compare similarity score and threshold defined
-        if similarity_score >= SIMILARITY_THRESHOLD:
-            if payload.llm_model == 'openai':
-                llm_response = get_llm_response(sanitized_prompt1)
-            elif payload.llm_model == 'local_llm':
-                llm_response = get_local_llm_response(sanitized_prompt1)
-            response  = sanitize_output_response(llm_response)
-            sanitized_response = response['sanitized_output']
+async def check_prompts(payload: PromptRequest, response: Response, timer: StageTimer, deadline: Optional[float] = None):
+    try:
+        result = await score_prompts(payload, timer)
+        if result is None:
+            return rejected_response(timer)
+
+        if result.is_similar:
+            llm_response = await get_sanitized_response(payload.llm_model, result.sanitized_prompt1, timer, deadline)
+            if llm_response.get('action') == "reject":
+                return rejected_response(timer)
             # Return santized output LLM response
-            return PromptResponse(
+            result.llm_response = llm_response['sanitized_output']
+        else:
+            result.llm_response = NOT_SIMILAR_MESSAGE
+        # Duration of each stage, e.g. "sanitize;dur=0.412, precheck;dur=0.021"
+        response.headers["Server-Timing"] = timer.server_timing()
+        return result
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+@app.post("/check_prompt_similarity", response_model=PromptResponse)
+async def check_prompt_similarity(payload: PromptRequest, request: Request, response: Response):
+    timer = StageTimer(observe=observe_stage)
+    deadline = request_deadline(request.headers)
+    if not profiling_requested(request.headers, request.query_params):
+        return await check_prompts(payload, response, timer, deadline)
+
+    # Profiled request: sanitization and similarity run in this process, under the profiler
+    with profiling() as profile:
+        result = await check_prompts(payload, response, timer, deadline)
+    if await run_in_threadpool(profile.save):
+        # Rejections are returned as their own response object
+        (result if isinstance(result, Response) else response).headers[PROFILE_ID_HEADER] = profile.id
+    return result
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_model_response(llm_model: str, prompt: str) -> AsyncIterator[str]:
+    """Yield the LLM response for a sanitized prompt in chunks as it is generated.
+
+    Closing this generator early (or cancelling it) closes the backend stream, which stops
+    the local model's generation thread.
+    """
+    if llm_model == 'openai':
+        async with aclosing(stream_llm_response_async(prompt)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+    elif llm_model == 'local_llm':
+        chunks = stream_local_llm_response(prompt)
+        try:
+            async for chunk in iterate_in_threadpool(chunks):
+                yield chunk
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+async def stream_sanitized_response(llm_model: str, result: PromptResponse, cached: Optional[dict] = None,
+                                    deadline: Optional[float] = None) -> AsyncIterator[str]:
+    """Server-sent events for a scored prompt pair: metadata, sanitized tokens, then done"""
+    yield sse_event("metadata", result.model_dump(exclude={"llm_response"}))
+    if not result.is_similar:
+        yield sse_event("token", {"text": NOT_SIMILAR_MESSAGE})
+        yield sse_event("done", {"status": "accepted"})
+        return
+
+    if cached is not None:
+        yield sse_event("token", {"text": cached['sanitized_output']})
+        yield sse_event("done", {"status": "accepted"})
+        return
+
+    # Tokens are sanitized incrementally and the output risk is checked before every release;
+    # generation stops as soon as releasing more would make the output unsafe
+    prompt = result.sanitized_prompt1
+    namespace = response_cache_namespace(llm_model)
+    sanitizer = StreamSanitizer(reject_early=True)
+    timer = StageTimer(observe=observe_stage)
+    try:
+        async with admission[llm_model].slot(deadline):
+            with timer.stage("llm", llm_model):
+                async with aclosing(stream_model_response(llm_model, prompt)) as chunks:
+                    async for chunk in chunks:
+                        text = sanitizer.feed(chunk)
+                        if text:
+                            yield sse_event("token", {"text": text})
+                        if sanitizer.rejected:
+                            break
+    except AdmissionRejected as e:
+        # The backend filled up between the admission check and the start of the stream
+        count_shed(e)
+        yield sse_event("error", {"message": str(e)})
+        return
+    except Exception as e:
+        # The response has started, so a failed backend ends the stream with an error event
+        yield sse_event("error", {"message": str(e)})
+        return
+    text = sanitizer.finish()
+    if text:
+        yield sse_event("token", {"text": text})
+
+    with timer.stage("output_sanitize"):
+        response = await run_in_threadpool(sanitizer.result)
+    if response.get('action') == "reject":
+        count_rejection("output", response)
+        yield sse_event("done", {"status": "rejected", "message": "Content violates safety policies."})
+        return
+    await cache_response(namespace, prompt, response)
+    yield sse_event("done", {"status": "accepted"})
+
+@app.post("/check_prompt_similarity/stream")
+async def check_prompt_similarity_stream(payload: PromptRequest, request: Request):
+    timer = StageTimer(observe=observe_stage)
+    deadline = request_deadline(request.headers)
+    try:
+        result = await score_prompts(payload, timer)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    if result is None:
+        return rejected_response(timer)
+
+    # Shed before the 200 and the stream start if the backend cannot take the request
+    cached = None
+    if result.is_similar:
+        cached = await get_cached_response(response_cache_namespace(payload.llm_model), result.sanitized_prompt1)
+        if cached is None:
+            admission[payload.llm_model].check(deadline)
+    return StreamingResponse(
+        stream_sanitized_response(payload.llm_model, result, cached, deadline),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Server-Timing": timer.server_timing()}
+    )
+
+async def score_batch(payload: List[PromptRequest], timer: StageTimer) -> List[PromptResponse]:
+    """Sanitize and score a batch; similar pairs are returned without an llm_response"""
+    # Sanitize every distinct prompt in the batch once
+    with timer.stage("sanitize"):
+        sanitized = await run_cpu(sanitize_input_prompts, [p for item in payload for p in (item.prompt1, item.prompt2)])
+    results = [None] * len(payload)
+    accepted = {}
+    for i, item in enumerate(payload):
+        sanitized_prompt1, sanitized_prompt2 = sanitized[2 * i], sanitized[2 * i + 1]
+        rejected = [r for r in (sanitized_prompt1, sanitized_prompt2) if r.get('action') == "reject"]
+        if rejected:
+            count_rejection("input", rejected[0])
+            results[i] = PromptResponse(status_code=400, llm_response="Content violates safety policies.")
+            continue
+        sanitized_prompt1, sanitized_prompt2 = sanitized_prompt1.get("sanitized_prompt"), sanitized_prompt2.get("sanitized_prompt")
+        # Pairs the single-pair endpoint answers with a 400 get their own 400 here
+        error = similarity_error(item.similarity_method, sanitized_prompt1, sanitized_prompt2)
+        if error:
+            results[i] = PromptResponse(
+                status_code=400, llm_response=error, sanitized_prompt1=sanitized_prompt1, sanitized_prompt2=sanitized_prompt2
+            )
+            continue
+        accepted.setdefault(item.similarity_method, []).append((i, sanitized_prompt1, sanitized_prompt2))
+
+    # One vectorized similarity computation per similarity method
+    for similarity_method, rows in accepted.items():
+        with timer.stage("similarity", similarity_method):
+            scores = await run_similarity(
+                similarity_method, BATCH_SIMILARITY[similarity_method], [(p1, p2) for _, p1, p2 in rows]
+            )
+        for (i, sanitized_prompt1, sanitized_prompt2), similarity_score in zip(rows, scores):
+            is_similar = similarity_score >= SIMILARITY_THRESHOLD
+            results[i] = PromptResponse(
                 status_code=200,
-                llm_response=sanitized_response,
                 similarity_score=similarity_score,
-                is_similar=True,
+                is_similar=is_similar,
                 sanitized_prompt1=sanitized_prompt1,
                 sanitized_prompt2=sanitized_prompt2
             )
-        
-        return PromptResponse(
-            status_code=200,
-            llm_response="The prompts are not similar enough to generate a meaningful response.",
-            similarity_score=similarity_score,
-            is_similar=False,
-            sanitized_prompt1=sanitized_prompt1,
-            sanitized_prompt2=sanitized_prompt2
+            if not is_similar:
+                results[i].llm_response = NOT_SIMILAR_MESSAGE
+    return results
+
+@app.post("/check_prompt_similarity/batch", response_model=List[PromptResponse])
+async def check_prompt_similarity_batch(payload: List[PromptRequest], request: Request, response: Response):
+    if len(payload) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=422, detail=f"Batch size exceeds the limit of {MAX_BATCH_SIZE}")
+
+    timer = StageTimer(observe=observe_stage)
+    deadline = request_deadline(request.headers)
+    try:
+        results = await score_batch(payload, timer)
+
+        # Only similar pairs are forwarded to the LLM, concurrently; shed pairs get a 503 each
+        similar = [i for i, result in enumerate(results) if result.is_similar]
+        responses = await asyncio.gather(
+            *(get_sanitized_response(payload[i].llm_model, results[i].sanitized_prompt1, timer, deadline) for i in similar),
+            return_exceptions=True
         )
+        retry_after = 0
+        for i, llm_response in zip(similar, responses):
+            if isinstance(llm_response, AdmissionRejected):
+                count_shed(llm_response)
+                retry_after = max(retry_after, llm_response.retry_after)
+                results[i].status_code, results[i].llm_response = 503, str(llm_response)
+            elif isinstance(llm_response, BaseException):
+                raise llm_response
+            elif llm_response.get('action') == "reject":
+                results[i].status_code, results[i].llm_response = 400, "Content violates safety policies."
+            else:
+                results[i].llm_response = llm_response['sanitized_output']
+        if retry_after:
+            response.headers["Retry-After"] = str(retry_after)
+        return results
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
+
+@app.post("/near_duplicates/add")
+def add_near_duplicate(payload: NearDuplicateAddRequest):
+    try:
+        with near_duplicates.update() as index:
+            return {"added": index.add(payload.key, index_text(payload.prompt))}
+    except ValueError as ve:
+        raise HTTPException(status_code=409, detail=str(ve))
+
+@app.post("/near_duplicates/query", response_model=NearDuplicateResponse)
+def query_near_duplicates(payload: NearDuplicateQueryRequest):
+    matches = near_duplicates.current().query(
+        index_text(payload.prompt), threshold=payload.threshold, limit=payload.limit
+    )
+    return NearDuplicateResponse(matches=[NearDuplicateMatch(key=key, score=score) for key, score in matches])
+
+@app.post("/reference_prompts/add")
+def add_reference_prompt(payload: ReferenceAddRequest):
+    try:
+        with reference_prompts.update() as index:
+            return {"added": index.add(payload.key, index_text(payload.prompt))}
+    except ValueError as ve:
+        raise HTTPException(status_code=409, detail=str(ve))
+
+@app.post("/reference_prompts/remove")
+def remove_reference_prompt(payload: ReferenceRemoveRequest):
+    with reference_prompts.update() as index:
+        if not index.remove(payload.key):
+            # Raised inside the update, so the unchanged index is not written again
+            raise HTTPException(status_code=404, detail=f"Key not indexed: {payload.key}")
+    return {"removed": True}
+
+@app.post("/reference_prompts/search", response_model=ReferenceSearchResponse)
+def search_reference_prompts(payload: ReferenceSearchRequest):
+    matches = reference_prompts.current().search(index_text(payload.prompt), k=payload.k, min_score=payload.min_score)
+    return ReferenceSearchResponse(matches=[ReferenceMatch(key=key, score=score) for key, score in matches])
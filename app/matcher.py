@@ -0,0 +1,524 @@
+import re
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+
+class PhraseMatches(NamedTuple):
+    """Result of a single scan of a text against a phrase list"""
+    counts: Dict[str, int]
+    spans: List[Tuple[int, int]]
+
+    @property
+    def phrases(self) -> List[str]:
+        return list(self.counts)
+
+    def __bool__(self) -> bool:
+        return bool(self.counts)
+
+
+def _trie_pattern(node: Dict) -> str:
+    """Emit a regex for a character trie so alternation branches on one character at a time."""
+    terminal = "" in node
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+
+    if not branches:
+        return ""
+    if len(branches) == 1 and not terminal:
+        return branches[0]
+
+    pattern = "(?:" + "|".join(branches) + ")"
+    return pattern + "?" if terminal else pattern
+
+
+_WORD_BOUNDARY = re.compile(r"\b")
+
+
+class PhraseMatcher:
+    """Case-insensitive phrase matcher compiled once into a single trie-shaped regex.
+
+    The cost of a scan depends on the text length, not on how many phrases are loaded:
+    at every word boundary the regex engine follows one path down the trie. Phrases are
+    counted wherever a word starts with them, so inflections ("bombs", "hacking") count
+    towards the risk, together with every shorter phrase the match starts with ("killer"
+    also counts "kill"). Only whole-word matches get a span, so redaction never cuts a
+    word in half.
+    """
+
+    def __init__(self, phrases: Iterable[str]):
+        self.phrases = tuple(dict.fromkeys(p.lower() for p in phrases if p))
+
+        trie: Dict = {}
+        for phrase in self.phrases:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[""] = True
+
+        # Every phrase that is a prefix of a phrase, itself included
+        self._prefixes: Dict[str, List[str]] = {}
+        for phrase in self.phrases:
+            node, prefixes = trie, []
+            for i, char in enumerate(phrase, 1):
+                node = node[char]
+                if "" in node:
+                    prefixes.append(phrase[:i])
+            self._prefixes[phrase] = prefixes
+
+        self._trie = trie
+        self.pattern = re.compile(r"\b" + _trie_pattern(trie), re.IGNORECASE) if self.phrases else None
+
+    def _phrase(self, matched: str) -> str:
+        """The phrase a match spells.
+
+        The regex folds case like re.IGNORECASE, which also pairs characters whose lower()
+        differs ("İ" and "i", "ſ" and "s"), so when lowercasing does not give back a phrase
+        the trie is walked with the same character comparison, in the regex's branch order.
+        """
+        phrase = matched.lower()
+        if phrase in self._prefixes:
+            return phrase
+
+        def walk(node, i):
+            if i == len(matched):
+                return "" if "" in node else None
+            for char in sorted(node):
+                if char and (char == matched[i] or re.fullmatch(re.escape(char), matched[i], re.IGNORECASE)):
+                    rest = walk(node[char], i + 1)
+                    if rest is not None:
+                        return char + rest
+            return None
+
+        return walk(self._trie, 0)
+
+    def scan(self, text: str) -> PhraseMatches:
+        """Return phrase hit counts and spans in one pass over the text"""
+        counts: Dict[str, int] = {}
+        spans: List[Tuple[int, int]] = []
+        if self.pattern is None:
+            return PhraseMatches(counts, spans)
+
+        for match in self.pattern.finditer(text):
+            prefixes = self._prefixes[self._phrase(match.group(0))]
+            for phrase in prefixes:
+                counts[phrase] = counts.get(phrase, 0) + 1
+            # The span covers the longest phrase matched here that ends at a word boundary
+            start = match.start()
+            for end in [match.end()] + [start + len(phrase) for phrase in reversed(prefixes[:-1])]:
+                if _WORD_BOUNDARY.match(text, end):
+                    spans.append((start, end))
+                    break
+        return PhraseMatches(counts, spans)
+
+    def redact(self, text: str, matches: PhraseMatches = None, replacement: str = "[redacted]") -> str:
+        """Replace every matched span with the replacement string"""
+        if matches is None:
+            matches = self.scan(text)
+        return replace_spans(text, matches.spans, replacement)
+
+
+# Characters of a text scanned for injection patterns; the rest is not scanned
+MAX_INJECTION_SCAN = 16384
+
+# Characters compared between classes besides Latin-1 and those a pattern names: the ones
+# re.IGNORECASE folds onto ASCII letters, and Unicode spaces
+_PROBE_EXTRA = "İıſKÅ    　"
+_QUANTIFIER = re.compile(r"\{(\d*)(,?)(\d*)\}")
+# Escapes of one character class, and of control characters
+_CLASS_ESCAPES = "sSdDwW"
+_CONTROL_ESCAPES = "ntrfva"
+
+
+class _LinearityCheck:
+    """Refuses an injection pattern that could make a backtracking scan superlinear.
+
+    The pattern is parsed into literals, classes, groups, alternations and repeats; any
+    other syntax (lookarounds, backreferences, inline flags) is refused. The engine is then
+    kept from choosing between two ways to go on:
+
+    - alternatives may not start with a common character;
+    - a group repeated a variable number of times may not start with a character that can
+      follow it, may not match nothing, and needs an upper bound, so `(?:a|a){0,30}` and
+      `(\\w+\\s*)+` are refused;
+    - a repeat without an upper bound (`*`, `+`, `{n,}`) is only allowed of a single
+      character or class that shares no character with the items right before and after it,
+      and not at the start of the pattern, so a run is entered from one position only.
+
+    The one choice left is where a bounded repeat of a single class such as `.{0,80}?` ends,
+    which costs at most its bound at every start position. A scan is then linear in the
+    scanned length, with a factor that grows with the product of the gap bounds in a
+    pattern. Case is folded as the matcher does, and classes are compared over Latin-1 plus
+    every character the pattern names.
+    """
+
+    def __init__(self, pattern: str):
+        re.compile(pattern, re.IGNORECASE)
+        self.pattern = pattern
+        self.pos = 0
+        self.probe = {chr(i) for i in range(256)} | set(_PROBE_EXTRA)
+        self._sets: Dict[str, frozenset] = {}
+        self.tree = self._alternation()
+
+    def check(self) -> None:
+        """Raise ValueError naming the first construct that could make a scan superlinear"""
+        self._check(self.tree, frozenset(), True, frozenset())
+
+    # Parsing, into ("char", source), ("empty",), ("seq", items), ("alt", branches) and
+    # ("repeat", min, max or None, item) nodes
+
+    def _peek(self) -> str:
+        return self.pattern[self.pos:self.pos + 1]
+
+    def _name(self, char: str) -> None:
+        self.probe |= {char, char.lower(), char.upper()}
+
+    def _alternation(self):
+        branches = [self._sequence()]
+        while self._peek() == "|":
+            self.pos += 1
+            branches.append(self._sequence())
+        return branches[0] if len(branches) == 1 else ("alt", branches)
+
+    def _sequence(self):
+        items = []
+        while self._peek() not in ("", "|", ")"):
+            items.append(self._repeat(self._atom()))
+        return ("seq", items)
+
+    def _atom(self):
+        start, char = self.pos, self._peek()
+        if char == "(":
+            if self.pattern.startswith("(?:", self.pos):
+                self.pos += 3
+            elif self.pattern.startswith("(?", self.pos):
+                raise ValueError("it uses unsupported group syntax")
+            else:
+                self.pos += 1
+            node = self._alternation()
+            self.pos += 1
+            return node
+        if char in "^$":
+            self.pos += 1
+            return ("empty",)
+        if char == "[":
+            self._class()
+        elif char == "\\":
+            escaped = self.pattern[self.pos + 1]
+            self.pos += 2
+            if escaped in "bBAZ":
+                return ("empty",)
+            self._escape(escaped)
+        else:
+            self.pos += 1
+            self._name(char)
+        return ("char", self.pattern[start:self.pos])
+
+    def _escape(self, escaped: str) -> None:
+        if escaped.isalnum() and escaped not in _CLASS_ESCAPES + _CONTROL_ESCAPES:
+            raise ValueError(f"it uses the unsupported escape \\{escaped}")
+        if not escaped.isalnum():
+            self._name(escaped)
+
+    def _class(self) -> None:
+        self.pos += 1
+        if self._peek() == "^":
+            self.pos += 1
+        if self._peek() == "]":
+            self.pos += 1
+            self._name("]")
+        while self._peek() != "]":
+            char = self._peek()
+            if char == "\\":
+                self._escape(self.pattern[self.pos + 1])
+                self.pos += 2
+            else:
+                self._name(char)
+                self.pos += 1
+        self.pos += 1
+
+    def _repeat(self, node):
+        char = self._peek()
+        if char in ("*", "+", "?"):
+            low, high = {"*": (0, None), "+": (1, None), "?": (0, 1)}[char]
+            self.pos += 1
+        else:
+            match = _QUANTIFIER.match(self.pattern, self.pos)
+            if not match or not (match.group(1) or match.group(3)):
+                return node
+            low = int(match.group(1) or 0)
+            high = int(match.group(3)) if match.group(3) else (None if match.group(2) else low)
+            self.pos = match.end()
+        # Lazy and possessive repeats go through the same positions
+        if self._peek() in ("?", "+"):
+            self.pos += 1
+        return ("repeat", low, high, node)
+
+    # Analysis
+
+    def _chars(self, source: str) -> frozenset:
+        """Characters of the probe alphabet a single-character item matches"""
+        if source not in self._sets:
+            item = re.compile(source, re.IGNORECASE)
+            self._sets[source] = frozenset(char for char in self.probe if item.fullmatch(char))
+        return self._sets[source]
+
+    def _ends(self, node, last: bool = False) -> Tuple[frozenset, bool]:
+        """Characters a node can start (or end) with, and whether it can match nothing"""
+        kind = node[0]
+        if kind == "char":
+            return self._chars(node[1]), False
+        if kind == "empty":
+            return frozenset(), True
+        if kind == "alt":
+            ends = [self._ends(branch, last) for branch in node[1]]
+            return frozenset().union(*(end[0] for end in ends)), any(end[1] for end in ends)
+        if kind == "repeat":
+            chars, nullable = self._ends(node[3], last)
+            return chars, nullable or node[1] == 0
+        chars = frozenset()
+        for item in reversed(node[1]) if last else node[1]:
+            item_chars, nullable = self._ends(item, last)
+            chars |= item_chars
+            if not nullable:
+                return chars, False
+        return chars, True
+
+    def _check(self, node, before: frozenset, at_start: bool, after: frozenset) -> None:
+        kind = node[0]
+        if kind == "seq":
+            items = node[1]
+            for i, item in enumerate(items):
+                chars, prefix_nullable = self._ends(("seq", items[:i]), last=True)
+                item_before = chars | before if prefix_nullable else chars
+                chars, nullable = self._ends(("seq", items[i + 1:]))
+                item_after = chars | after if nullable else chars
+                self._check(item, item_before, at_start and prefix_nullable, item_after)
+        elif kind == "alt":
+            seen = frozenset()
+            for branch in node[1]:
+                chars, nullable = self._ends(branch)
+                if nullable:
+                    chars |= after
+                if chars & seen:
+                    raise ValueError("alternatives can start with the same character")
+                seen |= chars
+                self._check(branch, before, at_start, after)
+        elif kind == "repeat":
+            low, high, body = node[1:]
+            if body[0] == "char":
+                if high is None:
+                    run = self._chars(body[1])
+                    if at_start:
+                        raise ValueError("the pattern can start with an unbounded repeat")
+                    if run & before:
+                        raise ValueError("an unbounded repeat overlaps what comes before it")
+                    if run & after:
+                        raise ValueError("an unbounded repeat overlaps what comes after it")
+                return
+            if high is None:
+                raise ValueError("a group is repeated without an upper bound")
+            first, nullable = self._ends(body)
+            if high > low and (nullable or first & after):
+                raise ValueError("a repeated group can match nothing or start like what comes after it")
+            if high > 1:
+                before, after = before | self._ends(body, last=True)[0], after | first
+            self._check(body, before, at_start, after)
+
+
+class InjectionMatcher:
+    """Prompt injection detector: all patterns compiled into one case-insensitive alternation.
+
+    A text is scanned once, whatever the number of patterns. The backtracking engine stays
+    linear only for patterns that leave it (almost) no choice of how to go on, so patterns
+    are checked when the matcher is built and refused otherwise (see _LinearityCheck): a gap
+    is written as a bounded repeat such as `.{0,80}?`, alternatives start differently, and
+    `*`/`+` only repeat a class that cannot overlap its neighbours, as in `system:\\s*`.
+    Only the first `max_scan` characters are scanned, a hard budget on the cost of one scan.
+    Counts are keyed by the pattern that matched.
+    """
+
+    def __init__(self, patterns: Iterable[str], max_scan: int = MAX_INJECTION_SCAN):
+        self.patterns = tuple(dict.fromkeys(p for p in patterns if p))
+        self.max_scan = max_scan
+        for pattern in self.patterns:
+            try:
+                _LinearityCheck(pattern).check()
+            except ValueError as e:
+                raise ValueError(f"Injection pattern could take superlinear time, {e}: {pattern}") from None
+        alternation = "|".join(f"(?P<p{i}>{pattern})" for i, pattern in enumerate(self.patterns))
+        self.pattern = re.compile(alternation, re.IGNORECASE) if self.patterns else None
+
+    def scan(self, text: str) -> PhraseMatches:
+        """Return match counts per pattern and spans in one pass over the scanned prefix"""
+        counts: Dict[str, int] = {}
+        spans: List[Tuple[int, int]] = []
+        if self.pattern is None:
+            return PhraseMatches(counts, spans)
+
+        for match in self.pattern.finditer(text, 0, self.max_scan):
+            pattern = self.patterns[int(match.lastgroup[1:])]
+            counts[pattern] = counts.get(pattern, 0) + 1
+            spans.append(match.span())
+        return PhraseMatches(counts, spans)
+
+
+def replace_spans(text: str, spans: List[Tuple[int, int]], replacement: str) -> str:
+    """Replace sorted, non-overlapping spans of the text"""
+    return apply_replacements(text, [(start, end, replacement) for start, end in spans])
+
+
+def apply_replacements(text: str, replacements: List[Tuple[int, int, str]]) -> str:
+    """Apply (start, end, replacement) edits in order of position, dropping any edit that overlaps an earlier one"""
+    if not replacements:
+        return text
+
+    parts = []
+    last = 0
+    for start, end, replacement in sorted(replacements, key=lambda r: r[0]):
+        if start < last:
+            continue
+        parts.append(text[last:start])
+        parts.append(replacement)
+        last = end
+    parts.append(text[last:])
+    return "".join(parts)
+
+
+class ProfanityScan(NamedTuple):
+    """Result of a scan of a text against a profanity index.
+
+    `ratio` is the share of whitespace-separated words that are profane on their own,
+    `bad_words` out of `words`; `spans` are the profane words to censor in the text.
+    """
+    ratio: float
+    spans: List[Tuple[int, int]]
+    bad_words: int = 0
+    words: int = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.spans)
+
+
+class ProfanityIndex:
+    """Hash-based profanity lookup equivalent to better_profanity's word matching.
+
+    Every listed word is stored under a normalized skeleton in which each leetspeak
+    substitute is folded onto one representative character, so a token is looked up
+    with one translate and one set lookup instead of comparing it with every word in
+    the list. Skeleton hits are confirmed position by position against the word's
+    allowed substitutes. Like better_profanity, up to `max_combinations` following
+    tokens are joined (with and without their separators) to catch split words, except a
+    token starting at the last character of the text. As in the profanity score that used
+    better_profanity.contains_profanity word by word, the ratio counts the whitespace
+    words that are profane on their own.
+    """
+
+    def __init__(self, words: Iterable[str], char_map: Dict[str, Tuple[str, ...]],
+                 allowed_characters: Iterable[str], max_combinations: int = 1, censor_char: str = "*"):
+        self.max_combinations = max_combinations
+        self.replacement = censor_char * 4
+        self.token_pattern = re.compile(
+            "[" + "".join(re.escape(char) for char in sorted(set(allowed_characters))) + "]+"
+        )
+
+        # Fold every group of interchangeable characters onto its smallest member
+        parent = {}
+
+        def find(char):
+            while parent.get(char, char) != char:
+                char = parent[char]
+            return char
+
+        for char, substitutes in char_map.items():
+            for substitute in substitutes:
+                if len(substitute) == 1:
+                    a, b = sorted((find(char), find(substitute)))
+                    parent[b] = a
+        self._fold = str.maketrans({char: find(char) for char in parent})
+
+        self.words = set()
+        self._by_skeleton: Dict[str, List[Tuple[frozenset, ...]]] = {}
+        self._prefixes = set()
+        for word in words:
+            word = word.lower()
+            self.words.add(word)
+            skeleton = self.skeleton(word)
+            positions = tuple(frozenset(char_map.get(char, (char,))) for char in word)
+            self._by_skeleton.setdefault(skeleton, []).append(positions)
+            self._prefixes.update(skeleton[:i] for i in range(1, len(skeleton) + 1))
+
+    @classmethod
+    def from_profanity(cls, profanity) -> "ProfanityIndex":
+        """Build an index from a loaded better_profanity.Profanity instance"""
+        return cls(
+            (str(word) for word in profanity.CENSOR_WORDSET),
+            profanity.CHARS_MAPPING,
+            profanity.ALLOWED_CHARACTERS,
+            profanity.MAX_NUMBER_COMBINATIONS,
+        )
+
+    def skeleton(self, token: str) -> str:
+        return token.translate(self._fold)
+
+    def contains(self, token: str) -> bool:
+        """Return True if a single lowercased token is a listed word or one of its variants"""
+        if token in self.words:
+            return True
+        for positions in self._by_skeleton.get(self.skeleton(token), ()):
+            if len(positions) == len(token) and all(c in allowed for c, allowed in zip(token, positions)):
+                return True
+        return False
+
+    def spans(self, text: str) -> List[Tuple[int, int]]:
+        """Spans better_profanity would censor in the text, found in one tokenization pass"""
+        tokens = [(m.start(), m.end()) for m in self.token_pattern.finditer(text)]
+        spans: List[Tuple[int, int]] = []
+        i = 0
+        while i < len(tokens):
+            start, end = tokens[i]
+            word = text[start:end].lower()
+            hit = None
+
+            # Join the following tokens to catch words split by separators
+            joined = joined_with_separators = word
+            for j in range(i + 1, min(i + 1 + self.max_combinations, len(tokens))):
+                next_start, next_end = tokens[j]
+                # better_profanity never joins a word starting at the last character
+                if next_start >= len(text) - 1:
+                    break
+                next_word = text[next_start:next_end].lower()
+                joined += next_word
+                joined_with_separators += text[tokens[j - 1][1]:next_start].lower() + next_word
+                if self.contains(joined) or self.contains(joined_with_separators):
+                    hit = j
+                    break
+                if (self.skeleton(joined) not in self._prefixes
+                        and self.skeleton(joined_with_separators) not in self._prefixes):
+                    break
+
+            if hit is None and self.contains(word):
+                hit = i
+
+            if hit is None:
+                i += 1
+                continue
+            spans.append((start, tokens[hit][1]))
+            i = hit + 1
+        return spans
+
+    def profane(self, word: str) -> bool:
+        """Whether a text has profanity on its own, like better_profanity.contains_profanity"""
+        if self.token_pattern.fullmatch(word):
+            return self.contains(word.lower())
+        return bool(self.spans(word))
+
+    def scan(self, text: str) -> ProfanityScan:
+        """Return the profane word ratio and the spans to censor"""
+        words = text.split()
+        if not words:
+            return ProfanityScan(0.0, [])
+        bad_words = sum(map(self.profane, words))
+        return ProfanityScan(bad_words / len(words), self.spans(text), bad_words, len(words))
+
+    def censor(self, text: str) -> str:
+        """Text with every profane word replaced, like better_profanity.censor"""
+        return replace_spans(text, self.spans(text), self.replacement)
+
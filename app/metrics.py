@@ -0,0 +1,232 @@
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Latency buckets in seconds, from sub-millisecond moderation to multi-second LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames) or not all(name in labels for name in self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def exposition(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonic count per label set"""
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        # A metric without labels is exported as 0 before it is first updated
+        self._values: Dict[Tuple[str, ...], float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+
+class Gauge(_Metric):
+    """Current value per label set, either set directly or read from a function at scrape time"""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        # A metric without labels is exported as 0 before it is first updated
+        self._values: Dict[Tuple[str, ...], float] = {} if self.labelnames else {(): 0}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        self._functions[self._key(labels)] = function
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        values.update({key: function() for key, function in self._functions.items()})
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count of observations per label set"""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Per label set: [count per bucket (not cumulative), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        samples = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(float(bound)),))
+                samples.append((self.name + "_bucket", labels, cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((self.name + "_sum", labels, total))
+            samples.append((self.name + "_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def exposition(self) -> str:
+        return "\n".join(metric.exposition() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+input_sanitization_seconds = registry.register(Histogram(
+    "promptguard_input_sanitization_seconds", "Time to sanitize the input prompts of a request"))
+similarity_seconds = registry.register(Histogram(
+    "promptguard_similarity_seconds", "Time to score prompt similarity", ("method",)))
+llm_seconds = registry.register(Histogram(
+    "promptguard_llm_seconds", "Time to get an LLM response", ("backend",)))
+output_sanitization_seconds = registry.register(Histogram(
+    "promptguard_output_sanitization_seconds", "Time to sanitize an LLM response"))
+rejections_total = registry.register(Counter(
+    "promptguard_rejections_total", "Rejected prompts and LLM responses by stage and category", ("stage", "category")))
+in_flight_requests = registry.register(Gauge(
+    "promptguard_in_flight_requests", "HTTP requests currently being handled"))
+queued_requests = registry.register(Gauge(
+    "promptguard_queued_requests", "Requests waiting in an internal queue", ("queue",)))
+shed_requests_total = registry.register(Counter(
+    "promptguard_shed_requests_total", "Requests rejected by LLM backend admission control", ("backend", "reason")))
+
+# Histogram and label name of each StageTimer stage that is exported
+STAGE_HISTOGRAMS = {
+    "sanitize": (input_sanitization_seconds, None),
+    "similarity": (similarity_seconds, "method"),
+    "llm": (llm_seconds, "backend"),
+    "output_sanitize": (output_sanitization_seconds, None),
+}
+
+
+def observe_stage(stage: str, seconds: float, label: str = None) -> None:
+    """Record a stage duration in its histogram; stages without a histogram are ignored"""
+    if stage not in STAGE_HISTOGRAMS:
+        return
+    histogram, label_name = STAGE_HISTOGRAMS[stage]
+    if label_name is None:
+        histogram.observe(seconds)
+    else:
+        histogram.observe(seconds, **{label_name: label or "unknown"})
+
+
+def count_rejection(stage: str, result: dict) -> None:
+    """Count a reject result of sanitization; rejections on the total risk have category "total" """
+    rejections_total.inc(stage=stage, category=result.get("category", "total"))
+
+
+def count_shed(rejection) -> None:
+    """Count a request shed by LLM backend admission control"""
+    shed_requests_total.inc(backend=rejection.backend, reason=rejection.reason)
+
+
+class InFlightMiddleware:
+    """ASGI middleware tracking HTTP requests in flight, excluding scrapes of the metrics path"""
+
+    def __init__(self, app, exclude: Tuple[str, ...] = ("/metrics",)):
+        self.app = app
+        self.exclude = exclude
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+        in_flight_requests.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            in_flight_requests.dec()
@@ -0,0 +1,93 @@
+import cProfile
+import contextvars
+import os
+import pstats
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+# Requests are only profiled when the server allows it
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+# Directory the pstats artifacts are written to
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Request header (or query parameter "profile") that asks for a profile
+PROFILE_HEADER = "X-Profile"
+# Response header carrying the artifact id
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+_current_profile = contextvars.ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    """cProfile statistics of the work done for one request, collected across threads.
+
+    Every call made through call() runs under its own profiler in the calling thread, so
+    work offloaded to the threadpool is covered; the statistics are merged when saved.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self._profilers = []
+        self._lock = threading.Lock()
+
+    def call(self, func: Callable, *args, **kwargs):
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._profilers.append(profiler)
+
+    def stats(self) -> Optional[pstats.Stats]:
+        with self._lock:
+            profilers = list(self._profilers)
+        if not profilers:
+            return None
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+    def save(self, directory: str = None) -> Optional[str]:
+        """Write the merged statistics to <directory>/<id>.prof and return the path"""
+        stats = self.stats()
+        if stats is None:
+            return None
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.id}.prof")
+        stats.dump_stats(path)
+        return path
+
+
+def current_profile() -> Optional[RequestProfile]:
+    """Profile of the request being handled, if it asked for one"""
+    return _current_profile.get()
+
+
+@contextmanager
+def profiling() -> Iterator[RequestProfile]:
+    """Profile the work of the current request until the block exits"""
+    profile = RequestProfile()
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+def profile_call(func: Callable, *args):
+    """Call func, under the request profile if there is one"""
+    profile = current_profile()
+    if profile is None:
+        return func(*args)
+    return profile.call(func, *args)
+
+
+def profiling_requested(headers, query_params) -> bool:
+    """True if profiling is enabled on the server and the request asks for it"""
+    if not PROFILING_ENABLED:
+        return False
+    flag = headers.get(PROFILE_HEADER) or query_params.get("profile") or ""
+    return flag.lower() in ("1", "true", "yes")
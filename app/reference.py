@@ -0,0 +1,230 @@
+import argparse
+import json
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from app.similarity import cosine_tokens
+from app.sanitize import MAX_QUERY_LENGTH, index_text
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    """Return `array` or a copy with room for at least `size` elements, doubling the capacity"""
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(16, size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class ReferenceIndex:
+    """Top-k cosine search over reference prompts: a TF-IDF sparse matrix with an inverted term index.
+
+    Rows keep raw term counts in CSR buffers that grow as prompts are added, alongside the
+    document frequency of every term, so IDF weights (smoothed as in TfidfVectorizer) always
+    reflect the prompts currently indexed and inserts or removals never refit anything. A
+    query takes the rows sharing at least one term with it from the inverted index, and only
+    those are weighted, normalized and scored; scores equal the cosine similarity under a
+    TfidfVectorizer fitted on the indexed prompts. Removed rows are tombstoned and dropped
+    once they outnumber the live ones.
+    """
+
+    def __init__(self):
+        self.vocabulary: Dict[str, int] = {}
+        self.keys: List[str] = []
+        self._key_ids: Dict[str, int] = {}
+        self._postings: List[List[int]] = []
+        self._df = np.zeros(0, dtype=np.int64)
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = np.zeros(0, dtype=np.int32)
+        self._data = np.zeros(0, dtype=np.float64)
+        self._alive = np.zeros(0, dtype=bool)
+        self._removed = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._key_ids)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._key_ids
+
+    @property
+    def _rows(self) -> int:
+        return len(self.keys)
+
+    def _matrix(self) -> sparse.csr_matrix:
+        rows, nnz = self._rows, self._indptr[self._rows]
+        return sparse.csr_matrix(
+            (self._data[:nnz], self._indices[:nnz], self._indptr[:rows + 1]),
+            shape=(rows, len(self.vocabulary))
+        )
+
+    def _idf(self) -> np.ndarray:
+        return np.log((1 + len(self)) / (1 + self._df[:len(self.vocabulary)])) + 1
+
+    def _insert(self, key: str, counts: Counter) -> None:
+        row, start = self._rows, self._indptr[self._rows]
+        columns = []
+        for term in counts:
+            column = self.vocabulary.get(term)
+            if column is None:
+                column = self.vocabulary[term] = len(self.vocabulary)
+                self._postings.append([])
+            columns.append(column)
+            self._postings[column].append(row)
+        columns = np.array(columns, dtype=np.int32)
+        order = np.argsort(columns)
+        end = start + len(columns)
+
+        self._indices = _grow(self._indices, end)
+        self._data = _grow(self._data, end)
+        self._indices[start:end] = columns[order]
+        self._data[start:end] = np.fromiter(counts.values(), dtype=np.float64, count=len(columns))[order]
+        self._indptr = _grow(self._indptr, row + 2)
+        self._indptr[row + 1] = end
+        self._alive = _grow(self._alive, row + 1)
+        self._alive[row] = True
+        self._df = _grow(self._df, len(self.vocabulary))
+        self._df[columns] += 1
+        self.keys.append(key)
+        self._key_ids[key] = row
+
+    def _rebuild_postings(self, matrix: sparse.csr_matrix) -> None:
+        columns = matrix.tocsc()
+        self._postings = [
+            columns.indices[columns.indptr[i]:columns.indptr[i + 1]].tolist() for i in range(matrix.shape[1])
+        ]
+
+    def _compact(self) -> None:
+        """Drop tombstoned rows; the vocabulary and document frequencies are unchanged"""
+        live = np.flatnonzero(self._alive[:self._rows])
+        matrix = self._matrix()[live]
+        matrix.sort_indices()
+        self.keys = [self.keys[row] for row in live]
+        self._key_ids = {key: row for row, key in enumerate(self.keys)}
+        self._indptr = matrix.indptr.astype(np.int64)
+        self._indices = matrix.indices.astype(np.int32)
+        self._data = matrix.data.astype(np.float64)
+        self._alive = np.ones(len(live), dtype=bool)
+        self._removed = 0
+        self._rebuild_postings(matrix)
+
+    def add(self, key: str, text: str) -> bool:
+        """Add a reference prompt under a unique key. Returns False if the text has no terms."""
+        counts = Counter(cosine_tokens(text))
+        if not counts:
+            return False
+        with self._lock:
+            if key in self._key_ids:
+                raise ValueError(f"Key already indexed: {key}")
+            self._insert(key, counts)
+        return True
+
+    def remove(self, key: str) -> bool:
+        """Remove a reference prompt. Returns False if the key is not indexed."""
+        with self._lock:
+            row = self._key_ids.pop(key, None)
+            if row is None:
+                return False
+            self._alive[row] = False
+            self._df[self._indices[self._indptr[row]:self._indptr[row + 1]]] -= 1
+            self._removed += 1
+            if self._removed > len(self._key_ids):
+                self._compact()
+        return True
+
+    def search(self, text: str, k: int = 10, min_score: float = 0.0) -> List[Tuple[str, float]]:
+        """Return up to k (key, cosine similarity) pairs at or above min_score, best first"""
+        counts = Counter(cosine_tokens(text))
+        if k <= 0 or not counts:
+            return []
+        with self._lock:
+            columns = [self.vocabulary[term] for term in counts if term in self.vocabulary]
+            columns = [column for column in columns if self._df[column] > 0]
+            if not columns:
+                return []
+            candidates = np.unique(np.concatenate([np.array(self._postings[c], dtype=np.int64) for c in columns]))
+            candidates = candidates[self._alive[candidates]]
+
+            idf = self._idf()
+            rows = self._matrix()[candidates]
+            rows.data *= idf[rows.indices]
+            norms = np.sqrt(np.asarray(rows.multiply(rows).sum(axis=1)).ravel())
+
+            query = np.zeros(len(self.vocabulary))
+            for term, count in counts.items():
+                column = self.vocabulary.get(term)
+                if column is not None and self._df[column] > 0:
+                    query[column] = count * idf[column]
+            query /= np.linalg.norm(query)
+
+            scores = (rows @ query) / norms
+            keep = scores >= min_score
+            candidates, scores = candidates[keep], scores[keep]
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                candidates, scores = candidates[top], scores[top]
+            order = np.argsort(-scores, kind="stable")
+            return [(self.keys[candidates[i]], float(scores[i])) for i in order]
+
+    def save(self, path: str) -> None:
+        """Write the live rows of the index to a .npz file"""
+        with self._lock:
+            live = np.flatnonzero(self._alive[:self._rows])
+            matrix = self._matrix()[live]
+            terms = sorted(self.vocabulary, key=self.vocabulary.get)
+            np.savez(
+                path,
+                indptr=matrix.indptr,
+                indices=matrix.indices,
+                data=matrix.data,
+                keys=np.array(json.dumps([self.keys[row] for row in live])),
+                vocabulary=np.array(json.dumps(terms)),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "ReferenceIndex":
+        """Load an index written by save(); document frequencies and postings are rebuilt from the counts"""
+        index = cls()
+        with np.load(path) as data:
+            terms = json.loads(str(data["vocabulary"]))
+            keys = json.loads(str(data["keys"]))
+            matrix = sparse.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=(len(keys), len(terms)))
+        matrix.sort_indices()
+        index.vocabulary = {term: column for column, term in enumerate(terms)}
+        index.keys = keys
+        index._key_ids = {key: row for row, key in enumerate(keys)}
+        index._indptr = matrix.indptr.astype(np.int64)
+        index._indices = matrix.indices.astype(np.int32)
+        index._data = matrix.data.astype(np.float64)
+        index._alive = np.ones(len(keys), dtype=bool)
+        index._df = np.bincount(index._indices, minlength=len(terms)).astype(np.int64)
+        index._rebuild_postings(matrix)
+        return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a reference prompt index (one prompt per line, optionally \"key<TAB>prompt\").")
+    parser.add_argument("prompts", help="Path to the reference prompts")
+    parser.add_argument("output", help="Path of the .npz index file to write")
+    args = parser.parse_args()
+    if not MAX_QUERY_LENGTH:
+        parser.error("set MAX_QUERY_LENGTH to the service's value; prompts are indexed as the service normalizes them")
+
+    index = ReferenceIndex()
+    with open(args.prompts, encoding="utf-8") as prompts_file:
+        for number, line in enumerate(prompts_file, 1):
+            line = line.rstrip("\n")
+            key, _, prompt = line.partition("\t") if "\t" in line else (str(number), "", line)
+            if prompt.strip():
+                index.add(key, index_text(prompt))
+
+    index.save(args.output)
+    print(f"Indexed {len(index)} reference prompts: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
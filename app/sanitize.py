@@ -1,31 +1,175 @@
-import re
-from typing import Dict
-from collections import defaultdict
+import hashlib
+import string
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from collections import OrderedDict, defaultdict
 from better_profanity import profanity
 from unidecode import unidecode
 import os
+from app.matcher import InjectionMatcher, PhraseMatcher, PhraseMatches, ProfanityIndex, ProfanityScan, apply_replacements
 
 profanity.load_censor_words()
 
 # List of disallowed phrases
 DISALLOWED_PHRASES = [
-    "kill", "bomb", "attack", "suicide", "nazi", "rape", "execute", "murder", "harm yourself", "stab"
+    "kill", "bomb", "attack", "suicide", "nazi", "rape", "execute", "murder", "harm yourself", "stab",
     "drop database", "shutdown", "hack", "backdoor", "exploit", "killer"
 ]
 
-# List of injection patterns to disregard
+# List of injection patterns to disregard; gaps are bounded so the combined scan stays linear
 INJECTION_PATTERNS = [
-    r"(ignore|disregard)\s+(all|previous)?\s*(instructions|rules)",
-    r"pretend\s+(to|you are)",
-    r"bypass.*filter",
-    r"(as\s+an\s+AI\s+language\s+model)",
-    r"<\|.*?\|>",
+    r"(?:ignore|disregard)\s+(?:(?:all|previous)\s*)?(?:instructions|rules)",
+    r"pretend\s+(?:to|you are)",
+    r"bypass.{0,80}?filter",
+    r"as\s+an\s+AI\s+language\s+model",
+    r"<\|.{0,64}?\|>",
     r"system:\s*",
 ]
 
 # Max query length
 MAX_QUERY_LENGTH = os.getenv("MAX_QUERY_LENGTH")
 
+# Raw characters read per character of the length limit; the rest of a longer input is dropped unread
+PRETRUNCATE_FACTOR = 8
+
+_ASCII_WHITESPACE = "".join(c for c in map(chr, range(128)) if c.isspace())
+
+def _deletion_table(punctuation: str) -> Dict[int, None]:
+    """str.translate table deleting ASCII characters other than word characters, whitespace and `punctuation`"""
+    keep = set(string.ascii_letters + string.digits + "_" + _ASCII_WHITESPACE + punctuation)
+    return {i: None for i in range(128) if chr(i) not in keep}
+
+# Characters removed from prompts and from LLM output, after transliteration to ASCII
+INPUT_DELETIONS = _deletion_table(".,!?'\"")
+OUTPUT_DELETIONS = _deletion_table(".,!?'\"-")
+
+class Normalized(NamedTuple):
+    text: str
+    # Characters of the raw input read to produce text
+    consumed: int
+
+def normalize(text: str, max_length: Optional[int] = None, deletions: Dict[int, None] = INPUT_DELETIONS,
+              collapse_whitespace: bool = True) -> Normalized:
+    """Transliterate to ASCII, drop disallowed characters and collapse whitespace, up to max_length.
+
+    ASCII text skips unidecode, and characters are filtered in a single translate pass. With
+    max_length, only a prefix of the input is normalized: first 2 * max_length characters,
+    then PRETRUNCATE_FACTOR * max_length if that gave too little text, so the work done does
+    not depend on the input length. Every step maps characters independently, so the result
+    equals normalizing the whole input and truncating whenever the prefix yields max_length
+    characters.
+    """
+    def run(raw):
+        if not raw.isascii():
+            raw = unidecode(raw)
+        raw = raw.translate(deletions)
+        return " ".join(raw.split()) if collapse_whitespace else raw
+
+    if max_length is None:
+        return Normalized(run(text), len(text))
+    limit = min(len(text), PRETRUNCATE_FACTOR * max_length)
+    consumed = min(limit, 2 * max_length)
+    while True:
+        normalized = run(text[:consumed])
+        if len(normalized) >= max_length or consumed == limit:
+            return Normalized(normalized[:max_length], consumed)
+        consumed = limit
+
+def index_text(prompt: str) -> str:
+    """A prompt as the search indexes store and query it, normalized like input prompts up to MAX_QUERY_LENGTH
+
+    Transliterated or punctuation-padded variants of a prompt index alike, and the work per
+    prompt is bounded.
+    """
+    return normalize(prompt, int(MAX_QUERY_LENGTH)).text
+
+# Bumped by update_policy() when the policy changes in a way policy_version() cannot see
+_policy_generation = 0
+
+# Current policy version, with the settings it was computed for (kept so their ids stay unique)
+_policy_version = (None, None, 0)
+
+def update_policy() -> None:
+    """Mark the moderation policy as changed.
+
+    Replacing DISALLOWED_PHRASES, INJECTION_PATTERNS, the better_profanity words,
+    MAX_QUERY_LENGTH or PRETRUNCATE_FACTOR, or changing the length of a list, is detected
+    automatically. Call this after any other change, such as an in-place edit of a list
+    entry or new ContentModerator thresholds or weights, so compiled matchers are rebuilt
+    and cached results dropped.
+    """
+    global _policy_generation
+    _policy_generation += 1
+
+def policy_version() -> int:
+    """Number identifying the current moderation policy, for caches of moderation results.
+
+    It changes only when the policy does, so checking it compares a few integers.
+    """
+    global _policy_version
+    settings = (DISALLOWED_PHRASES, INJECTION_PATTERNS, profanity.CENSOR_WORDSET)
+    key = (*map(id, settings), *map(len, settings), MAX_QUERY_LENGTH, PRETRUNCATE_FACTOR, _policy_generation)
+    if key != _policy_version[0]:
+        _policy_version = (key, settings, _policy_version[2] + 1)
+    return _policy_version[2]
+
+# Phrase matcher compiled once from DISALLOWED_PHRASES, rebuilt only if the policy changes
+_phrase_matcher = (policy_version(), PhraseMatcher(DISALLOWED_PHRASES))
+
+def get_phrase_matcher() -> PhraseMatcher:
+    """Return the compiled matcher for the current DISALLOWED_PHRASES list"""
+    global _phrase_matcher
+    version = policy_version()
+    built, matcher = _phrase_matcher
+    if built != version:
+        matcher = PhraseMatcher(DISALLOWED_PHRASES)
+        _phrase_matcher = (version, matcher)
+    return matcher
+
+# Profanity index built once from the better_profanity word list, rebuilt only if the policy changes
+_profanity_index = (policy_version(), ProfanityIndex.from_profanity(profanity))
+
+def get_profanity_index() -> ProfanityIndex:
+    """Return the profanity index for the currently loaded better_profanity words"""
+    global _profanity_index
+    version = policy_version()
+    built, index = _profanity_index
+    if built != version:
+        index = ProfanityIndex.from_profanity(profanity)
+        _profanity_index = (version, index)
+    return index
+
+# Injection matcher compiled once from INJECTION_PATTERNS, rebuilt only if the policy changes
+_injection_matcher = (policy_version(), InjectionMatcher(INJECTION_PATTERNS))
+
+def get_injection_matcher() -> InjectionMatcher:
+    """Return the combined matcher for the current INJECTION_PATTERNS list"""
+    global _injection_matcher
+    version = policy_version()
+    built, matcher = _injection_matcher
+    if built != version:
+        matcher = InjectionMatcher(INJECTION_PATTERNS)
+        _injection_matcher = (version, matcher)
+    return matcher
+
+# Policy matches found in a single scan of a text; injections are not scanned in LLM output
+class PolicyScan(NamedTuple):
+    phrases: PhraseMatches
+    profanity: ProfanityScan
+    injections: Optional[PhraseMatches] = None
+
+def redactions(scan: PolicyScan) -> List[Tuple[int, int, str]]:
+    """(start, end, replacement) for every injection, disallowed phrase and profane word found by a scan"""
+    replacements = [(start, end, "[redacted]") for start, end in scan.injections.spans] if scan.injections else []
+    replacements += [(start, end, "[redacted]") for start, end in scan.phrases.spans]
+    censor = get_profanity_index().replacement
+    replacements += [(start, end, censor) for start, end in scan.profanity.spans]
+    return replacements
+
+def redact(text: str, scan: PolicyScan) -> str:
+    """Redact disallowed phrases and censor profanity found by one scan of the text"""
+    return apply_replacements(text, redactions(scan))
+
 # Content moderator to check and calculate profanity score and input risk
 class ContentModerator:
     
@@ -43,22 +187,36 @@ class ContentModerator:
             'disallowed_phrase': 0.4
         }
 
-    def profanity_score(self, text: str) -> int:
+    def profanity_score(self, text: str, scan: ProfanityScan = None) -> float:
         """Calculate profanity score of input prompt"""
-        words = text.split()
-        bad_words = [word for word in words if profanity.contains_profanity(word)]
-        return len(bad_words) / len(words) if words else 0.0
+        if scan is None:
+            scan = get_profanity_index().scan(text)
+        return scan.ratio
         
-    def calculate_risk(self, text: str) -> Dict:
+    def scan(self, text: str, injections: bool = True) -> PolicyScan:
+        """Scan text once for all policy matches"""
+        return PolicyScan(
+            phrases=get_phrase_matcher().scan(text),
+            profanity=get_profanity_index().scan(text),
+            injections=get_injection_matcher().scan(text) if injections else None
+        )
+
+    def calculate_risk(self, text: str, scan: PolicyScan = None) -> Dict:
         """Calculate risk score of the input prompt"""
         risk_score = defaultdict(float)
+        if scan is None:
+            scan = self.scan(text)
         
         # Calculating profanity score
-        risk_score['profanity'] = self.profanity_score(text)
+        risk_score['profanity'] = self.profanity_score(text, scan.profanity)
        
         # Matching disallowed phrase  
-        found_phrases = sum(1 for p in DISALLOWED_PHRASES if p in text.lower())
+        found_phrases = len(scan.phrases.counts)
         risk_score['disallowed_phrase'] = min(found_phrases * 0.5, 1.0)
+
+        # Matching injection patterns, if the text was scanned for them
+        if scan.injections is not None:
+            risk_score['injection'] = min(len(scan.injections.counts) * 0.5, 1.0)
         
         # Calculating total risk of the input prompt
         total_risk = sum(
@@ -71,23 +229,85 @@ class ContentModerator:
             'category_risks': dict(risk_score)
         }
 
+class SanitizationCache:
+    """Thread-safe LRU cache of sanitize_input_prompt results for one policy version.
+
+    Entries are keyed by a 128-bit BLAKE2 digest of the prompt, so long prompts are not
+    kept in memory. Accepted and rejected results are both cached. A lookup with a policy
+    version other than the cached one clears the cache.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(prompt: str) -> bytes:
+        return hashlib.blake2b(prompt.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    def get(self, key: bytes, version: int) -> Optional[Dict]:
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(result)
+
+    def put(self, key: bytes, version: int, result: Dict) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = dict(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.version = None
+            self.hits = self.misses = 0
+
+# Cache of input sanitization results (SANITIZE_CACHE_SIZE=0 disables it)
+SANITIZE_CACHE_SIZE = int(os.getenv("SANITIZE_CACHE_SIZE", "10000"))
+sanitize_cache = SanitizationCache(SANITIZE_CACHE_SIZE)
+
 def sanitize_input_prompt(prompt: str) -> Dict:
-    """Process and sanitize input prompt"""
+    """Process and sanitize input prompt, reusing the cached result of a repeated prompt"""
+    if sanitize_cache.maxsize <= 0:
+        return _sanitize_input_prompt(prompt)
+    # Characters past the pre-truncation limit are never read, so they are not hashed either
+    key = SanitizationCache.key(prompt[:PRETRUNCATE_FACTOR * int(MAX_QUERY_LENGTH)])
+    version = policy_version()
+    result = sanitize_cache.get(key, version)
+    if result is None:
+        result = _sanitize_input_prompt(prompt)
+        sanitize_cache.put(key, version, result)
+    return result
+
+def _sanitize_input_prompt(prompt: str) -> Dict:
     moderator = ContentModerator()
-    
-    # Initial sanitization
-    sanitized_prompt = unidecode(prompt)
-    sanitized_prompt = re.sub(r"[^\w\s.,!?'\"]", '', sanitized_prompt)
-    sanitized_prompt = re.sub(r"\s+", ' ', sanitized_prompt).strip()[:int(MAX_QUERY_LENGTH)]
 
-    # Injection pattern removal
-    for pattern in INJECTION_PATTERNS:
-        sanitized_prompt = re.sub(pattern, "[redacted]", sanitized_prompt, flags=re.IGNORECASE)
+    # Normalize a bounded prefix; the risk is scored on the raw text that was read
+    normalized = normalize(prompt, int(MAX_QUERY_LENGTH))
 
-    # Calculate risk score
-    risk_result = moderator.calculate_risk(prompt)
+    # Calculate risk score first, so rejected prompts skip the rewriting steps below
+    risk_result = moderator.calculate_risk(prompt[:normalized.consumed])
     category_risks = risk_result['category_risks']
-    print("Category risks:", category_risks)
     
     # Reject if any individual risk exceeds the threshold
     for category, risk_score in category_risks.items():
@@ -107,36 +327,33 @@ def sanitize_input_prompt(prompt: str) -> Dict:
             "risk_breakdown": risk_result['category_risks'],
             "message": "Content violates safety policies"
         }
-    
-    # Content sanitization
-    if any(phrase in sanitized_prompt.lower() for phrase in DISALLOWED_PHRASES):
-        sanitized_prompt = re.sub(
-            r"\b(" + "|".join(re.escape(phrase) for phrase in DISALLOWED_PHRASES) + r")\b",
-            "[redacted]",
-            sanitized_prompt,
-            flags=re.IGNORECASE
-        )
-    
-    if profanity.contains_profanity(sanitized_prompt):
-        sanitized_prompt = profanity.censor(sanitized_prompt)  # Censor profanity
+
+    sanitized_prompt = normalized.text
+
+    # Injection removal, content sanitization and profanity censoring
+    sanitized_prompt = redact(sanitized_prompt, moderator.scan(sanitized_prompt))
 
     return {"action": "accept", "sanitized_prompt": sanitized_prompt}
 
+def sanitize_input_prompts(prompts: List[str]) -> List[Dict]:
+    """Sanitize a batch of input prompts, processing each distinct prompt once"""
+    results = {prompt: None for prompt in prompts}
+    for prompt in results:
+        results[prompt] = sanitize_input_prompt(prompt)
+    return [results[prompt] for prompt in prompts]
+
 def contains_disallowed_phrases(text: str) -> bool:
-    return any(phrase in text.lower() for phrase in DISALLOWED_PHRASES)
+    return bool(get_phrase_matcher().scan(text))
 
-def sanitize_output_response(response: str) -> Dict:
-    """Sanitize and validate LLM generated content"""
-    moderator = ContentModerator()
-    
-    # Initial sanitization
-    sanitized_output = unidecode(response)
-    sanitized_output = re.sub(r"[^\w\s.,!?'\"\n-]", '', sanitized_output)
+def filter_output(text: str) -> str:
+    """Transliterate to ASCII and drop characters not allowed in LLM output, keeping its whitespace"""
+    return normalize(text, deletions=OUTPUT_DELETIONS, collapse_whitespace=False).text
 
-    # Calculae risk 
-    risk_result = moderator.calculate_risk(sanitized_output)
-    
-    # High-risk rejection
+def output_rejection(moderator: "ContentModerator", text: str, scan: PolicyScan = None) -> Optional[Dict]:
+    """Reject response for LLM output whose total risk exceeds the output threshold, else None"""
+    if scan is None:
+        scan = moderator.scan(text, injections=False)
+    risk_result = moderator.calculate_risk(text, scan)
     if risk_result['total_risk'] > moderator.output_risk_threshold:
         return {
             "action": "reject",
@@ -144,17 +361,165 @@ def sanitize_output_response(response: str) -> Dict:
             "risk_breakdown": risk_result['category_risks'],
             "message": "Content violates safety policies"
         }
+    return None
 
-    # Content sanitization
-    if contains_disallowed_phrases(sanitized_output):
-        sanitized_output = re.sub(
-            r"\b(" + "|".join(re.escape(p) for p in DISALLOWED_PHRASES) + r")\b",
-            "[redacted]",
-            sanitized_output,
-            flags=re.IGNORECASE
-        )
+def sanitize_output_response(response: str) -> Dict:
+    """Sanitize and validate LLM generated content"""
+    moderator = ContentModerator()
     
-    if profanity.contains_profanity(sanitized_output):
-        sanitized_output = profanity.censor(sanitized_output)
+    # Initial sanitization
+    sanitized_output = filter_output(response)
+
+    # Calculae risk and reject high-risk output
+    scan = moderator.scan(sanitized_output, injections=False)
+    rejection = output_rejection(moderator, sanitized_output, scan)
+    if rejection is not None:
+        return rejection
+
+    # Content sanitization and profanity censoring
+    sanitized_output = redact(sanitized_output, scan)
+
+    return {"action": "accept", "sanitized_output":sanitized_output}
+
+class StreamSanitizer:
+    """Sanitizes LLM output that arrives in chunks, releasing redacted text as soon as it is safe.
+
+    The last `window` characters are held back, and text is only released up to a whitespace
+    boundary, so a disallowed phrase or profane word split across chunks is still seen whole
+    before any of it is sent. The window defaults to the longest disallowed phrase or twice the
+    longest profane word. finish() releases the rest and result() applies the output risk check to the
+    complete text, as sanitize_output_response does.
+
+    With `reject_early`, the output risk of the text released so far is checked before every
+    release: once releasing more would push it past the output threshold, nothing more is
+    released, `rejected` is set and result() is a rejection, so a client never receives the
+    text that made the output unsafe. The released prefix was below the threshold, so such an
+    output may be rejected where the complete text would have been diluted below it.
+    """
+
+    def __init__(self, window: int = None, reject_early: bool = False):
+        if window is None:
+            window = max(
+                max(map(len, get_phrase_matcher().phrases), default=0),
+                # Profane words may be split by a separator after every character
+                2 * max(map(len, get_profanity_index().words), default=0)
+            )
+        self.window = window
+        self.reject_early = reject_early
+        self.rejection: Optional[Dict] = None
+        self.moderator = ContentModerator()
+        self._pending = ""
+        self._raw = []
+        self._released = []
+        self._phrases = set()
+        self._bad_words = 0
+        self._words = 0
+
+    @property
+    def text(self) -> str:
+        """Sanitized text released so far"""
+        return "".join(self._released)
+
+    @property
+    def rejected(self) -> bool:
+        return self.rejection is not None
+
+    def _risks(self, phrases: int, bad_words: int, words: int) -> Dict[str, float]:
+        return {
+            'profanity': bad_words / words if words else 0.0,
+            'disallowed_phrase': min(phrases * 0.5, 1.0)
+        }
+
+    def _total_risk(self, risks: Dict[str, float]) -> float:
+        return sum(weight * risks.get(category, 0.0) for category, weight in self.moderator.risk_weights.items())
+
+    def _cut(self) -> int:
+        limit = len(self._pending) - self.window
+        if limit <= 0:
+            return 0
+        cut = max(self._pending.rfind(c, 0, limit + 1) for c in " \t\r\n")
+        # Without a word boundary, release at the window anyway so the buffer stays bounded
+        if cut <= 0 and limit > 3 * self.window:
+            cut = limit
+        return max(cut, 0)
+
+    def _release(self, cut: int) -> str:
+        text = self._pending
+        if cut <= 0:
+            return ""
+        # Never split a match: stop before any match that runs past the cut
+        replacements = redactions(self.moderator.scan(text, injections=False)) if cut < len(text) else []
+        moved = True
+        while moved:
+            moved = False
+            for start, end, _ in replacements:
+                if start < cut < end:
+                    cut, moved = start, True
+        if cut <= 0:
+            return ""
+
+        # Released text is final, so its policy matches count towards the output risk
+        scan = self.moderator.scan(text[:cut], injections=False)
+        if self.reject_early:
+            risks = self._risks(
+                len(self._phrases.union(scan.phrases.counts)),
+                self._bad_words + scan.profanity.bad_words,
+                self._words + scan.profanity.words
+            )
+            total_risk = self._total_risk(risks)
+            if total_risk > self.moderator.output_risk_threshold:
+                self.rejection = {
+                    "action": "reject",
+                    "risk_score": total_risk,
+                    "risk_breakdown": risks,
+                    "message": "Content violates safety policies"
+                }
+                return ""
+        self._phrases.update(scan.phrases.counts)
+        self._bad_words += scan.profanity.bad_words
+        self._words += scan.profanity.words
+        released = apply_replacements(text[:cut], redactions(scan))
+        self._raw.append(text[:cut])
+        self._released.append(released)
+        self._pending = text[cut:]
+        return released
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk of output and return the sanitized text that can be released now"""
+        if self.rejected:
+            return ""
+        self._pending += filter_output(chunk)
+        return self._release(self._cut())
+
+    def finish(self) -> str:
+        """Release the held back text at the end of the output"""
+        if self.rejected:
+            return ""
+        return self._release(len(self._pending))
+
+    def min_risk(self, more_words: int) -> float:
+        """Lowest total risk the complete output can have if at most `more_words` words follow.
+
+        Disallowed phrases found in released text stay counted. Profane words already complete
+        in the held back text stay profane, and the profanity ratio can at worst be diluted by
+        the last, unfinished word and `more_words` clean words.
+        """
+        index = get_profanity_index()
+        complete = max(self._pending.rfind(c) for c in " \t\r\n") + 1
+        pending = index.scan(self._pending[:complete])
+        partial = 1 if self._pending[complete:] else 0
+        words = self._words + pending.words + partial + more_words
+        return self._total_risk(self._risks(len(self._phrases), self._bad_words + pending.bad_words, words))
+
+    def certain_rejection(self, more_words: int) -> bool:
+        """True once the output will be rejected however it continues for up to `more_words` words"""
+        return self.min_risk(more_words) > self.moderator.output_risk_threshold
 
-    return {"action": "accept", "sanitized_output":sanitized_output}
\ No newline at end of file
+    def result(self) -> Dict:
+        """Final moderation result for the whole output, shaped like sanitize_output_response"""
+        if self.rejected:
+            return self.rejection
+        rejection = output_rejection(self.moderator, "".join(self._raw) + self._pending)
+        if rejection is not None:
+            return rejection
+        return {"action": "accept", "sanitized_output": self.text}
@@ -0,0 +1,67 @@
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Optional, Tuple
+
+
+class SharedIndex:
+    """An index kept in a file shared by every worker on a host, or in memory without a path.
+
+    Changes go through update(), which takes an exclusive lock on `path`.lock, reloads the
+    index if another process saved it since, applies the change and writes the index to a
+    temporary file that replaces `path`, so readers never see a partial file. current()
+    reloads the index when the file was replaced, so every worker serves the same entries
+    and entries added at runtime survive a restart. A change that raises is not saved.
+    `load` reads a file written by the index's save(path), which must write to that path.
+    """
+
+    def __init__(self, path: Optional[str], load: Callable[[str], Any], factory: Callable[[], Any]):
+        self.path = path
+        self._load = load
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._index = factory()
+        if path:
+            self._refresh()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _refresh(self) -> Any:
+        """Reload the index if its file was replaced since it was last read or written"""
+        stamp = self._file_stamp()
+        with self._lock:
+            if stamp is not None and stamp != self._stamp:
+                self._index = self._load(self.path)
+                self._stamp = stamp
+            return self._index
+
+    def current(self) -> Any:
+        """The index as last saved by any worker"""
+        return self._refresh() if self.path else self._index
+
+    @contextmanager
+    def update(self):
+        """Yield the index to change; the change is saved when the block exits without an error"""
+        if not self.path:
+            yield self._index
+            return
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = self._refresh()
+                yield index
+                # numpy adds .npz to paths without it, so the temporary file keeps the suffix
+                temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+                index.save(temporary)
+                os.replace(temporary, self.path)
+                with self._lock:
+                    self._stamp = self._file_stamp()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,32 +1,287 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+import numpy as np
+import math
+import os
 import string
-from sentence_transformers import SentenceTransformer, util
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from app.tfidf import TfidfModel
+from app.embedding_store import EmbeddingStore
 
 def cosine_similarity_tfidf(prompt1, prompt2):
     """Cosine Similarity (Default) - Computes the cosine similarity between two input text prompts using TF-IDF (Term Frequency - Inverse Document Frequency) vectorization."""
     vectorizer = TfidfVectorizer().fit([prompt1, prompt2])
     vectors = vectorizer.transform([prompt1, prompt2])
     similarity = cosine_similarity(vectors[0], vectors[1])
-    print(similarity[0][0])
     return similarity[0][0]
 
 
+# Path to a TF-IDF model fitted offline (python -m app.tfidf); without it cosine fits per request
+TFIDF_MODEL_PATH = os.getenv("TFIDF_MODEL_PATH")
+
+_tfidf_model = None
+
+
+def get_tfidf_model() -> Optional[TfidfModel]:
+    """Return the pre-fitted TF-IDF model, loading it once, or None if none is configured"""
+    global _tfidf_model
+    if _tfidf_model is None and TFIDF_MODEL_PATH:
+        _tfidf_model = TfidfModel.load(TFIDF_MODEL_PATH)
+    return _tfidf_model
+
+
+def cosine_similarity_score(prompt1, prompt2):
+    """Cosine similarity using the pre-fitted TF-IDF model when configured, else a per-request fit"""
+    model = get_tfidf_model()
+    if model is not None:
+        return model.similarity(prompt1, prompt2)
+    return cosine_similarity_tfidf(prompt1, prompt2)
+
+
+def cosine_similarity_score_batch(pairs: List[Tuple[str, str]]) -> List[float]:
+    """Batched cosine_similarity_score"""
+    model = get_tfidf_model()
+    if model is not None:
+        return model.similarity_batch(pairs)
+    return cosine_similarity_tfidf_batch(pairs)
+
+
+_PUNCTUATION = str.maketrans('', '', string.punctuation)
+
+# IDF weight of a term present in only one of two documents (smooth_idf: ln((1 + 2) / (1 + 1)) + 1)
+_PAIR_IDF_SINGLE = math.log(1.5) + 1
+
+
+def jaccard_tokens(prompt):
+    """Lowercased, punctuation-free word tokens used by Jaccard similarity"""
+    return prompt.lower().translate(_PUNCTUATION).split()
+
+
+# Tokenizer of the TF-IDF vectorizers used by cosine similarity
+_cosine_analyzer = TfidfVectorizer().build_analyzer()
+
+
+def cosine_tokens(prompt):
+    """Lowercased word tokens as counted by the TF-IDF vectorizers of cosine similarity"""
+    return _cosine_analyzer(prompt)
+
+
+def similarity_precheck(similarity_method: str, prompt1: str, prompt2: str) -> Optional[float]:
+    """Score of a prompt pair when it is known without running the similarity method, else None.
+
+    Cosine similarity of two prompts without a shared term is exactly 0.0, which a token set
+    intersection shows far cheaper than a TF-IDF fit. This does not hold for the hashing
+    TF-IDF model (colliding terms) or for semantic similarity, which return None.
+    """
+    if similarity_method != "cosine":
+        return None
+    model = get_tfidf_model()
+    if model is not None and model.hashing:
+        return None
+    terms1, terms2 = set(cosine_tokens(prompt1)), set(cosine_tokens(prompt2))
+    # Prompts without any term are left to the method, which rejects an empty vocabulary
+    if terms1 and terms2 and terms1.isdisjoint(terms2):
+        return 0.0
+    return None
+
+
+def similarity_error(similarity_method: str, prompt1: str, prompt2: str) -> Optional[str]:
+    """Error the single-pair similarity method raises for a prompt pair, else None.
+
+    The batched methods score such pairs 0.0 so one pair cannot fail a whole batch; this lets
+    the batch endpoint answer them with the same error as the single-pair endpoint.
+    """
+    if similarity_method != "cosine" or get_tfidf_model() is not None:
+        return None
+    if cosine_tokens(prompt1) or cosine_tokens(prompt2):
+        return None
+    try:
+        cosine_similarity_tfidf(prompt1, prompt2)
+    except ValueError as ve:
+        # Empty vocabulary of the per-request fit
+        return str(ve)
+    return None
+
+
+def cosine_similarity_tfidf_batch(pairs: List[Tuple[str, str]]) -> List[float]:
+    """Cosine similarity of many prompt pairs in one vectorized computation.
+
+    Gives the same score as cosine_similarity_tfidf for each pair: terms are counted over the
+    whole batch once, and the per-pair IDF (1 for terms in both prompts, ln(1.5) + 1 for terms
+    in only one) is applied with sparse element-wise operations. Pairs without any shared
+    vocabulary score 0.0.
+    """
+    if not pairs:
+        return []
+    try:
+        counts = CountVectorizer().fit_transform([p for pair in pairs for p in pair]).tocsr().astype(np.float64)
+    except ValueError:
+        # No pair contains a single token
+        return [0.0] * len(pairs)
+    a, b = counts[0::2], counts[1::2]
+
+    shared = a.multiply(b)
+    a_squared, b_squared = a.multiply(a), b.multiply(b)
+    mask = shared.astype(bool)
+    weight = _PAIR_IDF_SINGLE ** 2
+
+    dot = np.asarray(shared.sum(axis=1)).ravel()
+    norm_a = weight * np.asarray(a_squared.sum(axis=1)).ravel() + (1 - weight) * np.asarray(a_squared.multiply(mask).sum(axis=1)).ravel()
+    norm_b = weight * np.asarray(b_squared.sum(axis=1)).ravel() + (1 - weight) * np.asarray(b_squared.multiply(mask).sum(axis=1)).ravel()
+    denominator = np.sqrt(norm_a * norm_b)
+
+    scores = np.divide(dot, denominator, out=np.zeros_like(dot), where=denominator > 0)
+    return scores.tolist()
+
+
+def jaccard_similarity_batch(pairs: List[Tuple[str, str]]) -> List[float]:
+    """Jaccard similarity of many prompt pairs from one binary token matrix. Pairs with no tokens score 0.0."""
+    if not pairs:
+        return []
+    vectorizer = CountVectorizer(analyzer=lambda prompt: set(jaccard_tokens(prompt)), binary=True)
+    try:
+        tokens = vectorizer.fit_transform([p for pair in pairs for p in pair]).tocsr()
+    except ValueError:
+        return [0.0] * len(pairs)
+    a, b = tokens[0::2], tokens[1::2]
+
+    intersection = np.asarray(a.multiply(b).sum(axis=1)).ravel().astype(np.float64)
+    union = np.asarray(a.sum(axis=1)).ravel() + np.asarray(b.sum(axis=1)).ravel() - intersection
+
+    scores = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+    return scores.tolist()
+
+
 def jaccard_similarity(prompt1, prompt2):
     """Jaccard Similarity - Based on the intersection over union of tokens. Simpler calculation based on word overlap."""
-    translator = str.maketrans('', '', string.punctuation)
-    set1 = set(prompt1.lower().translate(translator).split())
-    set2 = set(prompt2.lower().translate(translator).split())
+    set1 = set(jaccard_tokens(prompt1))
+    set2 = set(jaccard_tokens(prompt2))
     intersection = set1 & set2
     union = set1 | set2
     return len(intersection) / len(union)
 
-            
-# def sentence_similarity(prompt1, prompt2):
-#     """Sentence Similarity - Computes the semantic similarity between two input text prompts using Sentence Transformers."""
-#     model = SentenceTransformer('all-MiniLM-L6-v2')
-#     embeddings1 = model.encode(prompt1, convert_to_tensor=True)
-#     embeddings2 = model.encode(prompt2, convert_to_tensor=True)
-#     similarity = util.pytorch_cos_sim(embeddings1, embeddings2)
-#     print(similarity.item())
-#     return similarity.item()
\ No newline at end of file
+
+# Sentence Transformers model used by semantic similarity, loaded on first use
+SEMANTIC_MODEL_NAME = os.getenv("SEMANTIC_MODEL_NAME", "all-MiniLM-L6-v2")
+
+# Maximum number of prompt embeddings kept in memory
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+
+
+class EmbeddingCache:
+    """Thread-safe LRU cache of prompt embeddings keyed by the sanitized prompt text"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            embedding = self._entries.get(text)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(text)
+            self.hits += 1
+            return embedding
+
+    def put(self, text: str, embedding: np.ndarray) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[text] = embedding
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE)
+
+# Directory of the on-disk embedding store shared by all workers (unset disables it)
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH")
+
+_embedding_store = None
+_embedding_store_lock = threading.Lock()
+
+
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    """Return the on-disk embedding store, opening it once, or None if none is configured"""
+    global _embedding_store
+    if _embedding_store is None and EMBEDDING_STORE_PATH:
+        with _embedding_store_lock:
+            if _embedding_store is None:
+                _embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH, model=SEMANTIC_MODEL_NAME)
+    return _embedding_store
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    """Return the sentence encoder, loading it once on first use"""
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                from sentence_transformers import SentenceTransformer
+                _encoder = SentenceTransformer(SEMANTIC_MODEL_NAME)
+    return _encoder
+
+
+def embed_prompts(prompts: List[str]) -> np.ndarray:
+    """Return L2-normalized embeddings, encoding all uncached prompts in one batched call.
+
+    Prompts missing from the in-memory cache are looked up in the on-disk store, if one is
+    configured, and newly encoded embeddings are appended to it.
+    """
+    store = get_embedding_store()
+    embeddings = {}
+    missing = []
+    for prompt in dict.fromkeys(prompts):
+        embedding = embedding_cache.get(prompt)
+        if embedding is None and store is not None:
+            embedding = store.get(prompt)
+            if embedding is not None:
+                embedding_cache.put(prompt, embedding)
+        if embedding is None:
+            missing.append(prompt)
+        else:
+            embeddings[prompt] = embedding
+
+    if missing:
+        encoded = get_encoder().encode(missing, convert_to_numpy=True, normalize_embeddings=True)
+        for prompt, embedding in zip(missing, encoded):
+            embedding = np.asarray(embedding, dtype=np.float32)
+            embedding_cache.put(prompt, embedding)
+            embeddings[prompt] = embedding
+        if store is not None:
+            store.put_many(missing, np.stack([embeddings[prompt] for prompt in missing]))
+
+    return np.stack([embeddings[prompt] for prompt in prompts])
+
+
+def semantic_similarity(prompt1, prompt2):
+    """Semantic Similarity - Cosine similarity of Sentence Transformers embeddings. Matches paraphrases that share few words."""
+    embeddings = embed_prompts([prompt1, prompt2])
+    return float(embeddings[0] @ embeddings[1])
+
+
+def semantic_similarity_batch(pairs: List[Tuple[str, str]]) -> List[float]:
+    """Semantic similarity of many prompt pairs from one batched encoding"""
+    if not pairs:
+        return []
+    embeddings = embed_prompts([p for pair in pairs for p in pair])
+    return np.einsum("ij,ij->i", embeddings[0::2], embeddings[1::2]).astype(float).tolist()
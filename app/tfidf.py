@@ -0,0 +1,116 @@
+import argparse
+import math
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, TfidfVectorizer
+from sklearn.pipeline import make_pipeline
+from sklearn.utils import murmurhash3_32
+
+# Number of hashed features for the hashing variant
+HASHING_FEATURES = 2 ** 18
+
+
+class TfidfModel:
+    """TF-IDF model fitted offline on a reference corpus and reused for every request.
+
+    The default variant stores the corpus vocabulary; terms outside it are ignored. The
+    hashing variant maps terms into a fixed number of buckets and only stores the IDF
+    vector, so unseen terms still count (with the highest IDF) and no vocabulary is kept.
+    Transformed rows are L2-normalized, so the cosine of two prompts is a sparse dot product.
+    """
+
+    def __init__(self, hashing: bool = False, n_features: int = HASHING_FEATURES):
+        self.hashing = hashing
+        if hashing:
+            self.vectorizer = make_pipeline(
+                HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None),
+                TfidfTransformer()
+            )
+        else:
+            self.vectorizer = TfidfVectorizer()
+
+    def fit(self, corpus: Iterable[str]) -> "TfidfModel":
+        """Fit the IDF weights on a reference corpus"""
+        self.vectorizer.fit(corpus)
+        self.__dict__.pop("_scorer", None)
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_scorer", None)
+        return state
+
+    def transform(self, texts: List[str]):
+        return self.vectorizer.transform(texts)
+
+    def _term_scorer(self):
+        """Analyzer, term-to-column mapping and IDF weights of the fitted vectorizer"""
+        if "_scorer" not in self.__dict__:
+            if self.hashing:
+                hashing, transformer = self.vectorizer[0], self.vectorizer[1]
+                n_features = hashing.n_features
+
+                def column(term):
+                    # Same bucket as HashingVectorizer
+                    h = murmurhash3_32(term, seed=0)
+                    return (2147483647 - (n_features - 1)) % n_features if h == -2147483648 else abs(h) % n_features
+
+                self._scorer = (hashing.build_analyzer(), column, transformer.idf_)
+            else:
+                self._scorer = (self.vectorizer.build_analyzer(), self.vectorizer.vocabulary_.get, self.vectorizer.idf_)
+        return self._scorer
+
+    def vector(self, text: str) -> Dict[int, float]:
+        """L2-normalized TF-IDF weights of a text as a sparse {column: weight} mapping"""
+        analyzer, column, idf = self._term_scorer()
+        counts = Counter(column(term) for term in analyzer(text))
+        counts.pop(None, None)
+        weights = {i: count * float(idf[i]) for i, count in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        return {i: w / norm for i, w in weights.items()} if norm else {}
+
+    def similarity(self, prompt1: str, prompt2: str) -> float:
+        """Cosine similarity of two prompts as a dot product of their sparse vectors"""
+        vector1, vector2 = self.vector(prompt1), self.vector(prompt2)
+        if len(vector1) > len(vector2):
+            vector1, vector2 = vector2, vector1
+        return sum(w * vector2.get(i, 0.0) for i, w in vector1.items())
+
+    def similarity_batch(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """Cosine similarity of many prompt pairs from one transform"""
+        if not pairs:
+            return []
+        vectors = self.transform([p for pair in pairs for p in pair]).tocsr()
+        return np.asarray(vectors[0::2].multiply(vectors[1::2]).sum(axis=1)).ravel().tolist()
+
+    def save(self, path: str) -> None:
+        joblib.dump(self, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TfidfModel":
+        model = joblib.load(path)
+        if not isinstance(model, cls):
+            raise ValueError(f"{path} does not contain a TfidfModel")
+        return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit a TF-IDF model on a reference corpus (one document per line).")
+    parser.add_argument("corpus", help="Path to the reference corpus")
+    parser.add_argument("output", help="Path of the model file to write")
+    parser.add_argument("--hashing", action="store_true", help="Use the hashing variant without a stored vocabulary")
+    parser.add_argument("--n-features", type=int, default=HASHING_FEATURES, help="Number of features for --hashing")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as corpus_file:
+        corpus = [line.strip() for line in corpus_file if line.strip()]
+
+    TfidfModel(hashing=args.hashing, n_features=args.n_features).fit(corpus).save(args.output)
+    print(f"Fitted TF-IDF model on {len(corpus)} documents: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+
+class StageTimer:
+    """Wall-clock duration of each named stage of a request, in milliseconds.
+
+    Durations of a stage entered more than once are added up. server_timing() formats them
+    as a Server-Timing header value, in the order the stages first ran. If `observe` is set,
+    it is called with the stage name, its duration in seconds and the stage label (such as
+    the similarity method) every time a stage ends.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter,
+                 observe: Callable[[str, float, Optional[str]], None] = None):
+        self.clock = clock
+        self.observe = observe
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str, label: str = None):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            seconds = self.clock() - start
+            self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+            if self.observe is not None:
+                self.observe(name, seconds, label)
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={duration:.3f}" for name, duration in self.stages.items())
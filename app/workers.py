@@ -0,0 +1,84 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.profiling import current_profile
+from app.sanitize import get_phrase_matcher, get_profanity_index
+from app.similarity import get_tfidf_model
+
+# "thread" runs CPU-bound moderation and similarity in the threadpool, "process" in a process pool
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "thread").lower()
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", "0")) or os.cpu_count() or 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_worker():
+    """Load the moderation policy and TF-IDF model once in each worker process"""
+    get_phrase_matcher()
+    get_profanity_index()
+    get_tfidf_model()
+
+
+def _ready() -> bool:
+    return True
+
+
+def process_mode() -> bool:
+    return EXECUTION_MODE == "process"
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool, creating it on first use.
+
+    Workers are spawned rather than forked, so they do not inherit the server's threads
+    (model loader, micro-batcher) or its open connections.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=PROCESS_POOL_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_worker
+                )
+    return _pool
+
+
+def start_process_pool() -> Optional[ProcessPoolExecutor]:
+    """Start every worker of the pool in process mode, so the first requests do not pay for it"""
+    if not process_mode():
+        return None
+    pool = get_process_pool()
+    for future in [pool.submit(_ready) for _ in range(PROCESS_POOL_WORKERS)]:
+        future.result()
+    return pool
+
+
+def shutdown_process_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+async def run_cpu(func: Callable, *args):
+    """Run CPU-bound work off the event loop, in the process pool in process mode.
+
+    In process mode `func` and its arguments are pickled, so `func` must be a module-level
+    function. Otherwise, and for requests being profiled, it runs in the threadpool.
+    """
+    profile = current_profile()
+    if profile is not None:
+        return await run_in_threadpool(profile.call, func, *args)
+    if process_mode():
+        return await asyncio.get_running_loop().run_in_executor(get_process_pool(), func, *args)
+    return await run_in_threadpool(func, *args)
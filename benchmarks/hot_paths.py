@@ -0,0 +1,194 @@
+"""Microbenchmarks of the sanitization and similarity hot paths.
+
+Times sanitize_input_prompt, sanitize_output_response, ContentModerator.calculate_risk,
+cosine_similarity_tfidf and jaccard_similarity across prompt lengths (10 characters to well
+past MAX_QUERY_LENGTH), disallowed-phrase list sizes and adversarial inputs, with the
+sanitization result cache disabled, plus one cached repeated prompt. Results are
+written as JSON; --compare checks them against a stored baseline and exits with status 1
+if any case got slower by more than --threshold.
+
+Run from the repository root:
+
+    python -m benchmarks.hot_paths --output baseline.json
+    python -m benchmarks.hot_paths --output current.json --compare baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import string
+import sys
+import time
+import timeit
+
+# sanitize_input_prompt needs a query length limit
+os.environ.setdefault("MAX_QUERY_LENGTH", "512")
+
+import app.sanitize as sanitize  # noqa: E402
+from app.sanitize import ContentModerator, sanitize_input_prompt, sanitize_output_response  # noqa: E402
+from app.similarity import cosine_similarity_tfidf, jaccard_similarity  # noqa: E402
+
+MAX_QUERY_LENGTH = int(os.environ["MAX_QUERY_LENGTH"])
+LENGTHS = [10, 100, MAX_QUERY_LENGTH, 4 * MAX_QUERY_LENGTH, 16 * MAX_QUERY_LENGTH]
+PHRASE_LIST_SIZES = [len(sanitize.DISALLOWED_PHRASES), 256, 4096]
+WORDS = (
+    "the model should explain how machine learning systems learn from data and why "
+    "careful evaluation matters for every prompt that reaches the service"
+).split()
+
+
+def natural_text(length, rng):
+    """Plain English-like text of exactly `length` characters with an occasional policy hit"""
+    words = []
+    while sum(len(w) + 1 for w in words) < length:
+        roll = rng.random()
+        words.append("kill" if roll < 0.01 else "shit" if roll < 0.02 else rng.choice(WORDS))
+    return " ".join(words)[:length]
+
+
+def adversarial_inputs(length):
+    """Inputs that stress the regexes, tokenizers and transliteration"""
+    return {
+        "no_whitespace": "a" * length,
+        "near_miss_phrases": ("kil bom attac hac " * length)[:length],
+        "split_profanity": ("s h i t f u c k " * length)[:length],
+        "leetspeak": ("5h1t @ss b1tch " * length)[:length],
+        "injection_bait": ("bypass the " * length)[:length],
+        "unclosed_special_tokens": ("<| " * length)[:length],
+        "non_ascii": ("héllo wörld ñandú " * length)[:length],
+    }
+
+
+def random_phrases(count, rng):
+    phrases = set(sanitize.DISALLOWED_PHRASES)
+    while len(phrases) < count:
+        phrases.add("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10))))
+    return sorted(phrases)
+
+
+def measure(func, repeat, min_time):
+    """Best and median time per call in microseconds"""
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    times = sorted(t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number))
+    return {"best_us": times[0], "median_us": times[len(times) // 2], "number": number, "repeat": repeat}
+
+
+def cases(rng, quick):
+    """(name, callable) for every benchmark case"""
+    moderator = ContentModerator()
+    lengths = LENGTHS[:-1] if quick else LENGTHS
+
+    for length in lengths:
+        text, other = natural_text(length, rng), natural_text(length, rng)
+        yield f"sanitize_input_prompt/length={length}", lambda t=text: sanitize_input_prompt(t)
+        yield f"sanitize_output_response/length={length}", lambda t=text: sanitize_output_response(t)
+        yield f"calculate_risk/length={length}", lambda t=text: moderator.calculate_risk(t)
+        yield f"cosine_similarity_tfidf/length={length}", lambda t=text, o=other: cosine_similarity_tfidf(t, o)
+        yield f"jaccard_similarity/length={length}", lambda t=text, o=other: jaccard_similarity(t, o)
+
+    for name, text in adversarial_inputs(MAX_QUERY_LENGTH if quick else 4 * MAX_QUERY_LENGTH).items():
+        yield f"sanitize_input_prompt/adversarial={name}", lambda t=text: sanitize_input_prompt(t)
+        yield f"sanitize_output_response/adversarial={name}", lambda t=text: sanitize_output_response(t)
+        yield f"calculate_risk/adversarial={name}", lambda t=text: moderator.calculate_risk(t)
+
+
+def phrase_list_cases(rng):
+    """(name, callable, phrases) for the phrase-list size sweep at MAX_QUERY_LENGTH"""
+    text = natural_text(MAX_QUERY_LENGTH, rng)
+    moderator = ContentModerator()
+    for size in PHRASE_LIST_SIZES:
+        phrases = random_phrases(size, rng)
+        yield f"sanitize_input_prompt/phrases={size}", lambda: sanitize_input_prompt(text), phrases
+        yield f"calculate_risk/phrases={size}", lambda: moderator.calculate_risk(text), phrases
+
+
+def run(quick=False, repeat=5, min_time=0.2):
+    rng = random.Random(0)
+    results = {}
+
+    def record(name, func):
+        func()  # Warm caches and compiled patterns outside the timed runs
+        results[name] = measure(func, repeat, min_time)
+        print(f"{name:<60} {results[name]['best_us']:>12.1f} us", file=sys.stderr)
+
+    # Measure sanitization itself, not lookups in the result cache
+    cache_size = sanitize.sanitize_cache.maxsize
+    sanitize.sanitize_cache.maxsize = 0
+    try:
+        for name, func in cases(rng, quick):
+            record(name, func)
+    finally:
+        sanitize.sanitize_cache.maxsize = cache_size
+
+    text = natural_text(MAX_QUERY_LENGTH, rng)
+    record(f"sanitize_input_prompt/cached/length={MAX_QUERY_LENGTH}", lambda: sanitize_input_prompt(text))
+
+    default_phrases = sanitize.DISALLOWED_PHRASES
+    sanitize.sanitize_cache.maxsize = 0
+    try:
+        for name, func, phrases in phrase_list_cases(rng):
+            # The phrase matcher is rebuilt when the list is replaced
+            sanitize.DISALLOWED_PHRASES = phrases
+            record(name, func)
+    finally:
+        sanitize.DISALLOWED_PHRASES = default_phrases
+        sanitize.sanitize_cache.maxsize = cache_size
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "max_query_length": MAX_QUERY_LENGTH,
+            "quick": quick,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Rows of (name, baseline us, current us, ratio, regressed) for cases present in both runs"""
+    rows = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before, after = baseline["results"][name]["best_us"], result["best_us"]
+        ratio = after / before if before else float("inf")
+        rows.append((name, before, after, ratio, ratio > 1 + threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sanitization and similarity hot paths")
+    parser.add_argument("--output", help="Write results to this JSON file (default: stdout)")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against a stored results file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative slowdown that counts as a regression (default: 0.2)")
+    parser.add_argument("--quick", action="store_true", help="Fewer repeats and no 16x length cases")
+    args = parser.parse_args()
+
+    results = run(quick=args.quick, repeat=3 if args.quick else 5, min_time=0.05 if args.quick else 0.2)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.threshold)
+        print(f"{'case':<60} {'baseline (us)':>14} {'current (us)':>13} {'ratio':>7}", file=sys.stderr)
+        for name, before, after, ratio, regressed in rows:
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{name:<60} {before:>14.1f} {after:>13.1f} {ratio:>6.2f}x{flag}", file=sys.stderr)
+        if any(row[4] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
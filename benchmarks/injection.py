@@ -0,0 +1,126 @@
+"""Adversarial and fuzz benchmark of injection pattern detection.
+
+Times the combined InjectionMatcher against the original patterns, applied one after another
+with re.sub, on inputs built to make backtracking regexes do quadratic work (repeated
+"bypass" with no "filter", unclosed "<|" tokens, long runs of whitespace after "ignore") and
+on seeded random mixes of pattern fragments. Each family is timed at growing lengths; the
+matcher only scans its first max_scan characters, so its time must stop growing once the
+input is longer than that. --check exits with status 1 if the matcher's time grows
+superlinearly between any two lengths, or keeps growing past the scan budget.
+
+Run from the repository root:
+
+    python -m benchmarks.injection
+    python -m benchmarks.injection --check --output injection.json
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+import timeit
+
+from app.matcher import MAX_INJECTION_SCAN, InjectionMatcher
+from app.sanitize import INJECTION_PATTERNS
+
+# The patterns as they were before they were rewritten with bounded gaps
+LEGACY_PATTERNS = [
+    r"(ignore|disregard)\s+(all|previous)?\s*(instructions|rules)",
+    r"pretend\s+(to|you are)",
+    r"bypass.*filter",
+    r"(as\s+an\s+AI\s+language\s+model)",
+    r"<\|.*?\|>",
+    r"system:\s*",
+]
+
+LENGTHS = [1024, 4096, 16384, 65536, 262144]
+# The legacy patterns are quadratic on some families; longer inputs would take minutes
+LEGACY_MAX_LENGTH = 16384
+FRAGMENTS = ["bypass", "filter", "<|", "|>", "ignore", "all", "rules", "pretend", "system", ":", "as an", " ", "\n", "x"]
+
+
+def adversarial_inputs(length, rng):
+    """Inputs that make a backtracking engine retry a long match from every position"""
+    return {
+        "bypass_no_filter": ("bypass " * length)[:length],
+        "unclosed_special_tokens": ("<| " * length)[:length],
+        "ignore_whitespace": ("ignore" + " " * length)[:length],
+        "as_an_ai_prefix": ("as an AI " * length)[:length],
+        "fuzz": "".join(rng.choice(FRAGMENTS) for _ in range(length))[:length],
+    }
+
+
+def legacy_scan(text):
+    for pattern in LEGACY_PATTERNS:
+        text = re.sub(pattern, "[redacted]", text, flags=re.IGNORECASE)
+    return text
+
+
+def best_time(func, repeat):
+    """Best time per call in seconds"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(repeat=3, lengths=LENGTHS, seed=0):
+    matcher = InjectionMatcher(INJECTION_PATTERNS)
+    results = {}
+    for length in lengths:
+        for name, text in adversarial_inputs(length, random.Random(seed)).items():
+            row = results.setdefault(name, {})
+            row[length] = {"matcher_us": best_time(lambda: matcher.scan(text), repeat) * 1e6}
+            if length <= LEGACY_MAX_LENGTH:
+                row[length]["legacy_us"] = best_time(lambda: legacy_scan(text), repeat) * 1e6
+            legacy = row[length].get("legacy_us")
+            print(f"{name:<26} {length:>8} {row[length]['matcher_us']:>12.1f} us "
+                  f"{'' if legacy is None else f'{legacy:>14.1f} us'}", file=sys.stderr)
+    return results
+
+
+def check(results, max_scan=MAX_INJECTION_SCAN, slack=2.0):
+    """Cases where the matcher's time grew faster than the scanned length, with `slack` for noise"""
+    failures = []
+    for name, rows in results.items():
+        lengths = sorted(rows)
+        for shorter, longer in zip(lengths, lengths[1:]):
+            growth = min(longer, max_scan) / min(shorter, max_scan)
+            ratio = rows[longer]["matcher_us"] / rows[shorter]["matcher_us"]
+            if ratio > growth * slack:
+                failures.append((name, shorter, longer, ratio, growth))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark injection detection on adversarial and fuzzed inputs")
+    parser.add_argument("--output", help="Write results to this JSON file (default: stdout)")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 if the matcher scales superlinearly")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'input':<26} {'length':>8} {'matcher':>15} {'legacy re.sub':>17}", file=sys.stderr)
+    results = run(repeat=args.repeat, seed=args.seed)
+    report = {
+        "max_scan": MAX_INJECTION_SCAN,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": {name: {str(length): row for length, row in rows.items()} for name, rows in results.items()},
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.check:
+        failures = check(results)
+        for name, shorter, longer, ratio, growth in failures:
+            print(f"SUPERLINEAR {name}: {shorter} -> {longer} took {ratio:.1f}x for {growth:.1f}x the text", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
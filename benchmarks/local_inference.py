@@ -0,0 +1,139 @@
+"""CPU inference benchmark of the local model across inference profiles.
+
+Every profile is loaded in a fresh subprocess, so its torch thread settings take effect and
+its memory is measured on its own. Each prompt generates exactly --max-new-tokens tokens
+(greedy, with min_new_tokens), without moderation stopping, so all profiles do the same
+work. Reports generated tokens per second, load time, resident memory after loading and
+peak resident memory, plus the first output so quantization quality can be compared.
+
+Run from the repository root (the model is downloaded on first use):
+
+    python -m benchmarks.local_inference
+    python -m benchmarks.local_inference --profiles fp32,int8 --intra-op-threads 4 --output local.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+# The service's own model manager is used, without preloading at import
+os.environ.setdefault("LOCAL_MODEL_PRELOAD", "false")
+
+from app.llm import MODEL_NAME, InferenceProfile, LocalModelManager  # noqa: E402
+
+PROFILES = {
+    "fp32_no_grad": InferenceProfile(quantize=False, inference_mode=False),
+    "fp32": InferenceProfile(quantize=False, inference_mode=True),
+    "int8": InferenceProfile(quantize=True, inference_mode=True),
+}
+
+PROMPTS = [
+    "Explain how machine learning models learn from data.",
+    "Write a short note about the history of the printing press.",
+    "What are good habits for writing maintainable software?",
+    "Describe the water cycle to a ten year old.",
+]
+
+
+def rss_mb() -> float:
+    """Current resident set size in MiB, from /proc on Linux"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return float("nan")
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def run_profile(profile: InferenceProfile, max_new_tokens: int, batch_size: int, repeat: int) -> dict:
+    """Load the model with one profile and time its generations in this process"""
+    manager = LocalModelManager(MODEL_NAME, warmup_prompt="Hello", warmup_tokens=8, profile=profile)
+    start = time.perf_counter()
+    manager.load()
+    load_s = time.perf_counter() - start
+    loaded_rss = rss_mb()
+
+    kwargs = {"max_new_tokens": max_new_tokens, "min_new_tokens": max_new_tokens, "do_sample": False}
+    sample = None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for i in range(0, len(PROMPTS), batch_size):
+            batch = PROMPTS[i:i + batch_size]
+            outputs = manager(batch, batch_size=len(batch), **kwargs)
+            if sample is None:
+                sample = outputs[0][0]["generated_text"]
+    elapsed = time.perf_counter() - start
+    tokens = repeat * len(PROMPTS) * max_new_tokens
+
+    return {
+        "profile": profile._asdict(),
+        "load_s": load_s,
+        "generated_tokens": tokens,
+        "elapsed_s": elapsed,
+        "tokens_per_s": tokens / elapsed,
+        "rss_loaded_mb": loaded_rss,
+        "rss_peak_mb": peak_rss_mb(),
+        "sample": sample,
+    }
+
+
+def run_in_subprocess(name: str, args) -> dict:
+    command = [
+        sys.executable, "-m", "benchmarks.local_inference", "--run-profile", name,
+        "--max-new-tokens", str(args.max_new_tokens), "--batch-size", str(args.batch_size),
+        "--repeat", str(args.repeat), "--intra-op-threads", str(args.intra_op_threads),
+        "--inter-op-threads", str(args.inter_op_threads),
+    ]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, check=True, text=True)
+    return json.loads(completed.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark local model inference profiles on CPU")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help=f"Comma-separated profiles (default: all of {', '.join(PROFILES)})")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=1, help="Prompts generated together (default: 1)")
+    parser.add_argument("--repeat", type=int, default=2, help="Passes over the prompts (default: 2)")
+    parser.add_argument("--intra-op-threads", type=int, default=0, help="torch intra-op threads for every profile (default: torch default)")
+    parser.add_argument("--inter-op-threads", type=int, default=0, help="torch inter-op threads for every profile (default: torch default)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--run-profile", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_profile:
+        profile = PROFILES[args.run_profile]._replace(
+            intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads)
+        json.dump(run_profile(profile, args.max_new_tokens, args.batch_size, args.repeat), sys.stdout)
+        return
+
+    names = [name.strip() for name in args.profiles.split(",") if name.strip()]
+    unknown = [name for name in names if name not in PROFILES]
+    if unknown:
+        parser.error(f"unknown profiles: {', '.join(unknown)}")
+
+    results = {}
+    print(f"{'profile':<14} {'tokens/s':>9} {'load s':>8} {'RSS MiB':>9} {'peak MiB':>9}", file=sys.stderr)
+    for name in names:
+        result = results[name] = run_in_subprocess(name, args)
+        print(f"{name:<14} {result['tokens_per_s']:>9.2f} {result['load_s']:>8.1f} "
+              f"{result['rss_loaded_mb']:>9.0f} {result['rss_peak_mb']:>9.0f}", file=sys.stderr)
+
+    report = {"model": MODEL_NAME, "config": {k: v for k, v in vars(args).items() if k not in ("output", "run_profile")}, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
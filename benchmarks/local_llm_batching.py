@@ -0,0 +1,53 @@
+"""Throughput of local_llm generation with and without micro-batching under concurrency.
+
+Needs the local model (downloaded on first run). Run from the repository root:
+
+    python -m benchmarks.local_llm_batching [--concurrency 8] [--requests 32]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.batching import MicroBatcher
+from app.llm import LOCAL_LLM_MAX_WAIT_MS, local_model
+
+PROMPTS = [
+    "Tell me about AI",
+    "What is machine learning?",
+    "Define deep learning",
+    "Explain artificial intelligence to me",
+]
+MAX_NEW_TOKENS = 32
+
+
+def run(batcher, concurrency, requests):
+    tokenizer = local_model.load().tokenizer
+
+    def generate(i):
+        prompt = PROMPTS[i % len(PROMPTS)]
+        text = batcher.submit(prompt, max_new_tokens=MAX_NEW_TOKENS, do_sample=False)[0]["generated_text"]
+        return len(tokenizer(text)["input_ids"]) - len(tokenizer(prompt)["input_ids"])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        tokens = sum(pool.map(generate, range(requests)))
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, tokens / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=32)
+    args = parser.parse_args()
+
+    local_model.load()
+    print(f"{'max batch':>9} {'requests/s':>11} {'tokens/s':>9}")
+    for max_batch_size in (1, 4, args.concurrency):
+        batcher = MicroBatcher(local_model, max_batch_size=max_batch_size, max_wait=LOCAL_LLM_MAX_WAIT_MS / 1000)
+        requests_per_second, tokens_per_second = run(batcher, args.concurrency, args.requests)
+        print(f"{max_batch_size:>9} {requests_per_second:>11.2f} {tokens_per_second:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
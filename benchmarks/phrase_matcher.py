@@ -0,0 +1,74 @@
+"""Compare the per-phrase scan with the compiled PhraseMatcher as the phrase list grows.
+
+Run from the repository root:
+
+    python -m benchmarks.phrase_matcher
+"""
+import random
+import re
+import string
+import timeit
+
+from app.matcher import PhraseMatcher
+
+LIST_SIZES = [16, 256, 1024, 4096, 16384]
+TEXT_LENGTH = 512
+REPEAT = 5
+
+
+def random_phrases(count, rng):
+    words = set()
+    while len(words) < count:
+        length = rng.randint(4, 10)
+        words.add("".join(rng.choice(string.ascii_lowercase) for _ in range(length)))
+    return sorted(words)
+
+
+def random_text(phrases, rng):
+    words = []
+    while sum(len(w) + 1 for w in words) < TEXT_LENGTH:
+        words.append(rng.choice(phrases) if rng.random() < 0.02 else "".join(
+            rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 8))
+        ))
+    return " ".join(words)[:TEXT_LENGTH]
+
+
+def legacy_scan(text, phrases):
+    """Previous behaviour: a substring check per phrase, then a fresh alternation regex"""
+    found = sum(1 for p in phrases if p in text.lower())
+    if any(p in text.lower() for p in phrases):
+        text = re.sub(
+            r"\b(" + "|".join(re.escape(p) for p in phrases) + r")\b",
+            "[redacted]",
+            text,
+            flags=re.IGNORECASE
+        )
+    return found, text
+
+
+def compiled_scan(text, matcher):
+    matches = matcher.scan(text)
+    return len(matches.counts), matcher.redact(text, matches)
+
+
+def best_of(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=REPEAT)) / number * 1e6
+
+
+def main():
+    rng = random.Random(0)
+    print(f"{'phrases':>8} {'legacy (us)':>12} {'compiled (us)':>14} {'speedup':>8}")
+    for size in LIST_SIZES:
+        phrases = random_phrases(size, rng)
+        text = random_text(phrases, rng)
+        matcher = PhraseMatcher(phrases)
+        assert legacy_scan(text, phrases)[1] == compiled_scan(text, matcher)[1]
+
+        number = max(1, 20000 // size)
+        legacy = best_of(lambda: legacy_scan(text, phrases), number)
+        compiled = best_of(lambda: compiled_scan(text, matcher), 200)
+        print(f"{size:>8} {legacy:>12.1f} {compiled:>14.1f} {legacy / compiled:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""Deterministic load replay of request traces against the service.
+
+A trace has one JSON request per line, in the requests.jsonl layout: an optional
+"request_id", an optional "path" (default /check_prompt_similarity) and the request payload
+under "body" (an object or a JSON string). A line without "body" is used as the payload
+itself. The OpenAI and local LLM backends are replaced by stubs with a fixed latency, and
+the trace is replayed either at a fixed concurrency (closed loop) or at a fixed arrival rate
+(open loop), in-process through ASGI or over a local socket. Single, batch and streaming
+similarity requests are classified by outcome; responses of other endpoints are counted as
+"other".
+
+Run from the repository root:
+
+    python -m benchmarks.replay benchmarks/traces/sample.jsonl --concurrency 16
+    python -m benchmarks.replay benchmarks/traces/sample.jsonl --rate 200 --duration 10 --socket
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional
+from unittest.mock import patch
+
+import httpx
+
+# sanitize_input_prompt needs a query length limit; the local model is never loaded here
+os.environ.setdefault("MAX_QUERY_LENGTH", "512")
+os.environ.setdefault("LOCAL_MODEL_PRELOAD", "false")
+
+OUTCOMES = ("rejected", "dissimilar", "llm_answered", "shed", "error", "other")
+
+# A batch is classified by the outcome of its pairs that comes first here
+BATCH_OUTCOME_ORDER = ("llm_answered", "shed", "error", "dissimilar", "rejected")
+
+REJECTED_MESSAGE = "Content violates safety policies."
+
+
+class TraceRequest(NamedTuple):
+    request_id: str
+    path: str
+    payload: dict
+
+
+class Sample(NamedTuple):
+    request_id: str
+    outcome: str
+    latency: float
+
+
+def load_trace(path: str) -> List[TraceRequest]:
+    requests = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            payload = record.get("body", record)
+            if isinstance(payload, str):
+                payload = json.loads(payload)
+            requests.append(TraceRequest(
+                str(record.get("request_id", number)),
+                record.get("path", "/check_prompt_similarity"),
+                payload
+            ))
+    return requests
+
+
+def classify_pair(result: dict) -> str:
+    """Outcome of one pair of a /check_prompt_similarity/batch response"""
+    if result.get("status_code") == 400:
+        return "rejected" if result.get("llm_response") == REJECTED_MESSAGE else "error"
+    if result.get("status_code") == 503:
+        return "shed"
+    if result.get("status_code") != 200:
+        return "error"
+    return "llm_answered" if result.get("is_similar") else "dissimilar"
+
+
+def classify_stream(body: str) -> str:
+    """Outcome of the server-sent events of a /check_prompt_similarity/stream response"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n") if ": " in line)
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields.get("data", "{}"))))
+    if not events or events[-1][0] != "done":
+        return "error"
+    if events[-1][1].get("status") == "rejected":
+        return "rejected"
+    metadata = next((data for event, data in events if event == "metadata"), {})
+    return "llm_answered" if metadata.get("is_similar") else "dissimilar"
+
+
+def classify(path: str, response: httpx.Response) -> str:
+    """Outcome of a similarity response; responses of other endpoints are "other"."""
+    if response.status_code == 503:
+        return "shed"
+    if response.status_code == 400:
+        try:
+            rejected = response.json().get("status") == "rejected"
+        except ValueError:
+            rejected = False
+        return "rejected" if rejected else "error"
+    if response.status_code != 200:
+        return "error"
+    if path == "/check_prompt_similarity":
+        return "llm_answered" if response.json().get("is_similar") else "dissimilar"
+    if path == "/check_prompt_similarity/batch":
+        outcomes = {classify_pair(result) for result in response.json()}
+        return next((outcome for outcome in BATCH_OUTCOME_ORDER if outcome in outcomes), "other")
+    if path == "/check_prompt_similarity/stream":
+        return classify_stream(response.text)
+    return "other"
+
+
+@contextmanager
+def stub_backends(openai_latency: float, local_latency: float, cache: bool = True):
+    """Replace both LLM backends with stubs that answer after a fixed latency"""
+    import app.main
+
+    async def openai_stub(prompt):
+        await asyncio.sleep(openai_latency)
+        return f"Stub answer to: {prompt}"
+
+    def local_stub(prompt):
+        # The real local backend blocks a threadpool thread for the whole generation
+        time.sleep(local_latency)
+        return f"{prompt} stub answer"
+
+    async def openai_stream_stub(prompt):
+        await asyncio.sleep(openai_latency)
+        yield f"Stub answer to: {prompt}"
+
+    def local_stream_stub(prompt):
+        time.sleep(local_latency)
+        yield f"{prompt} stub answer"
+
+    with patch.object(app.main, "get_llm_response_async", openai_stub), \
+         patch.object(app.main, "get_local_llm_response", local_stub), \
+         patch.object(app.main, "stream_llm_response_async", openai_stream_stub), \
+         patch.object(app.main, "stream_local_llm_response", local_stream_stub), \
+         patch.object(app.main.response_cache, "maxsize", app.main.response_cache.maxsize if cache else 0):
+        app.main.response_cache.clear()
+        yield app.main.app
+
+
+@contextmanager
+def serve(app):
+    """Run the app with uvicorn on a free local port in a background thread"""
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+async def send(client: httpx.AsyncClient, request: TraceRequest) -> Sample:
+    start = time.perf_counter()
+    try:
+        response = await client.post(request.path, json=request.payload)
+        outcome = classify(request.path, response)
+    except httpx.HTTPError:
+        outcome = "error"
+    return Sample(request.request_id, outcome, time.perf_counter() - start)
+
+
+async def closed_loop(client, requests: List[TraceRequest], concurrency: int) -> List[Sample]:
+    """Each of `concurrency` workers sends the next request as soon as its previous one returns"""
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+    samples = []
+
+    async def worker():
+        while not queue.empty():
+            samples.append(await send(client, queue.get_nowait()))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+async def open_loop(client, requests: List[TraceRequest], rate: float, poisson: bool, seed: int) -> List[Sample]:
+    """Requests start on a fixed schedule of `rate` per second, whether or not earlier ones finished"""
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    at, tasks = 0.0, []
+    for request in requests:
+        delay = start + at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(client, request)))
+        at += rng.expovariate(rate) if poisson else 1 / rate
+    return list(await asyncio.gather(*tasks))
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+def summarize(samples: List[Sample], elapsed: float) -> Dict:
+    def stats(latencies):
+        latencies = sorted(latencies)
+        return {
+            "count": len(latencies),
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        }
+
+    report = {"requests": len(samples), "elapsed_s": elapsed, "throughput_rps": len(samples) / elapsed if elapsed else 0.0}
+    report["all"] = stats([s.latency for s in samples])
+    report["outcomes"] = {
+        outcome: stats([s.latency for s in samples if s.outcome == outcome])
+        for outcome in OUTCOMES if any(s.outcome == outcome for s in samples)
+    }
+    return report
+
+
+async def replay(requests: List[TraceRequest], base_url: Optional[str], app=None, concurrency: int = 8,
+                 rate: float = None, poisson: bool = False, seed: int = 0) -> Dict:
+    if base_url is None:
+        transport = httpx.ASGITransport(app=app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=None)
+    else:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        client = httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits)
+    async with client:
+        start = time.perf_counter()
+        if rate:
+            samples = await open_loop(client, requests, rate, poisson, seed)
+        else:
+            samples = await closed_loop(client, requests, concurrency)
+        return summarize(samples, time.perf_counter() - start)
+
+
+def print_report(report: Dict) -> None:
+    print(f"{report['requests']} requests in {report['elapsed_s']:.2f}s, {report['throughput_rps']:.1f} req/s", file=sys.stderr)
+    print(f"{'outcome':<14} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}", file=sys.stderr)
+    for outcome, stats in [("all", report["all"])] + list(report["outcomes"].items()):
+        print(f"{outcome:<14} {stats['count']:>7} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a request trace against the service with stubbed LLM backends")
+    parser.add_argument("trace", help="JSON lines trace file")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=int, default=8, help="Closed loop: requests in flight (default: 8)")
+    load.add_argument("--rate", type=float, help="Open loop: arrivals per second")
+    parser.add_argument("--poisson", action="store_true", help="Open loop with seeded exponential inter-arrival times")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the trace this many times")
+    parser.add_argument("--duration", type=float, help="Open loop: repeat the trace to cover this many seconds")
+    parser.add_argument("--openai-latency-ms", type=float, default=300.0)
+    parser.add_argument("--local-latency-ms", type=float, default=1000.0)
+    parser.add_argument("--no-cache", action="store_true", help="Disable the response cache")
+    parser.add_argument("--socket", action="store_true", help="Serve with uvicorn on a local port instead of in-process ASGI")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    requests = load_trace(args.trace)
+    repeat = args.repeat
+    if args.rate and args.duration:
+        repeat = max(repeat, int(args.rate * args.duration / len(requests)) + 1)
+        requests = (requests * repeat)[:int(args.rate * args.duration)]
+    else:
+        requests = requests * repeat
+
+    with stub_backends(args.openai_latency_ms / 1000, args.local_latency_ms / 1000, cache=not args.no_cache) as app:
+        def run(base_url=None):
+            return asyncio.run(replay(requests, base_url, app, args.concurrency, args.rate, args.poisson, args.seed))
+
+        if args.socket:
+            with serve(app) as base_url:
+                report = run(base_url)
+        else:
+            report = run()
+
+    report["config"] = {k: v for k, v in vars(args).items() if k != "output"}
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
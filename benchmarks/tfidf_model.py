@@ -0,0 +1,125 @@
+"""Compare the per-request TF-IDF fit with pre-fitted models on latency and score quality.
+
+Run from the repository root, optionally with a reference corpus (one document per line):
+
+    python -m benchmarks.tfidf_model [--corpus corpus.txt]
+
+Score quality is reported on labeled similar/different prompt pairs: the mean score of each
+group, the margin between them and how often the SIMILARITY_THRESHOLD decision is correct.
+The labeled prompts are never part of the reference corpus the models are fitted on.
+"""
+import argparse
+import timeit
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from app.tfidf import TfidfModel
+
+SIMILARITY_THRESHOLD = 0.4
+REPEAT = 5
+NUMBER = 200
+
+SIMILAR_PAIRS = [
+    ("Tell me about AI", "Explain artificial intelligence to me"),
+    ("What is machine learning?", "Describe machine learning"),
+    ("Define deep learning", "What does deep learning mean?"),
+    ("How do I cook pasta?", "What is the best way to cook pasta?"),
+    ("Explain quantum computing", "How does quantum computing work?"),
+    ("Tell me about the stock market", "How does the stock market work?"),
+]
+
+DIFFERENT_PAIRS = [
+    ("What's the weather like today?", "Explain quantum computing"),
+    ("How do I cook pasta?", "Tell me about the stock market"),
+    ("Describe a cat", "How does an airplane work?"),
+    ("What is machine learning?", "Tell me about the history of Rome"),
+    ("Define deep learning", "How do I fix a flat tire?"),
+    ("Tell me about AI", "What is the capital of France?"),
+]
+
+# The scored prompts are held out of every reference corpus, so the fitted models are scored
+# on text they have not seen, as they are in production
+HELD_OUT = {prompt for pair in SIMILAR_PAIRS + DIFFERENT_PAIRS for prompt in pair}
+
+DEFAULT_CORPUS = [
+    "What is artificial intelligence used for?",
+    "How are machine learning models trained?",
+    "Explain neural networks and deep learning",
+    "Give me a recipe for tomato pasta sauce",
+    "How do I cook rice on the stove?",
+    "What is a qubit in quantum computing?",
+    "How do I invest in the stock market?",
+    "What will the weather be tomorrow?",
+    "How do I take care of a cat?",
+    "Tell me about ancient Rome and its emperors",
+    "How do I change a car tire?",
+    "What is the capital of Germany?",
+    "Tell me about the history of computers",
+    "What is the difference between a virus and bacteria?",
+    "How do I write a cover letter?",
+    "Explain how vaccines work",
+    "What is the meaning of life?",
+    "Describe the water cycle",
+    "How does the internet work?",
+    "What are the benefits of exercise?",
+    "Tell me a story about a dragon",
+    "How do I learn to play the guitar?",
+    "What is the tallest mountain in the world?",
+    "Explain the theory of relativity",
+    "What is a black hole?",
+    "How do airplanes fly?",
+    "Describe the rules of chess",
+    "What is photosynthesis?",
+]
+
+
+def per_request_fit(prompt1, prompt2):
+    """Previous behaviour: fit a new vectorizer on the two prompts"""
+    vectorizer = TfidfVectorizer().fit([prompt1, prompt2])
+    vectors = vectorizer.transform([prompt1, prompt2])
+    return cosine_similarity(vectors[0], vectors[1])[0][0]
+
+
+def quality(score):
+    similar = [score(p1, p2) for p1, p2 in SIMILAR_PAIRS]
+    different = [score(p1, p2) for p1, p2 in DIFFERENT_PAIRS]
+    correct = sum(s >= SIMILARITY_THRESHOLD for s in similar) + sum(s < SIMILARITY_THRESHOLD for s in different)
+    mean_similar = sum(similar) / len(similar)
+    mean_different = sum(different) / len(different)
+    return mean_similar, mean_different, correct / (len(similar) + len(different))
+
+
+def latency(score):
+    p1, p2 = SIMILAR_PAIRS[0]
+    return min(timeit.repeat(lambda: score(p1, p2), number=NUMBER, repeat=REPEAT)) / NUMBER * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="Reference corpus, one document per line")
+    args = parser.parse_args()
+
+    corpus = DEFAULT_CORPUS
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as corpus_file:
+            corpus = [line.strip() for line in corpus_file if line.strip()]
+    held_out = sum(document in HELD_OUT for document in corpus)
+    corpus = [document for document in corpus if document not in HELD_OUT]
+
+    modes = {
+        "per-request fit": per_request_fit,
+        "fitted vocabulary": TfidfModel().fit(corpus).similarity,
+        "fitted hashing": TfidfModel(hashing=True).fit(corpus).similarity,
+    }
+
+    print(f"reference corpus: {len(corpus)} documents ({held_out} scored prompts held out)")
+    print(f"{'mode':<18} {'latency (us)':>12} {'similar':>8} {'different':>10} {'margin':>7} {'accuracy':>9}")
+    for name, score in modes.items():
+        mean_similar, mean_different, accuracy = quality(score)
+        print(f"{name:<18} {latency(score):>12.1f} {mean_similar:>8.3f} {mean_different:>10.3f} "
+              f"{mean_similar - mean_different:>7.3f} {accuracy:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from app.admission import AdmissionController, AdmissionRejected
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAdmissionController:
+    def test_concurrency_limit_and_fifo_handoff(self):
+        # Test that requests beyond the limit wait and get freed slots in arrival order
+        controller = AdmissionController("local_llm", max_concurrency=2, max_queue=4, max_wait=5)
+        running, peak, order = 0, 0, []
+
+        async def call(i):
+            nonlocal running, peak
+            async with controller.slot():
+                running += 1
+                peak = max(peak, running)
+                order.append(i)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        async def run():
+            await asyncio.gather(*(call(i) for i in range(6)))
+
+        asyncio.run(run())
+        assert peak == 2
+        assert order == list(range(6))
+        assert controller.active == 0 and controller.queued() == 0
+        assert controller.service_time is not None
+
+    def test_queue_full_rejected(self):
+        # Test that a request is shed once the wait queue is full
+        controller = AdmissionController("openai", max_concurrency=1, max_queue=1, max_wait=5)
+
+        async def run():
+            await controller.acquire()
+            waiter = asyncio.ensure_future(controller.acquire())
+            await asyncio.sleep(0)
+            with pytest.raises(AdmissionRejected) as rejected:
+                await controller.acquire()
+            controller.release()
+            await waiter
+            controller.release()
+            return rejected.value
+
+        rejected = asyncio.run(run())
+        assert rejected.reason == "queue_full"
+        assert rejected.backend == "openai"
+        assert rejected.retry_after >= 1
+        assert controller.active == 0
+
+    def test_deadline_that_cannot_be_met_rejected_early(self):
+        # Test that the estimated wait plus one call is compared with the deadline
+        clock = FakeClock()
+        controller = AdmissionController("local_llm", max_concurrency=1, max_queue=10, max_wait=60, clock=clock)
+        controller.service_time = 2.0
+        controller._active = 1
+        controller._waiters.extend([object(), object()])
+
+        # Three calls ahead and one of its own: at least 8 seconds
+        with pytest.raises(AdmissionRejected) as rejected:
+            controller.check(deadline=clock.now + 7)
+        assert rejected.value.reason == "deadline"
+        assert rejected.value.retry_after == 6
+        assert controller.check(deadline=clock.now + 9) == clock.now + 7
+
+    def test_idle_backend_admits_without_deadline(self):
+        # Test that a free slot is taken at once and the wait is capped by max_wait
+        clock = FakeClock()
+        controller = AdmissionController("openai", max_concurrency=1, max_queue=0, max_wait=3, clock=clock)
+        assert controller.check() == clock.now + 3
+        with pytest.raises(AdmissionRejected):
+            controller.check(deadline=clock.now - 1)
+
+    def test_waiter_gives_up_at_deadline(self):
+        # Test that a request still queued when its wait must end is rejected and leaves the queue
+        controller = AdmissionController("local_llm", max_concurrency=1, max_queue=4, max_wait=0.05)
+
+        async def run():
+            await controller.acquire()
+            with pytest.raises(AdmissionRejected) as rejected:
+                await controller.acquire()
+            assert controller.queued() == 0
+            controller.release()
+            return rejected.value
+
+        assert asyncio.run(run()).reason == "deadline"
+        assert controller.active == 0
+
+    def test_cancelled_waiter_does_not_take_slot(self):
+        # Test that a cancelled request is skipped when its slot would be handed over
+        controller = AdmissionController("local_llm", max_concurrency=1, max_queue=4, max_wait=5)
+
+        async def run():
+            await controller.acquire()
+            cancelled = asyncio.ensure_future(controller.acquire())
+            waiting = asyncio.ensure_future(controller.acquire())
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            await asyncio.sleep(0)
+            controller.release()
+            await waiting
+            controller.release()
+
+        asyncio.run(run())
+        assert controller.active == 0 and controller.queued() == 0
@@ -0,0 +1,92 @@
+import threading
+import pytest
+from unittest.mock import MagicMock
+from app.batching import MicroBatcher
+
+
+def fake_generate(prompts, **kwargs):
+    # Mimic the transformers pipeline for single prompts and lists of prompts
+    if isinstance(prompts, str):
+        return [{"generated_text": prompts + " out"}]
+    return [[{"generated_text": p + " out"}] for p in prompts]
+
+
+def submit_concurrently(batcher, prompts, **kwargs):
+    results = {}
+    barrier = threading.Barrier(len(prompts))
+
+    def run(prompt):
+        barrier.wait()
+        results[prompt] = batcher.submit(prompt, **kwargs)
+
+    threads = [threading.Thread(target=run, args=(p,)) for p in prompts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results
+
+
+class TestMicroBatcher:
+    def test_concurrent_prompts_batched(self):
+        # Test concurrent prompts are generated in one call and routed back to their callers
+        generate = MagicMock(side_effect=fake_generate)
+        batcher = MicroBatcher(generate, max_batch_size=4, max_wait=0.5)
+        results = submit_concurrently(batcher, ["a", "b", "c", "d"], max_new_tokens=5)
+
+        assert results == {p: [{"generated_text": p + " out"}] for p in "abcd"}
+        generate.assert_called_once()
+        assert sorted(generate.call_args.args[0]) == ["a", "b", "c", "d"]
+        assert generate.call_args.kwargs == {"batch_size": 4, "max_new_tokens": 5}
+
+    def test_flush_after_max_wait(self):
+        # Test a single prompt is flushed after the maximum wait
+        generate = MagicMock(side_effect=fake_generate)
+        batcher = MicroBatcher(generate, max_batch_size=8, max_wait=0.01)
+        assert batcher.submit("solo", max_new_tokens=5) == [{"generated_text": "solo out"}]
+        generate.assert_called_once_with("solo", max_new_tokens=5)
+
+    def test_batch_size_limit(self):
+        # Test batches never exceed the maximum size
+        generate = MagicMock(side_effect=fake_generate)
+        batcher = MicroBatcher(generate, max_batch_size=2, max_wait=0.2)
+        results = submit_concurrently(batcher, ["a", "b", "c", "d", "e"])
+        assert len(results) == 5
+        assert all(
+            isinstance(call.args[0], str) or len(call.args[0]) <= 2
+            for call in generate.call_args_list
+        )
+
+    def test_different_parameters_not_mixed(self):
+        # Test prompts with different generation parameters are generated separately
+        generate = MagicMock(side_effect=fake_generate)
+        batcher = MicroBatcher(generate, max_batch_size=4, max_wait=0.2)
+        barrier = threading.Barrier(2)
+        results = {}
+
+        def run(prompt, tokens):
+            barrier.wait()
+            results[prompt] = batcher.submit(prompt, max_new_tokens=tokens)
+
+        threads = [threading.Thread(target=run, args=("a", 5)), threading.Thread(target=run, args=("b", 10))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        assert generate.call_count == 2
+        assert {call.kwargs["max_new_tokens"] for call in generate.call_args_list} == {5, 10}
+
+    def test_errors_reach_every_caller(self):
+        # Test generation errors are raised to each caller of the batch
+        batcher = MicroBatcher(MagicMock(side_effect=Exception("Model response is missing")), max_batch_size=4, max_wait=0.01)
+        with pytest.raises(Exception) as exc_info:
+            batcher.submit("prompt")
+        assert "response is missing" in str(exc_info.value)
+
+    def test_batching_disabled(self):
+        # Test a batch size of 1 generates directly
+        generate = MagicMock(side_effect=fake_generate)
+        batcher = MicroBatcher(generate, max_batch_size=1)
+        assert batcher.submit("direct") == [{"generated_text": "direct out"}]
+        assert batcher._worker is None
@@ -0,0 +1,85 @@
+import numpy as np
+from app.cache import ResponseCache, normalize_prompt
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_normalize_prompt():
+    # Test prompts differing only in whitespace share a key, but case is kept
+    assert normalize_prompt("  Tell me\nabout  AI ") == normalize_prompt("Tell me about AI")
+    assert normalize_prompt("Tell me about AI") != normalize_prompt("tell me about ai")
+
+
+class TestResponseCache:
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        # Test exact hits by namespace and normalized prompt
+        self.cache.put(("openai", "gpt"), "Tell me about AI", {"sanitized_output": "AI is..."})
+        assert self.cache.get(("openai", "gpt"), "Tell me  about AI") == {"sanitized_output": "AI is..."}
+        assert self.cache.get(("local_llm", "falcon"), "Tell me about AI") is None
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+    def test_ttl_expiry(self):
+        # Test entries expire after the time-to-live
+        self.cache.put("ns", "prompt", "value")
+        self.clock.now = 9.9
+        assert self.cache.get("ns", "prompt") == "value"
+        self.clock.now = 10.0
+        assert self.cache.get("ns", "prompt") is None
+        assert len(self.cache) == 0
+
+    def test_lru_eviction(self):
+        # Test the least recently used entry is evicted
+        self.cache.put("ns", "a", 1)
+        self.cache.put("ns", "b", 2)
+        self.cache.get("ns", "a")
+        self.cache.put("ns", "c", 3)
+        assert self.cache.get("ns", "b") is None
+        assert self.cache.get("ns", "a") == 1
+
+    def test_expired_entries_evicted_first(self):
+        # Test expired entries make room before live ones are evicted
+        self.cache.put("ns", "old", 1)
+        self.clock.now = 5
+        self.cache.put("ns", "live", 2)
+        self.clock.now = 11
+        self.cache.put("ns", "new", 3)
+        assert self.cache.get("ns", "live") == 2
+        assert self.cache.get("ns", "new") == 3
+
+    def test_disabled(self):
+        # Test a zero-size cache stores nothing
+        cache = ResponseCache(maxsize=0)
+        cache.put("ns", "prompt", "value")
+        assert cache.get("ns", "prompt") is None
+
+
+class TestSemanticResponseCache:
+    def embed(self, prompt):
+        vectors = {"Tell me about AI": [1.0, 0.0], "Tell me about AI please": [0.99, 0.141], "Describe a cat": [0.0, 1.0]}
+        return np.array(vectors[prompt])
+
+    def test_semantic_hit(self):
+        # Test near-identical prompts above the threshold hit the cache
+        cache = ResponseCache(embed=self.embed, semantic_threshold=0.95)
+        cache.put("ns", "Tell me about AI", "AI is...")
+        assert cache.get("ns", "Tell me about AI please") == "AI is..."
+        assert cache.get("ns", "Describe a cat") is None
+        assert cache.get("other", "Tell me about AI please") is None
+        assert (cache.hits, cache.semantic_hits, cache.misses) == (0, 1, 2)
+
+    def test_semantic_disabled_without_threshold(self):
+        # Test semantic lookups are off without a threshold
+        cache = ResponseCache(embed=self.embed)
+        cache.put("ns", "Tell me about AI", "AI is...")
+        assert not cache.semantic
+        assert cache.get("ns", "Tell me about AI please") is None
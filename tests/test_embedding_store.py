@@ -0,0 +1,86 @@
+import os
+import numpy as np
+import pytest
+from app import embedding_store
+from app.embedding_store import EmbeddingStore, EmbeddingStoreMismatch
+
+
+def vectors(n, dim=4, seed=0):
+    return np.random.RandomState(seed).rand(n, dim).astype(np.float32)
+
+
+class TestEmbeddingStore:
+    def test_put_and_get(self, tmp_path):
+        # Test stored embeddings are returned as read-only views and unknown prompts miss
+        store = EmbeddingStore(str(tmp_path), model="m")
+        embeddings = vectors(2)
+        assert store.put_many(["a", "b"], embeddings) == 2
+        assert np.array_equal(store.get("a"), embeddings[0])
+        assert np.array_equal(store.get("b"), embeddings[1])
+        assert not store.get("a").flags.writeable
+        assert store.get("c") is None
+        assert (store.hits, store.misses) == (3, 1)
+        assert len(store) == 2
+
+    def test_append_only_and_deduplicated(self, tmp_path):
+        # Test prompts already stored, or repeated in a batch, are written once
+        store = EmbeddingStore(str(tmp_path), model="m")
+        store.put_many(["a"], vectors(1))
+        assert store.put_many(["a", "b", "b"], vectors(3, seed=1)) == 1
+        assert len(store) == 2
+        assert os.path.getsize(tmp_path / "keys.u64") == 16
+        assert os.path.getsize(tmp_path / "vectors.f32") == 2 * 4 * 4
+
+    def test_warm_after_reopen(self, tmp_path):
+        # Test a reopened store serves every embedding written before
+        store = EmbeddingStore(str(tmp_path), model="m")
+        embeddings = vectors(100)
+        store.put_many([f"prompt {i}" for i in range(100)], embeddings)
+        store.close()
+        reopened = EmbeddingStore(str(tmp_path), model="m")
+        assert len(reopened) == 100
+        assert reopened.dim == 4
+        assert np.array_equal(reopened.get("prompt 42"), embeddings[42])
+
+    def test_shared_between_writers(self, tmp_path):
+        # Test rows appended by another worker are found on a miss
+        worker1 = EmbeddingStore(str(tmp_path), model="m")
+        worker2 = EmbeddingStore(str(tmp_path), model="m")
+        worker1.put_many(["a"], vectors(1))
+        worker2.put_many(["b"], vectors(1, seed=1))
+        assert np.array_equal(worker2.get("a"), worker1.get("a"))
+        assert np.array_equal(worker1.get("b"), vectors(1, seed=1)[0])
+        assert worker1.put_many(["b"], vectors(1)) == 0
+
+    def test_index_rebuild(self, tmp_path):
+        # Test lookups across the sorted index and recently appended rows
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(embedding_store, "RECENT_ROWS_LIMIT", 4)
+            store = EmbeddingStore(str(tmp_path), model="m")
+            embeddings = vectors(20)
+            for i in range(20):
+                store.put_many([f"p{i}"], embeddings[i:i + 1])
+            assert all(np.array_equal(store.get(f"p{i}"), embeddings[i]) for i in range(20))
+            assert len(store._sorted_keys) > 0
+
+    def test_partial_write_ignored(self, tmp_path):
+        # Test a row whose key was not completely written is invisible and overwritten
+        store = EmbeddingStore(str(tmp_path), model="m")
+        store.put_many(["a"], vectors(1))
+        with open(tmp_path / "vectors.f32", "ab") as f:
+            f.write(b"\0" * 16)
+        with open(tmp_path / "keys.u64", "ab") as f:
+            f.write(b"\1\2\3")
+        reopened = EmbeddingStore(str(tmp_path), model="m")
+        assert len(reopened) == 1
+        reopened.put_many(["b"], vectors(1, seed=1))
+        assert os.path.getsize(tmp_path / "keys.u64") == 16
+        assert np.array_equal(EmbeddingStore(str(tmp_path), model="m").get("b"), vectors(1, seed=1)[0])
+
+    def test_model_and_width_mismatch(self, tmp_path):
+        # Test a store is not reused by another model or with another embedding width
+        EmbeddingStore(str(tmp_path), model="m").put_many(["a"], vectors(1))
+        with pytest.raises(EmbeddingStoreMismatch):
+            EmbeddingStore(str(tmp_path), model="other")
+        with pytest.raises(EmbeddingStoreMismatch):
+            EmbeddingStore(str(tmp_path), model="m").put_many(["b"], vectors(1, dim=8))
@@ -1,7 +1,17 @@
+import asyncio
 import os
+import queue
+import sys
+import threading
 import pytest
-from unittest.mock import patch, MagicMock
-from app.llm import get_llm_response, get_local_llm_response
+from unittest.mock import patch, MagicMock, AsyncMock
+import app.llm
+from app.llm import (
+    get_llm_response, get_local_llm_response, LocalModelManager,
+    get_llm_response_async, get_async_openai_client, close_async_openai_client,
+    stream_llm_response_async, stream_local_llm_response, ModerationStoppingCriteria, EventStoppingCriteria,
+    moderated_generate, InferenceProfile, quantize_linear_layers
+)
 
 
 @patch('openai.OpenAI')
@@ -86,4 +96,282 @@ def test_empty_resposne_from_openai(mock_openai):
     mock_openai.return_value = mock_client
     with pytest.raises(Exception) as exc_info:
         get_llm_response("Tell me a joke")
-    assert "LLM request failed" in str(exc_info.value)
\ No newline at end of file
+    assert "LLM request failed" in str(exc_info.value)
+
+class TestLocalModelManager:
+    def setup_method(self):
+        self.pipeline = MagicMock(return_value=[{"generated_text": "generated"}])
+        self.manager = LocalModelManager("test-model", warmup_prompt="Hello", warmup_tokens=4)
+
+    def test_not_loaded_on_creation(self):
+        # Test the model is not loaded until first use
+        with patch.object(LocalModelManager, '_load_pipeline', return_value=self.pipeline) as mock_load:
+            manager = LocalModelManager("test-model")
+            assert manager.state == "not_loaded"
+            mock_load.assert_not_called()
+
+    def test_loads_once_and_warms_up(self):
+        # Test the pipeline is loaded once and primed with one warmup generation
+        with patch.object(LocalModelManager, '_load_pipeline', return_value=self.pipeline) as mock_load:
+            assert self.manager("prompt", max_new_tokens=10) == [{"generated_text": "generated"}]
+            self.manager("prompt again")
+        mock_load.assert_called_once()
+        assert self.pipeline.call_args_list[0].args == ("Hello",)
+        assert self.pipeline.call_args_list[0].kwargs["max_new_tokens"] == 4
+        assert self.manager.ready
+
+    def test_warmup_disabled(self):
+        # Test an empty warmup prompt skips warmup
+        manager = LocalModelManager("test-model", warmup_prompt="")
+        with patch.object(LocalModelManager, '_load_pipeline', return_value=self.pipeline):
+            manager.load()
+        self.pipeline.assert_not_called()
+
+    def test_background_load(self):
+        # Test background loading reports readiness when done
+        with patch.object(LocalModelManager, '_load_pipeline', return_value=self.pipeline):
+            self.manager.start_background_load().join(timeout=5)
+        assert self.manager.status() == {"model": "test-model", "state": "ready"}
+
+    def test_failed_load(self):
+        # Test load failures are reported and can be retried
+        with patch.object(LocalModelManager, '_load_pipeline', side_effect=Exception("download failed")):
+            self.manager.start_background_load().join(timeout=5)
+        assert self.manager.state == "failed"
+        assert self.manager.status()["error"] == "download failed"
+        with patch.object(LocalModelManager, '_load_pipeline', return_value=self.pipeline):
+            self.manager.load()
+        assert self.manager.ready
+
+
+class TestInferenceProfile:
+    def load(self, profile):
+        # Load a pipeline through fake torch and transformers modules
+        torch, transformers = MagicMock(), MagicMock()
+        with patch.dict(sys.modules, {"torch": torch, "transformers": transformers}), \
+             patch('app.llm._torch_threads_set', False), \
+             patch('app.llm.quantize_linear_layers', side_effect=lambda model: ("quantized", model)) as quantize:
+            generator = LocalModelManager("test-model", profile=profile)._load_pipeline()
+        return torch, transformers, quantize, generator
+
+    def test_default_profile(self):
+        # Test the default profile keeps fp32 and torch threading, and generates under inference_mode
+        torch, transformers, quantize, generator = self.load(InferenceProfile())
+        quantize.assert_not_called()
+        torch.set_num_threads.assert_not_called()
+        torch.set_num_interop_threads.assert_not_called()
+        assert generator.get_inference_context() is torch.inference_mode
+
+    def test_quantized_profile(self):
+        # Test thread counts are set and the model is quantized before the pipeline is built
+        profile = InferenceProfile(quantize=True, inference_mode=False, intra_op_threads=4, inter_op_threads=1)
+        torch, transformers, quantize, generator = self.load(profile)
+        torch.set_num_threads.assert_called_once_with(4)
+        torch.set_num_interop_threads.assert_called_once_with(1)
+        model = transformers.AutoModelForCausalLM.from_pretrained.return_value
+        assert transformers.pipeline.call_args.kwargs["model"] == ("quantized", model)
+        assert generator.get_inference_context is not torch.inference_mode
+
+    def test_thread_counts_set_once_per_process(self):
+        # Test a retried load does not set the thread counts again, which torch refuses for inter-op threads
+        torch = MagicMock()
+        torch.set_num_interop_threads.side_effect = [None, RuntimeError("cannot set number of interop threads")]
+        manager = LocalModelManager("test-model", profile=InferenceProfile(intra_op_threads=4, inter_op_threads=1))
+        with patch.dict(sys.modules, {"torch": torch, "transformers": MagicMock()}), \
+             patch('app.llm._torch_threads_set', False):
+            manager._load_pipeline()
+            manager._load_pipeline()
+        torch.set_num_threads.assert_called_once_with(4)
+        torch.set_num_interop_threads.assert_called_once_with(1)
+
+    def test_quantize_linear_layers(self):
+        # Test linear layers and their subclasses are replaced by dynamic int8 layers
+        torch = pytest.importorskip("torch")
+
+        class SubclassLinear(torch.nn.Linear):
+            def forward(self, input):
+                return input @ self.weight.T + self.bias
+
+        torch.manual_seed(0)
+        model = torch.nn.Sequential(torch.nn.Linear(16, 16), torch.nn.ReLU(), SubclassLinear(16, 4))
+        inputs = torch.randn(8, 16)
+        expected = model(inputs)
+        quantized = quantize_linear_layers(model)
+        assert all(not isinstance(m, torch.nn.Linear) or type(m).__module__.startswith("torch.ao") for m in quantized.modules())
+        assert torch.allclose(quantized(inputs), expected, atol=0.05)
+
+
+class TestModerationStopping:
+    class Tokenizer:
+        def decode(self, ids, skip_special_tokens=True):
+            return "".join(ids)
+
+    def test_stops_when_rejection_is_certain(self):
+        # Test a row is stopped once its decoded output must be rejected
+        criteria = ModerationStoppingCriteria(self.Tokenizer(), max_new_tokens=18)
+        ids = ["shit ", "fuck ", "bitch ", "kill ", "bomb ", "shit "] * 3
+        assert not criteria._should_stop(0, ids[:1], remaining=5)
+        assert criteria._should_stop(0, ids, remaining=0)
+
+    def test_clean_row_continues(self):
+        # Test clean output is never stopped
+        criteria = ModerationStoppingCriteria(self.Tokenizer(), max_new_tokens=3)
+        assert not criteria._should_stop(1, ["Machine ", "learning ", "is fun. "], remaining=0)
+
+    @patch('app.llm.generator')
+    def test_moderated_generate_adds_criteria(self, mock_generator):
+        # Test local generations get a fresh moderation stopping criterion
+        moderated_generate("Hello", max_new_tokens=10)
+        criteria = mock_generator.call_args.kwargs["stopping_criteria"]
+        assert isinstance(criteria[0], ModerationStoppingCriteria)
+        assert criteria[0].max_new_tokens == 10
+        with patch('app.llm.LOCAL_MODERATION_STOPPING', False):
+            moderated_generate("Hello", max_new_tokens=10)
+        assert "stopping_criteria" not in mock_generator.call_args.kwargs
+
+        moderated_generate("Hello", max_new_tokens=10, stopping_criteria=["caller"])
+        assert mock_generator.call_args.kwargs["stopping_criteria"][0] == "caller"
+
+
+class TestLocalStream:
+    class Streamer:
+        # Stands in for TextIteratorStreamer: iterates over put() text until end()
+        def __init__(self, tokenizer, **kwargs):
+            self.queue = queue.Queue()
+
+        def put(self, text):
+            self.queue.put(text)
+
+        def end(self):
+            self.queue.put(None)
+
+        def __iter__(self):
+            return iter(self.queue.get, None)
+
+    def test_generation_stops_when_closed(self):
+        # Test closing the stream early stops the generation thread at the next token
+        stopped = threading.Event()
+
+        def generate(prompt, streamer, stopping_criteria, **kwargs):
+            # Emits tokens until a stopping criterion is met, like generate()
+            criterion = stopping_criteria[0]
+            assert isinstance(criterion, EventStoppingCriteria)
+            while not criterion.event.wait(0.001):
+                streamer.put("token ")
+            stopped.set()
+            streamer.end()
+
+        transformers = MagicMock(TextIteratorStreamer=self.Streamer)
+        with patch.dict(sys.modules, {"transformers": transformers}), \
+             patch.object(app.llm.local_model, 'load'), \
+             patch('app.llm.moderated_generate', side_effect=generate):
+            chunks = stream_local_llm_response("Hello")
+            assert next(chunks) == "token "
+            chunks.close()
+        assert stopped.wait(5)
+
+    def test_failed_load(self):
+        # Test a model that fails to load or warm up is reported like a failed generation
+        transformers = MagicMock(TextIteratorStreamer=self.Streamer)
+        with patch.dict(sys.modules, {"transformers": transformers}), \
+             patch.object(app.llm.local_model, 'load', side_effect=OSError("model not found")):
+            with pytest.raises(RuntimeError, match="LLM request failed: model not found"):
+                next(stream_local_llm_response("Hello"))
+
+
+class TestAsyncOpenAIClient:
+    def setup_method(self):
+        app.llm._async_client = None
+
+    def teardown_method(self):
+        app.llm._async_client = None
+
+    def mock_client(self, content="Mock GPT response"):
+        mock_client = MagicMock()
+        mock_choice = MagicMock()
+        mock_choice.message.content = content
+        mock_client.chat.completions.create = AsyncMock(return_value=MagicMock(choices=[mock_choice]))
+        mock_client.close = AsyncMock()
+        return mock_client
+
+    @patch('openai.AsyncOpenAI')
+    def test_client_is_reused(self, mock_openai):
+        # Test one async client is shared across calls
+        mock_openai.return_value = self.mock_client()
+        assert asyncio.run(get_llm_response_async("first")) == "Mock GPT response"
+        assert asyncio.run(get_llm_response_async("second")) == "Mock GPT response"
+        mock_openai.assert_called_once()
+
+    @patch('openai.AsyncOpenAI')
+    def test_client_pool_and_timeouts(self, mock_openai):
+        # Test the client is created with the configured pool and timeouts
+        with patch('app.llm.OPENAI_POOL_SIZE', 7), patch('app.llm.OPENAI_TIMEOUT', 12.0):
+            get_async_openai_client()
+        kwargs = mock_openai.call_args.kwargs
+        assert kwargs["timeout"].read == 12.0
+        assert kwargs["http_client"]._transport._pool._max_connections == 7
+
+    class FakeStream:
+        # Mimics openai.AsyncStream: async iteration over chunks and an async close()
+        def __init__(self, contents):
+            self.contents = contents
+            self.closed = False
+
+        async def __aiter__(self):
+            for content in self.contents:
+                chunk = MagicMock()
+                chunk.choices[0].delta.content = content
+                yield chunk
+
+        async def close(self):
+            self.closed = True
+
+    @patch('openai.AsyncOpenAI')
+    def test_streamed_response(self, mock_openai):
+        # Test streamed chunks are yielded as they arrive, skipping empty deltas
+        async def collect():
+            return [chunk async for chunk in stream_llm_response_async("Hi")]
+
+        stream = self.FakeStream(("Hello", None, " world"))
+        mock_client = self.mock_client()
+        mock_client.chat.completions.create = AsyncMock(return_value=stream)
+        mock_openai.return_value = mock_client
+        assert asyncio.run(collect()) == ["Hello", " world"]
+        assert mock_client.chat.completions.create.call_args.kwargs["stream"] is True
+        assert stream.closed
+
+    @patch('openai.AsyncOpenAI')
+    def test_streamed_response_closed_early(self, mock_openai):
+        # Test closing the generator early closes the HTTP stream
+        async def first():
+            chunks = stream_llm_response_async("Hi")
+            chunk = await chunks.__anext__()
+            await chunks.aclose()
+            return chunk
+
+        stream = self.FakeStream(("Hello", " world"))
+        mock_client = self.mock_client()
+        mock_client.chat.completions.create = AsyncMock(return_value=stream)
+        mock_openai.return_value = mock_client
+        assert asyncio.run(first()) == "Hello"
+        assert stream.closed
+
+    @patch('openai.AsyncOpenAI')
+    def test_async_request_failure(self, mock_openai):
+        # Test async request failures are wrapped like the sync path
+        mock_client = self.mock_client()
+        mock_client.chat.completions.create.side_effect = Exception("Unexpected failure")
+        mock_openai.return_value = mock_client
+        with pytest.raises(RuntimeError) as exc_info:
+            asyncio.run(get_llm_response_async("Trigger unexpected error"))
+        assert "LLM request failed: Unexpected failure" in str(exc_info.value)
+
+    @patch('openai.AsyncOpenAI')
+    def test_close_client(self, mock_openai):
+        # Test closing releases the shared client
+        mock_client = self.mock_client()
+        mock_openai.return_value = mock_client
+        get_async_openai_client()
+        asyncio.run(close_async_openai_client())
+        mock_client.close.assert_awaited_once()
+        assert app.llm._async_client is None
@@ -0,0 +1,82 @@
+import pytest
+from app.lsh import LSHIndex, MinHash, lsh_params
+from app.similarity import jaccard_similarity
+
+
+def test_lsh_params():
+    # Test bands and rows cover every permutation
+    for threshold in (0.3, 0.5, 0.8):
+        bands, rows = lsh_params(128, threshold)
+        assert bands * rows == 128
+    assert lsh_params(128, 0.9)[1] > lsh_params(128, 0.3)[1]
+
+
+class TestMinHash:
+    def test_signature_shape_and_determinism(self):
+        # Test signatures are fixed-width and reproducible for the same seed
+        signature = MinHash(num_perm=64).signature("the quick brown fox")
+        assert signature.shape == (64,)
+        assert signature.dtype.name == "uint32"
+        assert (signature == MinHash(num_perm=64).signature("The quick, brown fox!")).all()
+
+    def test_empty_text(self):
+        # Test texts without tokens have no signature
+        assert MinHash().signature("...") is None
+
+    def test_estimate_close_to_jaccard(self):
+        # Test the fraction of equal positions estimates Jaccard similarity
+        text1 = " ".join(f"word{i}" for i in range(40))
+        text2 = " ".join(f"word{i}" for i in range(20, 60))
+        minhash = MinHash(num_perm=256)
+        estimate = (minhash.signature(text1) == minhash.signature(text2)).mean()
+        assert estimate == pytest.approx(jaccard_similarity(text1, text2), abs=0.1)
+
+
+class TestLSHIndex:
+    def setup_method(self):
+        self.index = LSHIndex(threshold=0.5)
+        self.index.add("ml", "tell me about machine learning and deep neural networks today")
+        self.index.add("weather", "what is the weather like in london this weekend")
+
+    def test_query_near_duplicate(self):
+        # Test a near-duplicate prompt is found with its estimated score
+        matches = self.index.query("please tell me about machine learning and deep neural networks today")
+        assert [key for key, _ in matches] == ["ml"]
+        assert 0.5 <= matches[0][1] <= 1.0
+
+    def test_query_no_match(self):
+        # Test unrelated and empty prompts return no matches
+        assert self.index.query("how do airplanes fly over the ocean") == []
+        assert self.index.query("") == []
+
+    def test_add(self):
+        # Test add results and duplicate keys
+        assert len(self.index) == 2
+        assert "ml" in self.index
+        assert not self.index.add("empty", "!!!")
+        with pytest.raises(ValueError):
+            self.index.add("ml", "another prompt")
+
+    def test_limit_and_order(self):
+        # Test results are ordered best first and limited
+        self.index.add("ml2", "tell me about machine learning and deep neural networks")
+        matches = self.index.query("tell me about machine learning and deep neural networks today", limit=1)
+        assert matches == [("ml", 1.0)]
+
+    def test_save_and_load(self, tmp_path):
+        # Test a saved index answers queries the same after loading
+        path = str(tmp_path / "index.npz")
+        self.index.save(path)
+        loaded = LSHIndex.load(path)
+        assert len(loaded) == 2
+        assert (loaded.bands, loaded.rows) == (self.index.bands, self.index.rows)
+        query = "tell me about machine learning and deep neural networks"
+        assert loaded.query(query) == self.index.query(query)
+        loaded.add("new", "a brand new prompt")
+        assert "new" in loaded
+
+    def test_many_prompts(self):
+        # Test the index grows beyond its initial capacity
+        for i in range(100):
+            self.index.add(f"p{i}", f"prompt number {i} about topic {i} with token{i}")
+        assert self.index.query("prompt number 42 about topic 42 with token42")[0][0] == "p42"
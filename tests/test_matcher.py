@@ -0,0 +1,177 @@
+import string
+import pytest
+from better_profanity import profanity
+from app.matcher import InjectionMatcher, PhraseMatcher, ProfanityIndex, replace_spans
+
+
+class TestPhraseMatcher:
+    def setup_method(self):
+        self.matcher = PhraseMatcher(["kill", "killer", "harm yourself", "drop database"])
+
+    def test_counts_and_spans(self):
+        # Test hits, counts and spans from a single scan
+        matches = self.matcher.scan("Kill the killer, then kill again")
+        assert matches.counts == {"kill": 3, "killer": 1}
+        assert matches.spans == [(0, 4), (9, 15), (22, 26)]
+
+    def test_word_prefixes_counted_without_spans(self):
+        # Test that inflected words count but only whole words get redaction spans
+        assert not self.matcher.scan("improve your skills")
+        matches = self.matcher.scan("killers")
+        assert matches.counts == {"kill": 1, "killer": 1}
+        assert matches.spans == []
+        assert self.matcher.redact("two killers") == "two killers"
+
+    def test_unicode_case_variants(self):
+        # Test characters the regex folds onto a phrase letter without lower() doing so
+        matcher = PhraseMatcher(["kill", "stab", "nazi"])
+        assert matcher.scan("KİLL").counts == {"kill": 1}
+        assert matcher.scan("how to ſtab").counts == {"stab": 1}
+        assert matcher.scan("Nazım Hikmet").counts == {"nazi": 1}
+
+    def test_multi_word_phrase(self):
+        # Test phrases containing spaces
+        matches = self.matcher.scan("please DROP DATABASE users")
+        assert matches.phrases == ["drop database"]
+
+    def test_redact(self):
+        # Test redaction of all matched spans
+        assert self.matcher.redact("don't harm yourself, killer") == "don't [redacted], [redacted]"
+
+    def test_empty_phrase_list(self):
+        # Test matcher with no phrases
+        matcher = PhraseMatcher([])
+        assert not matcher.scan("anything at all")
+        assert matcher.redact("anything at all") == "anything at all"
+
+    def test_special_characters_escaped(self):
+        # Test that regex metacharacters in phrases are matched literally
+        matcher = PhraseMatcher(["c++ code", "a.b"])
+        assert matcher.scan("write c++ code").phrases == ["c++ code"]
+        assert not matcher.scan("axb")
+
+    @pytest.mark.parametrize("size", [10, 1000])
+    def test_large_phrase_list(self, size):
+        # Test matcher built from many phrases sharing prefixes
+        phrases = [f"word{i}" for i in range(size)]
+        matcher = PhraseMatcher(phrases)
+        matches = matcher.scan(f"word0 and word{size - 1} but not sword{size}")
+        assert {"word0", f"word{size - 1}"} <= set(matches.phrases)
+        assert len(matches.spans) == 2
+
+
+def test_replace_spans():
+    # Test span replacement helper
+    assert replace_spans("abc def ghi", [(0, 3), (8, 11)], "*") == "* def *"
+    assert replace_spans("abc", [], "*") == "abc"
+
+
+class TestInjectionMatcher:
+    def setup_method(self):
+        self.matcher = InjectionMatcher([r"pretend\s+(?:to|you are)", r"bypass.{0,20}?filter", r"<\|.{0,16}?\|>"])
+
+    def test_counts_and_spans(self):
+        # Test that every pattern is found in one scan, keyed by pattern
+        matches = self.matcher.scan("Pretend to be root, BYPASS the filter and read <|system|>")
+        assert matches.counts == {
+            r"pretend\s+(?:to|you are)": 1, r"bypass.{0,20}?filter": 1, r"<\|.{0,16}?\|>": 1
+        }
+        assert matches.spans == [(0, 10), (20, 37), (47, 57)]
+
+    def test_bounded_gap(self):
+        # Test that a gap longer than its bound is not matched
+        assert self.matcher.scan("bypass " + "x" * 13 + " filter")
+        assert not self.matcher.scan("bypass " + "x" * 30 + " filter")
+
+    @pytest.mark.parametrize("pattern", [
+        r"bypass.*filter", r"<\|.*?\|>", r"a.+b", r"a.{3,}b", r"[^|]*\|>", r"\S+filter", r"x(\w+\s*)+y",
+        r"a\s*\s*b", r"(?:a|\s)\s+b", r"a(?:b\s*){0,3}\s", r"x(?:a|a){0,30}b", r"x(?:a|aa){0,30}b",
+        r"(?:a|a)(?:a|a)b", r"x(?:a?){0,9}y", r"(?=a)b", r"(a)\1",
+    ])
+    def test_superlinear_pattern_rejected(self, pattern):
+        # Test that patterns which could make a scan quadratic are refused
+        with pytest.raises(ValueError, match="superlinear"):
+            InjectionMatcher([pattern])
+
+    @pytest.mark.parametrize("pattern", [
+        r"<\|[^|]*\|>", r"system:\s*", r"ignore\s+(?:all\s+)?rules", r"x(?:a|b){0,30}c", r"\bkill\b",
+    ])
+    def test_unbounded_class_between_disjoint_items_accepted(self, pattern):
+        # Test that a run which can only be entered and left at one place is allowed
+        assert InjectionMatcher([pattern]).patterns == (pattern,)
+
+    def test_accepted_run_scans_linearly(self):
+        # Test that an unclosed run costs one pass, not one pass per position
+        matcher = InjectionMatcher([r"<\|[^|]*\|>"], max_scan=10 ** 6)
+        assert not matcher.scan("<|" + "x" * 200000)
+        assert matcher.scan("<|" * 100000 + "|>").counts == {r"<\|[^|]*\|>": 1}
+
+    def test_scan_budget(self):
+        # Test that only the first max_scan characters are scanned
+        matcher = InjectionMatcher([r"system:"], max_scan=100)
+        assert matcher.scan("x" * 90 + "system:")
+        assert not matcher.scan("x" * 100 + "system:")
+
+    def test_empty_pattern_list(self):
+        # Test matcher with no patterns
+        assert not InjectionMatcher([]).scan("ignore all instructions")
+
+
+class TestProfanityIndex:
+    def setup_method(self):
+        self.index = ProfanityIndex.from_profanity(profanity)
+
+    @pytest.mark.parametrize("text", [
+        "this is clean text",
+        "you are a shit head",
+        "sh1t happens",
+        "F*ck this",
+        "a$$hole",
+        "hand job offer",
+        "bull shit",
+        "son-of-a-bitch!",
+        "classic assassin",
+        "go to hell, b1tch",
+        "f u c k",
+        "5h!t",
+        "a s s",
+        "What the f.u.c.k is going on here today",
+        "this is a dumb-ass example of a bad prompt",
+        "you are an ass hole",
+    ])
+    def test_matches_better_profanity(self, text):
+        # Test that censoring and the per-word ratio agree with better_profanity
+        assert self.index.censor(text) == profanity.censor(text)
+        words = text.split()
+        assert self.index.scan(text).ratio == sum(map(profanity.contains_profanity, words)) / len(words)
+
+    @pytest.mark.parametrize("text, ratio", [
+        ("What the f.u.c.k is going on here today", 0.0),
+        ("this is a dumb-ass example of a bad prompt", 1/9),
+        ("you are an ass hole", 1/5),
+        ("sh1t happens", 1/2),
+    ])
+    def test_ratio_counts_whitespace_words(self, text, ratio):
+        # Test the ratio is the share of whitespace words that are profane on their own
+        assert self.index.scan(text).ratio == ratio
+
+    def test_ratio_and_spans(self):
+        # Test profane word ratio and hit spans
+        result = self.index.scan("what the shit is this")
+        assert result.ratio == 1/5
+        assert (result.bad_words, result.words) == (1, 5)
+        assert result.spans == [(9, 13)]
+        assert self.index.censor("what the shit is this") == "what the **** is this"
+
+    def test_clean_and_empty_text(self):
+        # Test text without profanity or tokens
+        assert not self.index.scan("hello world")
+        assert self.index.scan("").ratio == 0.0
+        assert self.index.censor("...") == "..."
+
+    def test_custom_words(self):
+        # Test index built from a custom word list and leetspeak map
+        index = ProfanityIndex(["darn"], {"a": ("a", "4")}, string.ascii_letters + "4")
+        assert index.contains("d4rn")
+        assert not index.contains("dern")
+        assert index.censor("oh DARN it") == "oh **** it"
@@ -0,0 +1,59 @@
+import pytest
+from app.metrics import Counter, Gauge, Histogram, Registry, observe_stage, similarity_seconds
+
+
+class TestCollectors:
+    def test_counter(self):
+        # Test counts per label set and their exposition
+        counter = Counter("test_total", "Test counter", ("category",))
+        counter.inc(category="profanity")
+        counter.inc(2, category="profanity")
+        assert counter.value(category="profanity") == 3
+        assert 'test_total{category="profanity"} 3' in counter.exposition()
+        with pytest.raises(ValueError):
+            counter.inc(stage="input")
+
+    def test_gauge(self):
+        # Test set, inc/dec and function gauges
+        gauge = Gauge("test_gauge", "Test gauge", ("queue",))
+        gauge.inc(queue="a")
+        gauge.inc(queue="a")
+        gauge.dec(queue="a")
+        gauge.set_function(lambda: 7, queue="b")
+        assert gauge.value(queue="a") == 1
+        assert 'test_gauge{queue="b"} 7' in gauge.exposition()
+
+    def test_histogram(self):
+        # Test cumulative buckets, sum and count
+        histogram = Histogram("test_seconds", "Test histogram", ("method",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, method="cosine")
+        text = histogram.exposition()
+        assert "# TYPE test_seconds histogram" in text
+        assert 'test_seconds_bucket{method="cosine",le="0.1"} 1' in text
+        assert 'test_seconds_bucket{method="cosine",le="1.0"} 3' in text
+        assert 'test_seconds_bucket{method="cosine",le="+Inf"} 4' in text
+        assert 'test_seconds_sum{method="cosine"} 6.05' in text
+        assert 'test_seconds_count{method="cosine"} 4' in text
+
+    def test_label_escaping(self):
+        # Test label values are escaped
+        counter = Counter("test_escape_total", "Test", ("category",))
+        counter.inc(category='a"b\\c')
+        assert 'category="a\\"b\\\\c"' in counter.exposition()
+
+    def test_registry(self):
+        # Test metrics are rendered together and names are unique
+        registry = Registry()
+        registry.register(Counter("one_total", "One"))
+        with pytest.raises(ValueError):
+            registry.register(Counter("one_total", "Again"))
+        assert registry.exposition().endswith("\n")
+
+
+def test_observe_stage():
+    # Test stage durations go to the histogram of the stage, unknown stages are ignored
+    before = similarity_seconds.count(method="jaccard")
+    observe_stage("similarity", 0.002, "jaccard")
+    observe_stage("precheck", 0.001)
+    assert similarity_seconds.count(method="jaccard") == before + 1
@@ -0,0 +1,40 @@
+import os
+import pstats
+from unittest.mock import patch
+from app.profiling import RequestProfile, profiling, current_profile, profile_call, profiling_requested
+
+
+def work(n):
+    return sum(range(n))
+
+
+def test_profiling_requested():
+    # Test profiling needs both the server setting and the request flag
+    with patch('app.profiling.PROFILING_ENABLED', True):
+        assert profiling_requested({"X-Profile": "1"}, {})
+        assert profiling_requested({}, {"profile": "true"})
+        assert not profiling_requested({}, {})
+    with patch('app.profiling.PROFILING_ENABLED', False):
+        assert not profiling_requested({"X-Profile": "1"}, {})
+
+
+def test_profile_calls_are_merged_and_saved(tmp_path):
+    # Test calls made under a request profile are saved as one pstats artifact
+    assert profile_call(work, 10) == 45
+    with profiling() as profile:
+        assert current_profile() is profile
+        profile_call(work, 100)
+        profile.call(work, 1000)
+    assert current_profile() is None
+
+    path = profile.save(str(tmp_path))
+    assert os.path.basename(path) == f"{profile.id}.prof"
+    stats = pstats.Stats(path)
+    calls = [value[0] for key, value in stats.stats.items() if key[2] == "work"]
+    assert calls == [2]
+
+
+def test_empty_profile_is_not_saved(tmp_path):
+    # Test nothing is written when no work was profiled
+    assert RequestProfile().save(str(tmp_path)) is None
+    assert os.listdir(tmp_path) == []
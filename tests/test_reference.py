@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from app.reference import ReferenceIndex
+
+
+REFERENCES = {
+    "ml": "Tell me about machine learning",
+    "dl": "Explain deep learning and neural networks",
+    "weather": "What is the weather like in London today",
+    "cooking": "How do I cook pasta at home",
+}
+
+
+def tfidf_scores(references, query):
+    # Cosine similarity of a TfidfVectorizer fitted on the references, the index's reference scores
+    vectorizer = TfidfVectorizer().fit(list(references.values()))
+    scores = (vectorizer.transform(list(references.values())) @ vectorizer.transform([query]).T).toarray().ravel()
+    return dict(zip(references, scores))
+
+
+class TestReferenceIndex:
+    def setup_method(self):
+        self.index = ReferenceIndex()
+        for key, prompt in REFERENCES.items():
+            self.index.add(key, prompt)
+
+    def test_search_matches_tfidf(self):
+        # Test top-k scores equal the cosine similarity of a TF-IDF fit on the references
+        query = "machine learning and neural networks"
+        expected = tfidf_scores(REFERENCES, query)
+        matches = self.index.search(query, k=2)
+        assert [key for key, _ in matches] == sorted(expected, key=expected.get, reverse=True)[:2]
+        for key, score in matches:
+            assert score == pytest.approx(expected[key])
+
+    def test_only_candidates_sharing_terms(self):
+        # Test references without a shared term are not returned and unknown terms match nothing
+        assert {key for key, _ in self.index.search("pasta")} == {"cooking"}
+        assert self.index.search("quantum chromodynamics") == []
+        assert self.index.search("...") == []
+        assert self.index.search("pasta", k=0) == []
+
+    def test_min_score(self):
+        # Test min_score filters weaker matches
+        matches = self.index.search("learning about the weather in London", k=10)
+        assert len(matches) == 3
+        best = matches[0][1]
+        assert self.index.search("learning about the weather in London", min_score=best) == matches[:1]
+
+    def test_add_and_remove_update_weights(self):
+        # Test inserts and removals change IDF weights without a refit
+        references = dict(REFERENCES, ml2="machine learning for beginners")
+        assert self.index.add("ml2", references["ml2"])
+        query = "learning machine"
+        expected = tfidf_scores(references, query)
+        assert dict(self.index.search(query)) == pytest.approx({k: v for k, v in expected.items() if v > 0})
+
+        assert self.index.remove("dl")
+        del references["dl"]
+        expected = tfidf_scores(references, query)
+        assert dict(self.index.search(query)) == pytest.approx({k: v for k, v in expected.items() if v > 0})
+        assert "dl" not in self.index
+        assert not self.index.remove("dl")
+
+    def test_add(self):
+        # Test add results and duplicate keys
+        assert len(self.index) == 4
+        assert not self.index.add("empty", "!!!")
+        with pytest.raises(ValueError):
+            self.index.add("ml", "another prompt")
+
+    def test_compaction(self):
+        # Test removed rows are dropped once they outnumber live rows
+        for key in ("ml", "dl", "weather"):
+            self.index.remove(key)
+        assert len(self.index) == 1
+        assert self.index.keys == ["cooking"]
+        assert self.index.search(REFERENCES["cooking"]) == [("cooking", pytest.approx(1.0))]
+        assert self.index.add("ml", REFERENCES["ml"])
+        assert [key for key, _ in self.index.search("machine learning")] == ["ml"]
+
+    def test_large_index(self):
+        # Test scores on a larger index with many removals against a full TF-IDF fit
+        rng = np.random.RandomState(0)
+        words = [f"word{i}" for i in range(300)]
+        references = {str(i): " ".join(rng.choice(words, size=rng.randint(2, 12))) for i in range(500)}
+        index = ReferenceIndex()
+        for key, prompt in references.items():
+            index.add(key, prompt)
+        for key in list(references)[::3]:
+            index.remove(key)
+            del references[key]
+        query = " ".join(rng.choice(words, size=6))
+        expected = tfidf_scores(references, query)
+        matches = index.search(query, k=5)
+        assert [score for _, score in matches] == pytest.approx(sorted(expected.values(), reverse=True)[:5])
+
+    def test_save_and_load(self, tmp_path):
+        # Test a saved index gives the same results after loading and stays mutable
+        self.index.remove("weather")
+        path = str(tmp_path / "reference.npz")
+        self.index.save(path)
+        loaded = ReferenceIndex.load(path)
+        assert len(loaded) == 3
+        assert loaded.search("deep learning machine") == self.index.search("deep learning machine")
+        assert loaded.add("weather", REFERENCES["weather"])
+        assert [key for key, _ in loaded.search("weather in London")] == ["weather"]
@@ -1,6 +1,13 @@
+import numpy as np
 import pytest
 from unittest.mock import patch, MagicMock
-from app.similarity import cosine_similarity_tfidf, jaccard_similarity
+from app.similarity import (
+    cosine_similarity_tfidf, jaccard_similarity,
+    cosine_similarity_tfidf_batch, jaccard_similarity_batch,
+    semantic_similarity, semantic_similarity_batch,
+    EmbeddingCache, embedding_cache, similarity_precheck, similarity_error
+)
+from app.embedding_store import EmbeddingStore
 
 class TestCosineSimilarityTfidf:
     def test_identical_texts(self):
@@ -92,4 +99,134 @@ class TestJaccardSimilarity:
         text1 = "the quick brown fox"
         text2 = ""
         similarity = jaccard_similarity(text1, text2)
-        assert similarity == 0.0
\ No newline at end of file
+        assert similarity == 0.0
+
+class TestBatchSimilarity:
+    pairs = [
+        ("This is a test sentence", "This is a test sentence"),
+        ("I like machine learning algorithms", "Machine learning is interesting"),
+        ("Hello, world! How are you?", "Hello world. How are you"),
+        ("the quick brown fox jumps", "the fox jumps over lazily"),
+        ("This is about apples", "Those are oranges and bananas"),
+    ]
+
+    def test_cosine_batch_matches_pairwise(self):
+        # Test batched cosine scores equal the per-pair TF-IDF fit
+        expected = [cosine_similarity_tfidf(p1, p2) for p1, p2 in self.pairs]
+        assert cosine_similarity_tfidf_batch(self.pairs) == pytest.approx(expected)
+
+    def test_jaccard_batch_matches_pairwise(self):
+        # Test batched Jaccard scores equal the per-pair computation
+        expected = [jaccard_similarity(p1, p2) for p1, p2 in self.pairs]
+        assert jaccard_similarity_batch(self.pairs) == pytest.approx(expected)
+
+    def test_empty_batch(self):
+        # Test empty batches
+        assert cosine_similarity_tfidf_batch([]) == []
+        assert jaccard_similarity_batch([]) == []
+
+    def test_pairs_without_tokens(self):
+        # Test pairs without any tokens score zero instead of raising
+        assert cosine_similarity_tfidf_batch([("", "")]) == [0.0]
+        assert jaccard_similarity_batch([("", ""), ("a b", "a b")]) == [0.0, 1.0]
+
+
+class TestSemanticSimilarity:
+    def setup_method(self):
+        embedding_cache.clear()
+        self.encoder = MagicMock()
+        self.encoder.encode.side_effect = lambda texts, **kwargs: np.array(
+            [[1.0, 0.0] if "AI" in t else [0.6, 0.8] for t in texts], dtype=np.float32
+        )
+
+    def test_scores_are_dot_products(self):
+        # Test semantic similarity of normalized embeddings
+        with patch('app.similarity.get_encoder', return_value=self.encoder):
+            assert semantic_similarity("Tell me about AI", "AI please") == pytest.approx(1.0)
+            assert semantic_similarity("Tell me about AI", "Explain cats") == pytest.approx(0.6)
+
+    def test_prompts_encoded_in_one_call(self):
+        # Test both prompts are encoded together with normalized embeddings
+        with patch('app.similarity.get_encoder', return_value=self.encoder):
+            semantic_similarity("Tell me about AI", "Explain cats")
+        self.encoder.encode.assert_called_once()
+        args, kwargs = self.encoder.encode.call_args
+        assert args[0] == ["Tell me about AI", "Explain cats"]
+        assert kwargs["normalize_embeddings"] is True
+
+    def test_cached_prompts_not_reencoded(self):
+        # Test repeated prompts are served from the embedding cache
+        with patch('app.similarity.get_encoder', return_value=self.encoder):
+            semantic_similarity("Tell me about AI", "Explain cats")
+            semantic_similarity("Tell me about AI", "Explain dogs")
+        assert self.encoder.encode.call_args_list[1][0][0] == ["Explain dogs"]
+        assert embedding_cache.hits == 1
+
+    def test_batch(self):
+        # Test batched semantic scores and deduplicated encoding
+        pairs = [("Tell me about AI", "AI please"), ("Tell me about AI", "Explain cats")]
+        with patch('app.similarity.get_encoder', return_value=self.encoder):
+            assert semantic_similarity_batch(pairs) == pytest.approx([1.0, 0.6])
+            assert semantic_similarity_batch([]) == []
+        assert self.encoder.encode.call_args[0][0] == ["Tell me about AI", "AI please", "Explain cats"]
+
+
+    def test_embedding_store(self, tmp_path):
+        # Test embeddings are appended to the on-disk store and served from it after a restart
+        store = EmbeddingStore(str(tmp_path), model="test")
+        with patch('app.similarity.get_encoder', return_value=self.encoder), \
+             patch('app.similarity.get_embedding_store', return_value=store):
+            semantic_similarity("Tell me about AI", "Explain cats")
+            embedding_cache.clear()
+            assert semantic_similarity("Tell me about AI", "Explain cats") == pytest.approx(0.6)
+        self.encoder.encode.assert_called_once()
+        assert len(store) == 2
+        assert store.hits == 2
+
+
+class TestEmbeddingCache:
+    def test_lru_eviction(self):
+        # Test least recently used embeddings are evicted first
+        cache = EmbeddingCache(maxsize=2)
+        cache.put("a", np.zeros(2))
+        cache.put("b", np.ones(2))
+        cache.get("a")
+        cache.put("c", np.ones(2))
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert len(cache) == 2
+
+    def test_disabled_cache(self):
+        # Test a zero-size cache stores nothing
+        cache = EmbeddingCache(maxsize=0)
+        cache.put("a", np.zeros(2))
+        assert cache.get("a") is None
+
+
+class TestSimilarityPrecheck:
+    def test_disjoint_prompts_score_zero(self):
+        # Test prompts without a shared term are settled without the TF-IDF fit
+        assert similarity_precheck("cosine", "Tell me about AI", "What's the weather") == 0.0
+        assert cosine_similarity_tfidf("Tell me about AI", "What's the weather") == 0.0
+
+    def test_undecided_pairs(self):
+        # Test the precheck leaves shared-term, empty and non-cosine pairs to the method
+        assert similarity_precheck("cosine", "Tell me about AI", "tell me a joke") is None
+        assert similarity_precheck("cosine", "a", "What's the weather") is None
+        assert similarity_precheck("jaccard", "Tell me about AI", "What's the weather") is None
+        assert similarity_precheck("semantic", "Tell me about AI", "Explain artificial intelligence") is None
+
+
+class TestSimilarityError:
+    def test_pair_without_terms(self):
+        # Test the per-request cosine fit's error is reported for a pair without any term
+        with pytest.raises(ValueError) as exc_info:
+            cosine_similarity_tfidf("!!!", "...")
+        assert similarity_error("cosine", "!!!", "...") == str(exc_info.value)
+
+    def test_scored_pairs(self):
+        # Test pairs the method scores, other methods and the pre-fitted model have no error
+        assert similarity_error("cosine", "Tell me about AI", "...") is None
+        assert similarity_error("jaccard", "!!!", "...") is None
+        with patch('app.similarity.get_tfidf_model', return_value=MagicMock()):
+            assert similarity_error("cosine", "!!!", "...") is None
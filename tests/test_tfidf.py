@@ -0,0 +1,70 @@
+import pytest
+from app.tfidf import TfidfModel
+
+CORPUS = [
+    "Tell me about machine learning",
+    "What is the weather like today?",
+    "Explain quantum computing to me",
+    "How do I cook pasta?",
+    "Describe deep learning and neural networks",
+    "What does the stock market do?",
+]
+
+
+@pytest.mark.parametrize("hashing", [False, True])
+class TestTfidfModel:
+    def test_identical_texts(self, hashing):
+        # Test identical prompts score 1
+        model = TfidfModel(hashing=hashing).fit(CORPUS)
+        assert model.similarity("machine learning today", "machine learning today") == pytest.approx(1.0)
+
+    def test_different_texts(self, hashing):
+        # Test prompts without shared terms score 0
+        model = TfidfModel(hashing=hashing).fit(CORPUS)
+        assert model.similarity("cook pasta", "quantum computing") == 0.0
+
+    def test_batch_matches_pairwise(self, hashing):
+        # Test batched scores equal the per-pair scores
+        model = TfidfModel(hashing=hashing).fit(CORPUS)
+        pairs = [("Tell me about AI", "Explain AI to me"), ("Describe deep learning", "What is deep learning?")]
+        expected = [model.similarity(p1, p2) for p1, p2 in pairs]
+        assert model.similarity_batch(pairs) == pytest.approx(expected)
+        assert model.similarity_batch([]) == []
+
+    def test_save_and_load(self, hashing, tmp_path):
+        # Test a saved model scores the same after loading
+        model = TfidfModel(hashing=hashing).fit(CORPUS)
+        path = str(tmp_path / "tfidf.joblib")
+        model.save(path)
+        loaded = TfidfModel.load(path)
+        assert loaded.hashing == hashing
+        assert loaded.similarity("machine learning", "deep learning") == pytest.approx(
+            model.similarity("machine learning", "deep learning")
+        )
+
+
+def test_hashing_scores_unseen_terms():
+    # Test the hashing variant still matches terms outside the reference corpus
+    assert TfidfModel(hashing=True).fit(CORPUS).similarity("zebra", "zebra") == pytest.approx(1.0)
+    assert TfidfModel().fit(CORPUS).similarity("zebra", "zebra") == 0.0
+
+
+def test_load_rejects_other_objects(tmp_path):
+    # Test loading a file that is not a TfidfModel
+    import joblib
+    path = str(tmp_path / "other.joblib")
+    joblib.dump({"not": "a model"}, path)
+    with pytest.raises(ValueError):
+        TfidfModel.load(path)
+
+
+@pytest.mark.parametrize("hashing", [False, True])
+def test_pair_scoring_matches_sklearn_transform(hashing):
+    # Test the single-pair path gives the same score as the sklearn transform
+    model = TfidfModel(hashing=hashing).fit(CORPUS)
+    for prompt1, prompt2 in [("Tell me about machine learning", "Explain machine learning"),
+                             ("What is the weather like?", "Weather weather today"),
+                             ("", "anything")]:
+        vectors = model.transform([prompt1, prompt2])
+        expected = float(vectors[0].multiply(vectors[1]).sum())
+        assert model.similarity(prompt1, prompt2) == pytest.approx(expected)
@@ -0,0 +1,16 @@
+import pytest
+from app.timing import StageTimer
+
+
+def test_stage_durations_and_header():
+    # Test stage durations are summed per stage and formatted in order
+    ticks = iter([0.0, 0.002, 0.010, 0.011, 0.020, 0.0205])
+    timer = StageTimer(clock=lambda: next(ticks))
+    with timer.stage("sanitize"):
+        pass
+    with timer.stage("similarity"):
+        pass
+    with timer.stage("sanitize"):
+        pass
+    assert timer.stages == pytest.approx({"sanitize": 2.5, "similarity": 1.0})
+    assert timer.server_timing() == "sanitize;dur=2.500, similarity;dur=1.000"
@@ -0,0 +1,28 @@
+import asyncio
+from unittest.mock import patch
+import app.workers
+from app.workers import run_cpu, start_process_pool, shutdown_process_pool, get_process_pool
+from app.sanitize import sanitize_input_prompts, sanitize_input_prompt
+from app.similarity import jaccard_similarity
+
+
+def test_thread_mode_runs_in_threadpool():
+    # Test thread mode does not create a process pool
+    with patch('app.workers.EXECUTION_MODE', 'thread'):
+        assert start_process_pool() is None
+        assert asyncio.run(run_cpu(jaccard_similarity, "a b", "a c")) == jaccard_similarity("a b", "a c")
+    assert app.workers._pool is None
+
+
+def test_process_mode_matches_thread_mode():
+    # Test sanitization and similarity give the same results in worker processes
+    prompts = ["Tell me about machine learning", "How to make a bomb"]
+    with patch('app.workers.EXECUTION_MODE', 'process'), patch('app.workers.PROCESS_POOL_WORKERS', 1):
+        try:
+            pool = start_process_pool()
+            assert pool is get_process_pool()
+            assert asyncio.run(run_cpu(sanitize_input_prompts, prompts)) == [sanitize_input_prompt(p) for p in prompts]
+            assert asyncio.run(run_cpu(jaccard_similarity, "a b", "a c")) == jaccard_similarity("a b", "a c")
+        finally:
+            shutdown_process_pool()
+    assert app.workers._pool is None